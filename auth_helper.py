@@ -1,2 +1,118 @@
+import os
+import time
+import hmac
+import hashlib
+from flask import _request_ctx_stack
 from flask_httpauth import HTTPBasicAuth
-auth = HTTPBasicAuth()
\ No newline at end of file
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from cache_helper import TTLCache
+import invalidation_helper
+import user_model
+
+auth = HTTPBasicAuth()
+
+# Cache of verified auth tokens: sha256(token) -> userID. Saves the
+# signature check and the user lookup on every authenticated request.
+# Entries never outlive the token itself and are dropped when the user
+# is updated or deleted, in every worker (see invalidation_helper).
+token_cache = TTLCache('auth_tokens',
+                       max_size=int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 10000)),
+                       ttl=int(os.environ.get('TOKEN_CACHE_TTL', 300)))
+
+# Cache of verified HTTP Basic credentials: HMAC(email, password) -> userID.
+# Saves running the (deliberately slow) password hash on repeat requests.
+# Only the keyed digest is stored, never the password. The HMAC key is
+# random per process, so the digests are useless outside this worker.
+credential_cache = TTLCache('auth_credentials',
+                            max_size=int(os.environ.get('CREDENTIAL_CACHE_MAX_SIZE', 10000)),
+                            ttl=int(os.environ.get('CREDENTIAL_CACHE_TTL', 60)))
+_credential_key = os.urandom(32)
+
+# Bumped when user entries are evicted. A lookup that ran meanwhile is not
+# cached, as it may have read the user before the change committed.
+_generation = [0]
+
+
+def _token_digest(token):
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).hexdigest()
+
+
+def verify_auth_token(token):
+    # Returns the ID of the user the token was issued to, or None if the token
+    # is invalid, expired or belongs to a user that no longer exists.
+    digest = _token_digest(token)
+    userID = token_cache.get(digest)
+    if userID is not None:
+        return userID
+
+    generation = _generation[0]
+    decoded = user_model.User.decode_auth_token(token)
+    if decoded is None:
+        return None
+    userID, expires_at = decoded
+    user = user_model.User.query.get(userID)
+    if user is None:
+        return None
+
+    ttl = min(token_cache.ttl, expires_at - time.time())
+    if generation == _generation[0]:
+        token_cache.set(digest, user.id, ttl=ttl, tags=(('user', user.id),))
+    return user.id
+
+
+def _credential_digest(email, password):
+    # Length-prefix the email so that ('ab', 'c') and ('a', 'bc') differ
+    message = '{}:{}:{}'.format(len(email), email, password).encode('utf-8')
+    return hmac.new(_credential_key, message, hashlib.sha256).hexdigest()
+
+
+def verify_credentials(email, password):
+    # Returns the ID of the user with the given email and password, or None
+    if password is None:
+        return None
+    digest = _credential_digest(email, password)
+    userID = credential_cache.get(digest)
+    if userID is not None:
+        return userID
+
+    generation = _generation[0]
+    user = user_model.User.query.filter_by(email=email).first()
+    if not user or not user.verify_password(password):
+        return None
+
+    if generation == _generation[0]:
+        credential_cache.set(digest, user.id, tags=(('user', user.id),))
+    return user.id
+
+
+def set_current_user_id(userID):
+    # Remembers the authenticated user for the rest of the request. Not on
+    # flask.g, which badmin_api's global app context shares between requests.
+    _request_ctx_stack.top.user_id = userID
+
+
+def current_user_id():
+    # ID of the user that authenticated the current request
+    return getattr(_request_ctx_stack.top, 'user_id', None)
+
+
+def _evict_user(userID):
+    _generation[0] += 1
+    token_cache.invalidate_tag(('user', userID))
+    credential_cache.invalidate_tag(('user', userID))
+
+
+invalidation_helper.register('user', _evict_user, caches=(token_cache, credential_cache))
+
+
+# A changed password (or email) or a deleted user must not keep
+# authenticating from the caches. Every worker, this one included, drops the
+# entries once the change is committed; dropped before, a concurrent request
+# could cache the old password again until the commit.
+@event.listens_for(user_model.User, 'after_update')
+@event.listens_for(user_model.User, 'after_delete')
+def _invalidate_user_auth(mapper, connection, target):
+    invalidation_helper.changed(object_session(target), 'user', target.id)
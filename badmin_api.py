@@ -1,19 +1,29 @@
 import sys
 import os
-import time
-from flask import Flask, jsonify, request, abort, render_template, g
+from flask import Flask, jsonify, request, abort, render_template
 from flask_restful import Api
 from flask_cors import CORS
 import logging, logging.config, yaml
 # Import API resources
-from user_resource import Users, UserPractices
+from user_resource import Users, UserPractices, UserSchedule, UserImport
 from club_resource import Clubs, ClubPractices, ClubPracticesDay
 from practice_resource import Practices
 from decline_notice_resource import DeclineNotice
 from confirm_notice_resource import ConfirmNotice
+from rsvp_resource import RSVPs
+from events_resource import ClubEvents, PracticeEvents
 import user_model
 import club_model
 import practice_model
+import counter_helper
+import timing_helper
+import metrics_helper
+import db_pool_helper
+import replica_helper
+import compression_helper
+import view_cache_helper
+import pubsub_helper
+import invalidation_helper
 # Import DB resources
 from db_helper import db
 from serialization_schemas import ma
@@ -21,6 +31,8 @@ from flask_migrate import Migrate
 
 # Security
 from auth_helper import auth
+import auth_helper
+from cache_helper import caches
 
 app = Flask(__name__)
 migrate = Migrate(app, db)
@@ -32,6 +44,8 @@ api = Api(app)
 api.add_resource(Users, "/user", methods=["GET", "POST"], endpoint="users_all")
 api.add_resource(Users, "/user/<int:userID>", methods=["GET", "PUT"], endpoint="user_with_id")
 api.add_resource(UserPractices, "/user/<int:userID>/practices", methods=["GET"], endpoint="user_practies_with_id")
+api.add_resource(UserSchedule, "/user/<int:userID>/schedule", methods=["GET"], endpoint="user_schedule_with_id")
+api.add_resource(UserImport, "/user/import", methods=["POST"], endpoint="user_import")
 
 api.add_resource(Clubs, "/club", methods=["GET", "POST"], endpoint="clubs_all")
 api.add_resource(Clubs, "/club/<int:clubID>", methods=["GET", "PUT", "DELETE"], endpoint="club_with_id")
@@ -48,26 +62,68 @@ api.add_resource(DeclineNotice, "/declineNotice/<int:declineNoticeID>", methods=
 api.add_resource(ConfirmNotice, "/confirmNotice", methods=["GET", "POST"], endpoint="confirm_notice_all")
 api.add_resource(ConfirmNotice, "/confirmNotice/<int:confirmNoticeID>", methods=["GET", "DELETE"], endpoint="confirm_notice_with_id")
 
+api.add_resource(RSVPs, "/rsvp", methods=["POST"], endpoint="rsvp_batch")
+
+api.add_resource(ClubEvents, "/club/<int:clubID>/events", methods=["GET"], endpoint="club_events")
+api.add_resource(PracticeEvents, "/practice/<int:practiceID>/events", methods=["GET"], endpoint="practice_events")
+
 # Setup database
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-# Heroku postgres have 20 conn limit. Running 4 workers parallel limits each worker to 5 conns.
-app.config['SQLALCHEMY_POOL_SIZE'] = 5
+# Heroku postgres have 20 conn limit. Each of the WEB_CONCURRENCY workers gets
+# its share of DB_CONNECTION_BUDGET, pool overflow included (see db_pool_helper),
+# less the LISTEN connection of the event streams (see pubsub_helper).
+# SQLite (local runs and benchmarks) doesn't use a sized connection pool.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    listeners = 1 if pubsub_helper.uses_listen_connection(app.config['SQLALCHEMY_DATABASE_URI']) else 0
+    app.config.update(db_pool_helper.pool_settings(listeners=listeners))
+    # Under gevent a query only blocks its own greenlet, not the whole worker
+    db_pool_helper.make_psycopg2_green()
+# Optional read replicas for GET handlers (see replica_helper)
+app.config['SQLALCHEMY_BINDS'] = replica_helper.binds()
 db.init_app(app)
 # Tell sqlalchemy that this app is the current app
 app.app_context().push()
+for engine in [db.engine] + replica_helper.engines(db):
+    # 503 instead of a 500 when no connection frees up in time
+    db_pool_helper.guard_pool(engine.pool)
+    # Pool checkout wait and usage for /metrics
+    metrics_helper.instrument_pool(engine.pool)
+
+# Hits, misses and invalidations of the in-process caches for /metrics
+for cache in caches.values():
+    metrics_helper.instrument_cache(cache)
 
 # Marshmallow must be initialized after sqlalchemy
 ma.init_app(app)
 
+# Drop cache entries on the writes of the other workers (see
+# invalidation_helper). Started on the first request rather than on import,
+# so scripts that only import the app (migrations, generate_data) don't.
+@app.before_first_request
+def start_invalidation_listener():
+    invalidation_helper.start()
+
+# Request duration and SQL statements per request (see timing_helper)
 @app.before_request
 def before_request():
-    g.ts_start = time.time()
+    timing_helper.start_request()
+    metrics_helper.start_request()
+
+@app.after_request
+def after_request(response):
+    replica_helper.record_write(response)
+    timing_helper.finish_request(response)
+    # Last, once the body is final
+    return compression_helper.compress_response(response)
 
 @app.teardown_request
 def teardown_request(exception=None):
-    ts_end = time.time()
-    l = logging.getLogger("root")
-    l.info("Request total time {}".format(ts_end - g.ts_start))
+    timing_helper.log_request(exception)
+    metrics_helper.finish_request(exception)
+    # The app context is global and never torn down, so Flask-SQLAlchemy never
+    # removes the session (one per greenlet) itself. Removing it ends the
+    # transaction and returns the connection to the pool.
+    db.session.remove()
 
 if not app.debug:
     # In production mode, log to both stdout and logfile
@@ -79,12 +135,13 @@ def verify_password(useremail_or_token, password):
     if not useremail_or_token:
         return False
     # first try to authenticate by token
-    user = user_model.User.verify_auth_token(useremail_or_token)
-    if not user:
+    userID = auth_helper.verify_auth_token(useremail_or_token)
+    if userID is None:
         # try to authenticate with username/password
-        user = user_model.User.query.filter_by(email=useremail_or_token).first()
-        if not user or not user.verify_password(password):
+        userID = auth_helper.verify_credentials(useremail_or_token, password)
+        if userID is None:
             return False
+    auth_helper.set_current_user_id(userID)
     return True
 
 # API Routes that Flask-Restful API doesn't handle
@@ -95,11 +152,22 @@ def index():
 
 @app.route("/stats")
 def stats():
-    _numUsers = user_model.User.query.count() 
-    _numClubs = club_model.Club.query.count()
-    _numPractices = practice_model.Practice.query.count()
-    _numPlayerPracticeRelationInvited = db.engine.execute("select count(*) from user_invited_practice;").scalar()
-    return render_template('stats.html', numUsers=_numUsers, numClubs=_numClubs, numPractices=_numPractices, numInvited=_numPlayerPracticeRelationInvited)
+    # Counters are maintained on write (see counter_helper), so this is one
+    # small query no matter how big the tables are
+    counters = counter_helper.read_counters()
+    return render_template('stats.html', numUsers=counters['users'], numClubs=counters['clubs'], numPractices=counters['practices'],
+                           numInvited=counters['invited'], numConfirmed=counters['confirmed'], numDeclined=counters['declined'],
+                           numTotal=counters['confirmed'] + counters['declined'])
+
+@app.route("/stats/caches")
+def cache_stats():
+    # Hit/miss counters for the in-process caches of this worker
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format, summed over all gunicorn workers (see metrics_helper)
+    return metrics_helper.metrics_response()
 
 @app.route('/token')
 @auth.login_required
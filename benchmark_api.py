@@ -0,0 +1,313 @@
+"""
+In-process benchmark of every API endpoint.
+
+Generates a dataset with generate_data.py (or uses the data already in
+DATABASE_URL with --no-generate) and drives each endpoint of badmin_api
+through the Flask test client, reads first and then writes. Per endpoint it
+records latency percentiles, the number of SQL statements per request and the
+peak Python memory allocated by a request (measured with tracemalloc on
+separate requests, so tracing doesn't inflate the latencies).
+
+Results are written as JSON (--output). Pass the results of an earlier run
+with --compare to print the change in median latency and statement count per
+endpoint; the run fails if an endpoint got slower than --max-regression.
+
+    python benchmark_api.py --clubs 20 --users 2000 --years 3 --output before.json
+    git checkout my-branch
+    python benchmark_api.py --clubs 20 --users 2000 --years 3 --output after.json --compare before.json
+
+Defaults to an in-memory SQLite DB. Set DATABASE_URL to benchmark a local
+Postgres (migrated and empty, or filled earlier with --no-generate).
+"""
+import os
+import sys
+import json
+import math
+import time
+import base64
+import logging
+import argparse
+import datetime
+import platform
+import subprocess
+import tracemalloc
+from collections import namedtuple, Counter
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'benchmark')
+
+from sqlalchemy import event
+import badmin_api
+import generate_data
+from db_helper import db, user_invited_practice
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+# name: "METHOD /route" shown in the results. url(i) and body(i) give the URL
+# and JSON body of the i-th request. The name of a scenario whose responses
+# create objects is also the key of their IDs in the created dict.
+Scenario = namedtuple('Scenario', ['name', 'method', 'url', 'body'])
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a non-empty list
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def basic_auth(username, password):
+    credentials = '{}:{}'.format(username, password).encode('utf-8')
+    return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+
+
+def sample_ids(num_targets):
+    # IDs to point the scenarios at, picked from the dataset
+    Practice = practice_model.Practice
+    ConfirmNotice = confirm_notice_model.ConfirmNotice
+    DeclineNotice = decline_notice_model.DeclineNotice
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+    practice = Practice.query.filter(Practice.club_id == 1, Practice.startTime >= today)\
+        .order_by(Practice.startTime.asc()).first()
+    if practice is None:
+        sys.exit("The dataset needs practices of club 1 from today on (generate_data.py --weeks-ahead)")
+    # Invites of other users than user 1 without any answer, to answer with
+    # POST /confirmNotice and /declineNotice
+    unanswered = db.session.query(user_invited_practice.c.user_id, user_invited_practice.c.practice_id)\
+        .outerjoin(ConfirmNotice, (ConfirmNotice.user_id == user_invited_practice.c.user_id) &
+                                  (ConfirmNotice.practice_id == user_invited_practice.c.practice_id))\
+        .outerjoin(DeclineNotice, (DeclineNotice.user_id == user_invited_practice.c.user_id) &
+                                  (DeclineNotice.practice_id == user_invited_practice.c.practice_id))\
+        .filter(ConfirmNotice.id.is_(None), DeclineNotice.id.is_(None), user_invited_practice.c.user_id != 1)\
+        .limit(num_targets).all()
+    if len(unanswered) < num_targets:
+        sys.exit("The dataset has only {} unanswered invites, {} are needed".format(len(unanswered), num_targets))
+    # Upcoming practices user 1 is invited to, answered in batches by POST /rsvp
+    upcoming = [practice_id for (practice_id,) in
+                db.session.query(user_invited_practice.c.practice_id).join(Practice)
+                .filter(user_invited_practice.c.user_id == 1, Practice.startTime >= today)
+                .order_by(Practice.startTime.asc()).limit(10)]
+    db.session.rollback()
+    return {'user': 1, 'club': 1, 'practice': practice.id, 'day': practice.startTime.strftime('%Y%m%d'),
+            'week': practice.startTime.isocalendar()[1], 'year': practice.startTime.isocalendar()[0],
+            'confirmNotice': db.session.query(ConfirmNotice.id).order_by(ConfirmNotice.id.asc()).first()[0],
+            'declineNotice': db.session.query(DeclineNotice.id).order_by(DeclineNotice.id.asc()).first()[0],
+            'unanswered': unanswered, 'upcoming': upcoming}
+
+
+def scenarios(ids, created, page_size):
+    timestamp = datetime.datetime.utcnow().isoformat()
+    startTime = (datetime.datetime.utcnow() + datetime.timedelta(days=30)).isoformat()
+    run = int(time.time())
+    page = '?limit={}'.format(page_size)
+
+    def get(route, url):
+        return Scenario('GET ' + route, 'GET', lambda i: url, None)
+
+    return [
+        get('/', '/'),
+        get('/stats', '/stats'),
+        get('/stats/caches', '/stats/caches'),
+        get('/user', '/user' + page),
+        get('/user/<id>', '/user/{}'.format(ids['user'])),
+        get('/user/<id>/practices', '/user/{}/practices'.format(ids['user'])),
+        get('/user/<id>/schedule', '/user/{}/schedule'.format(ids['user'])),
+        get('/club', '/club' + page),
+        get('/club/<id>', '/club/{}'.format(ids['club'])),
+        get('/club/<id>/practicesbyweek', '/club/{}/practicesbyweek?year={}'.format(ids['club'], ids['year'])),
+        get('/club/<id>/practicesbyweek/<week>', '/club/{}/practicesbyweek/{}?year={}'.format(ids['club'], ids['week'], ids['year'])),
+        get('/club/<id>/practicesbydate/<date>', '/club/{}/practicesbydate/{}'.format(ids['club'], ids['day'])),
+        get('/practice', '/practice' + page),
+        get('/practice/<id>', '/practice/{}'.format(ids['practice'])),
+        get('/confirmNotice', '/confirmNotice' + page),
+        get('/confirmNotice/<id>', '/confirmNotice/{}'.format(ids['confirmNotice'])),
+        get('/declineNotice', '/declineNotice' + page),
+        get('/declineNotice/<id>', '/declineNotice/{}'.format(ids['declineNotice'])),
+        get('/token', '/token'),
+        Scenario('POST /user', 'POST', lambda i: '/user',
+                 lambda i: {'name': 'Benchmark {}'.format(i), 'email': 'benchmark{}-{}@example.com'.format(run, i),
+                            'phone': 12345678, 'password': 'foobar'}),
+        Scenario('PUT /user/<id>', 'PUT', lambda i: '/user/{}'.format(created['POST /user'][i]),
+                 lambda i: {'name': 'Benchmark {} renamed'.format(i)}),
+        Scenario('POST /club', 'POST', lambda i: '/club',
+                 lambda i: {'name': 'Benchmark club {}-{}'.format(run, i), 'userID': ids['user']}),
+        Scenario('PUT /club/<id>', 'PUT', lambda i: '/club/{}'.format(created['POST /club'][i]),
+                 lambda i: {'name': 'Benchmark club {}-{} renamed'.format(run, i), 'members': created['POST /user'][:10]}),
+        Scenario('DELETE /club/<id>', 'DELETE', lambda i: '/club/{}'.format(created['POST /club'][i]), None),
+        Scenario('POST /practice', 'POST', lambda i: '/practice',
+                 lambda i: {'club': ids['club'], 'name': 'Benchmark practice {}'.format(i), 'startTime': startTime,
+                            'durationMinutes': 90, 'invited': created['POST /user'][:10], 'repeats': 4}),
+        Scenario('PUT /practice/<id>', 'PUT', lambda i: '/practice/{}'.format(created['POST /practice'][i]),
+                 lambda i: {'name': 'Benchmark practice {} renamed'.format(i), 'invited': created['POST /user'][:5]}),
+        Scenario('DELETE /practice/<id>', 'DELETE', lambda i: '/practice/{}'.format(created['POST /practice'][i]), None),
+        Scenario('POST /confirmNotice', 'POST', lambda i: '/confirmNotice',
+                 lambda i: {'userId': ids['unanswered'][i][0], 'practiceId': ids['unanswered'][i][1], 'timestamp': timestamp}),
+        Scenario('DELETE /confirmNotice/<id>', 'DELETE', lambda i: '/confirmNotice/{}'.format(created['POST /confirmNotice'][i]), None),
+        Scenario('POST /declineNotice', 'POST', lambda i: '/declineNotice',
+                 lambda i: {'userId': ids['unanswered'][i][0], 'practiceId': ids['unanswered'][i][1], 'timestamp': timestamp}),
+        Scenario('DELETE /declineNotice/<id>', 'DELETE', lambda i: '/declineNotice/{}'.format(created['POST /declineNotice'][i]), None),
+        # Flips user 1's answers to the same practices on every request
+        Scenario('POST /rsvp', 'POST', lambda i: '/rsvp',
+                 lambda i: {'timestamp': timestamp,
+                            'answers': [{'practiceId': practiceID, 'status': 'confirmed' if i % 2 == 0 else 'declined'}
+                                        for practiceID in ids['upcoming']]}),
+    ]
+
+
+def uncovered_routes(client_scenarios):
+    # (endpoint, method) pairs of badmin_api that no scenario requested. Call
+    # after the run, the URLs of some scenarios depend on created objects.
+    adapter = badmin_api.app.url_map.bind('localhost')
+    covered = set()
+    for scenario in client_scenarios:
+        endpoint, _ = adapter.match(scenario.url(0).split('?')[0], method=scenario.method)
+        covered.add((endpoint, scenario.method))
+    routes = set((rule.endpoint, method) for rule in badmin_api.app.url_map.iter_rules()
+                 for method in rule.methods - {'HEAD', 'OPTIONS'} if rule.endpoint != 'static')
+    return sorted(routes - covered)
+
+
+class StatementCounter(object):
+    # Counts the SQL statements sent by the engine
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def run_scenario(client, headers, scenario, num_requests, warmup, memory_samples, statements, created):
+    latencies, statement_counts, peak_memory, status = [], [], [], Counter()
+    # Writes can't repeat a request, so they get no warmup
+    iterations = [(None, False)] * (warmup if scenario.method == 'GET' else 0) + \
+                 [(i, False) for i in range(num_requests)] + \
+                 [(i, True) for i in range(num_requests, num_requests + memory_samples)]
+    for i, traced in iterations:
+        index = 0 if i is None else i
+        kwargs = {'headers': headers}
+        if scenario.body is not None:
+            kwargs.update(data=json.dumps(scenario.body(index)), content_type='application/json')
+        if traced:
+            tracemalloc.start()
+        statements_before = statements.count
+        ts_start = time.perf_counter()
+        response = client.open(scenario.url(index), method=scenario.method, **kwargs)
+        response.get_data()
+        latency = time.perf_counter() - ts_start
+        if traced:
+            peak_memory.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        if i is None:
+            continue
+
+        status[str(response.status_code)] += 1
+        if scenario.method == 'POST' and response.status_code == 200:
+            data = json.loads(response.get_data(as_text=True))
+            if isinstance(data, dict) and 'id' in data:
+                created.setdefault(scenario.name, []).append(data['id'])
+        if not traced:
+            latencies.append(latency * 1000)
+            statement_counts.append(statements.count - statements_before)
+
+    return {'requests': num_requests,
+            'status': dict(status),
+            'latency_ms': {'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+                           'p99': percentile(latencies, 99), 'max': max(latencies),
+                           'mean': sum(latencies) / len(latencies)},
+            'sql_statements': {'mean': sum(statement_counts) / float(len(statement_counts)), 'max': max(statement_counts)},
+            'peak_memory_kb': max(peak_memory) / 1024.0 if peak_memory else None}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, max_regression):
+    # Prints the change against the baseline results, returns the names of
+    # endpoints whose median latency grew by more than max_regression
+    regressions = []
+    print("\nCompared to {} ({})".format(baseline.get('commit'), baseline.get('started')))
+    print("{:<40} {:>10} {:>10} {:>8} {:>12}".format('endpoint', 'p50 before', 'p50 now', 'change', 'SQL before/now'))
+    for name, result in results['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            print("{:<40} {:>10} {:>10.2f}".format(name, '-', result['latency_ms']['p50']))
+            continue
+        ratio = result['latency_ms']['p50'] / max(before['latency_ms']['p50'], 1e-6)
+        print("{:<40} {:>10.2f} {:>10.2f} {:>7.2f}x {:>6.1f}/{:<6.1f}".format(
+            name, before['latency_ms']['p50'], result['latency_ms']['p50'], ratio,
+            before['sql_statements']['mean'], result['sql_statements']['mean']))
+        if ratio > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every API endpoint in-process")
+    parser.add_argument('--no-generate', action='store_true', help="use the data already in DATABASE_URL")
+    parser.add_argument('--clubs', type=int, default=10)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--requests', type=int, default=50, help="timed requests per endpoint")
+    parser.add_argument('--page-size', type=int, default=20, help="?limit of the list endpoints")
+    parser.add_argument('--warmup', type=int, default=3, help="untimed requests per GET endpoint")
+    parser.add_argument('--memory-samples', type=int, default=3, help="extra requests per endpoint run with tracemalloc")
+    parser.add_argument('--only', help="only endpoints whose name contains this string (PUT and DELETE need the POST they build on)")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--max-regression', type=float, default=1.5,
+                        help="fail if a median latency grew by more than this factor against --compare")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    dataset = None
+    if not args.no_generate:
+        db.create_all()
+        ts_start = time.time()
+        dataset = generate_data.generate(args.clubs, args.users, args.years)
+        print("Generated {} rows in {:.1f} s".format(sum(dataset.values()), time.time() - ts_start))
+
+    num_targets = args.requests + args.memory_samples
+    ids = sample_ids(num_targets)
+    created = {}
+    client_scenarios = [s for s in scenarios(ids, created, args.page_size) if args.only is None or args.only in s.name]
+
+    client = badmin_api.app.test_client()
+    token = json.loads(client.get('/token', headers=basic_auth('user1@example.com', generate_data.PASSWORD)).get_data(as_text=True))['token']
+    token_headers = basic_auth(token, 'unused')
+    statements = StatementCounter(db.engine)
+
+    results = {'commit': git_commit(), 'started': datetime.datetime.utcnow().isoformat(),
+               'python': platform.python_version(), 'database': db.engine.dialect.name, 'dataset': dataset,
+               'requests': args.requests, 'endpoints': {}}
+    print("{:<40} {:>8} {:>8} {:>8} {:>8} {:>6} {:>10}  {}".format('endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'SQL', 'peak KB', 'status'))
+    for scenario in client_scenarios:
+        # /token is what clients call with Basic auth, everything else uses the token
+        headers = basic_auth('user1@example.com', generate_data.PASSWORD) if scenario.name == 'GET /token' else token_headers
+        result = run_scenario(client, headers, scenario, args.requests, args.warmup, args.memory_samples, statements, created)
+        results['endpoints'][scenario.name] = result
+        latency = result['latency_ms']
+        print("{:<40} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>6.1f} {:>10.1f}  {}".format(
+            scenario.name, latency['p50'], latency['p90'], latency['p99'], latency['max'],
+            result['sql_statements']['mean'], result['peak_memory_kb'] or 0,
+            ' '.join('{}x{}'.format(n, code) for code, n in sorted(result['status'].items()))))
+
+    if args.only is None:
+        for endpoint, method in uncovered_routes(client_scenarios):
+            print("Not benchmarked: {} {}".format(method, endpoint))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("Median latency grew by more than {}x: {}".format(args.max_regression, ', '.join(regressions)))
+            sys.exit(1)
@@ -0,0 +1,90 @@
+"""
+Bytes saved against CPU spent by response compression, per GET endpoint.
+
+Generates a dataset like benchmark_api.py, requests every GET endpoint once
+uncompressed and then, for gzip and brotli (if installed), measures the size
+of the compressed body and the CPU time of compressing it (median of
+--repeat runs), next to the cost of serving the same body from the
+compressed_responses cache of compression_helper instead.
+
+    python benchmark_compression.py --clubs 20 --users 2000 --years 3
+    COMPRESSION_GZIP_LEVEL=9 COMPRESSION_BROTLI_QUALITY=9 python benchmark_compression.py --output level9.json
+
+Endpoints below COMPRESSION_MIN_SIZE are listed but sent uncompressed by the
+API.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'benchmark')
+
+import badmin_api
+import generate_data
+import compression_helper
+from db_helper import db
+from benchmark_api import percentile, basic_auth, sample_ids, scenarios
+
+
+def cpu_ms(f, repeat):
+    # Median CPU time of f() in milliseconds
+    times = []
+    for _ in range(repeat):
+        ts_start = time.process_time()
+        f()
+        times.append(time.process_time() - ts_start)
+    return percentile(times, 50) * 1000
+
+
+def measure(body, encoding, repeat):
+    compressed = compression_helper.compress(body, encoding)
+    compression_helper.compress_cached(body, encoding)
+    return {'bytes': len(compressed),
+            'saved_percent': round(100.0 * (1 - float(len(compressed)) / len(body)), 1) if body else 0,
+            'compress_cpu_ms': round(cpu_ms(lambda: compression_helper.compress(body, encoding), repeat), 3),
+            'cached_cpu_ms': round(cpu_ms(lambda: compression_helper.compress_cached(body, encoding), repeat), 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure response compression per GET endpoint")
+    parser.add_argument('--no-generate', action='store_true', help="use the data already in DATABASE_URL")
+    parser.add_argument('--clubs', type=int, default=10)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--page-size', type=int, default=50, help="limit of the paginated list endpoints")
+    parser.add_argument('--repeat', type=int, default=20, help="compressions per endpoint and encoding")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if not args.no_generate:
+        db.create_all()
+        generate_data.generate(args.clubs, args.users, args.years)
+    client = badmin_api.app.test_client()
+    credentials = basic_auth('user1@example.com', generate_data.PASSWORD)
+    token = json.loads(client.get('/token', headers=credentials).get_data(as_text=True))['token']
+    headers = dict(basic_auth(token, 'unused'), **{'Accept-Encoding': 'identity'})
+
+    results = {'min_size': compression_helper.MIN_SIZE, 'gzip_level': compression_helper.GZIP_LEVEL,
+               'brotli_quality': compression_helper.BROTLI_QUALITY, 'endpoints': {}}
+    encodings = compression_helper.encodings()[::-1]
+    print("{:<40} {:>9}".format('endpoint', 'bytes') +
+          ''.join(" {:>9} {:>6} {:>9} {:>9}".format(e + ' bytes', 'saved', 'cpu ms', 'cached ms') for e in encodings))
+    for scenario in scenarios(sample_ids(1), {}, args.page_size):
+        if scenario.method != 'GET':
+            continue
+        response = client.get(scenario.url(0), headers=credentials if scenario.name == 'GET /token' else headers)
+        body = response.get_data()
+        result = {'bytes': len(body), 'status': response.status_code}
+        result.update({encoding: measure(body, encoding, args.repeat) for encoding in encodings})
+        results['endpoints'][scenario.name] = result
+        print("{:<40} {:>9}".format(scenario.name, len(body)) + ''.join(
+            " {bytes:>9} {saved_percent:>5.1f}% {compress_cpu_ms:>9.3f} {cached_cpu_ms:>9.3f}".format(**result[encoding])
+            for encoding in encodings))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
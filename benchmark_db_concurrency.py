@@ -0,0 +1,162 @@
+"""
+Benchmark of how many requests one gevent worker keeps in the database at
+once, with psycopg2 blocking and with the gevent wait callback of
+db_pool_helper.
+
+Runs --concurrency greenlets in one process, each sending --requests requests
+to --path through the Flask test client, like the greenlets of one gunicorn
+gevent worker. With blocking psycopg2 a query holds the whole process, so
+only one statement is ever in flight and throughput doesn't grow with the
+concurrency; with the wait callback the others keep running while a query
+waits for Postgres. Per mode it prints requests per second, latency
+percentiles, the time requests waited for a pooled connection and the peak
+number of statements in flight at the same time. Latency is end to end, from
+when a request is due until its response, including the time its greenlet
+waited to run; by Little's law the mean is about concurrency / throughput in
+both modes.
+
+--db-latency adds a pg_sleep before every statement, to stand in for the
+network round trip to a remote database (Heroku Postgres is not on the same
+host as the dynos).
+
+    DATABASE_URL=postgresql://localhost/badmin_bench python benchmark_db_concurrency.py --concurrency 20 --db-latency 5
+
+Needs a Postgres database with data (generate_data.py) and user 1 with the
+password 'foobar'. The pool is sized like one of WEB_CONCURRENCY workers
+(db_pool_helper.pool_settings).
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+# Switched per mode below, not on import of badmin_api
+os.environ['DB_GEVENT'] = 'off'
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'benchmark')
+
+import gevent
+import psycopg2.extensions
+from sqlalchemy import event
+import badmin_api
+import db_pool_helper
+import timing_helper
+from db_helper import db
+from benchmark_api import percentile, basic_auth
+import generate_data
+
+
+"""
+Counts the statements in flight on an engine and the peak of them. With
+latency > 0 every statement is preceded by a pg_sleep of that many seconds on
+the same connection.
+"""
+class InFlightCounter(object):
+
+    def __init__(self, engine, latency=0.0):
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def reset(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        if self.latency:
+            # Straight on the DBAPI cursor, so it isn't counted as a statement
+            cursor.execute("SELECT pg_sleep(%s)", (self.latency,))
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.in_flight -= 1
+
+    def _handle_error(self, exception_context):
+        self.in_flight -= 1
+
+
+def run_mode(client, headers, path, concurrency, num_requests):
+    durations, pool_waits, statuses = [], [], {}
+    # Pool waits are only known inside the request, pick them up on teardown
+    @badmin_api.app.teardown_request
+    def record_pool_wait(exception=None):
+        timing = timing_helper.current()
+        if timing is not None:
+            pool_waits.append(timing.pool_wait)
+
+    def worker(ts_due):
+        # Each request is timed from when it is due: the start of the run for
+        # the first, the end of the previous one after that. A greenlet may
+        # only get to run much later (in blocking mode, not before the query
+        # of another greenlet is done); that wait counts, as it would for a
+        # client of the worker.
+        for _ in range(num_requests):
+            response = client.get(path, headers=headers)
+            ts_end = time.time()
+            durations.append(ts_end - ts_due)
+            ts_due = ts_end
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            # A gunicorn greenlet yields while it writes the response and
+            # reads the next request. Without that the greenlet that just
+            # returned its connection takes it straight back, and the ones
+            # waiting in the pool time out.
+            gevent.sleep(0)
+
+    ts_start = time.time()
+    gevent.joinall([gevent.spawn(worker, ts_start) for _ in range(concurrency)], raise_error=True)
+    elapsed = time.time() - ts_start
+    badmin_api.app.teardown_request_funcs[None].remove(record_pool_wait)
+    return {'requests': len(durations),
+            'statuses': statuses,
+            'requests_per_second': round(len(durations) / elapsed, 1),
+            'p50_ms': round(percentile(durations, 50) * 1000, 1),
+            'p95_ms': round(percentile(durations, 95) * 1000, 1),
+            'pool_wait_p95_ms': round(percentile(pool_waits, 95) * 1000, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare blocking and gevent-cooperative psycopg2 under concurrent requests")
+    parser.add_argument('--path', default='/practice/1', help="URL requested by all greenlets")
+    parser.add_argument('--concurrency', type=int, default=20, help="greenlets sending requests at the same time")
+    parser.add_argument('--requests', type=int, default=20, help="requests per greenlet")
+    parser.add_argument('--db-latency', type=float, default=0, help="extra latency per statement in milliseconds")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if db.engine.dialect.name != 'postgresql':
+        sys.exit("DATABASE_URL must point at a Postgres database; the gevent wait callback is psycopg2 only")
+    counter = InFlightCounter(db.engine, args.db_latency / 1000.0)
+    client = badmin_api.app.test_client()
+    response = client.get('/token', headers=basic_auth('user1@example.com', generate_data.PASSWORD))
+    if response.status_code != 200:
+        sys.exit("Could not log in as user1@example.com: {}".format(response.get_data(as_text=True)))
+    headers = basic_auth(json.loads(response.get_data(as_text=True))['token'], 'unused')
+    # As badmin_api sized it, less the LISTEN connection if there is one
+    settings = {key: badmin_api.app.config[key] for key in ('SQLALCHEMY_POOL_SIZE', 'SQLALCHEMY_MAX_OVERFLOW', 'SQLALCHEMY_POOL_TIMEOUT')}
+    print("Pool per worker: {SQLALCHEMY_POOL_SIZE} + {SQLALCHEMY_MAX_OVERFLOW} overflow, timeout {SQLALCHEMY_POOL_TIMEOUT} s".format(**settings))
+
+    results = {}
+    for mode, wait_callback in (('blocking', None), ('gevent', db_pool_helper.gevent_wait_callback)):
+        psycopg2.extensions.set_wait_callback(wait_callback)
+        # Start each mode with an empty pool. dispose() replaces the pool, so
+        # guard the new one as badmin_api does (503s, pool wait timing).
+        db.engine.dispose()
+        db_pool_helper.guard_pool(db.engine.pool)
+        counter.reset()
+        results[mode] = run_mode(client, headers, args.path, args.concurrency, args.requests)
+        results[mode]['peak_statements_in_flight'] = counter.peak
+        print("{:<9} {requests_per_second:>8} req/s  p50 {p50_ms:>7} ms  p95 {p95_ms:>7} ms  "
+              "pool wait p95 {pool_wait_p95_ms:>7} ms  peak in flight {peak_statements_in_flight:>3}  {statuses}".format(mode, **results[mode]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'pool': settings, 'results': results}, f, indent=2)
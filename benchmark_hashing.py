@@ -0,0 +1,74 @@
+"""
+Benchmark: latency of an unrelated endpoint while the same gevent worker is
+busy hashing passwords (e.g. a signup burst).
+
+Serves the app with gevent's WSGIServer, starts a number of greenlets that
+hash passwords back to back, and measures GET / latency from another greenlet
+for the given hashing pool modes (default: all). Run with:
+
+    python benchmark_hashing.py [storm_greenlets] [requests] [mode ...]
+
+Expect the inline mode to take minutes: every yield of the request greenlet
+waits for a full round of hashes.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+import time
+import logging
+import gevent
+from gevent.pywsgi import WSGIServer
+from urllib.request import urlopen
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'benchmark')
+
+import badmin_api
+import hashing_helper
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def run(mode, url, storm_greenlets, requests):
+    hashing_helper.pool = hashing_helper.HashingPool(mode=mode, size=2, max_queue=storm_greenlets)
+    running = [True]
+
+    def storm():
+        while running[0]:
+            hashing_helper.hash_password('benchmark')
+            # A real request yields on socket I/O between hashes
+            gevent.sleep(0)
+
+    storms = [gevent.spawn(storm) for _ in range(storm_greenlets)]
+    gevent.sleep(0.1)
+    latencies = []
+    for _ in range(requests):
+        ts_start = time.time()
+        urlopen(url).read()
+        latencies.append((time.time() - ts_start) * 1000)
+    running[0] = False
+    gevent.joinall(storms)
+    return latencies
+
+
+if __name__ == "__main__":
+    storm_greenlets = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    logging.disable(logging.INFO)
+
+    server = WSGIServer(('127.0.0.1', 0), badmin_api.app, log=None)
+    server.start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    print("GET / latency (ms) with {} greenlets hashing passwords".format(storm_greenlets))
+    print("{:<8} {:>8} {:>8} {:>8} {:>8}".format('mode', 'p50', 'p95', 'p99', 'max'))
+    for mode in sys.argv[3:] or ('inline', 'thread', 'process'):
+        latencies = run(mode, url, storm_greenlets, requests)
+        print("{:<8} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(mode, percentile(latencies, 50), percentile(latencies, 95),
+                                                             percentile(latencies, 99), max(latencies)))
+    server.stop()
@@ -0,0 +1,87 @@
+"""
+Benchmark: marshmallow PracticeSchema.dump vs. the compiled serializer in
+fast_serialization on a list of practices with invites and notices.
+
+Seeds an in-memory SQLite DB (or DATABASE_URL if set), loads all practices
+once and times only the serialization. Run with:
+
+    python benchmark_serialization.py [practices] [rounds]
+"""
+import os
+import sys
+import time
+import json
+import random
+import logging
+import datetime
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'benchmark')
+
+from sqlalchemy.orm import subqueryload
+import badmin_api
+import fast_serialization
+from db_helper import db, user_invited_practice
+from serialization_schemas import PracticeSchema
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+
+def seed(num_practices, num_users=30):
+    db.create_all()
+    rnd = random.Random(42)
+    db.engine.execute(db.metadata.tables['user'].insert(),
+                      [{'id': i, 'name': 'User {}'.format(i), 'email': 'user{}@example.com'.format(i), 'phone': 12345678}
+                       for i in range(1, num_users + 1)])
+    db.engine.execute(db.metadata.tables['club'].insert(), [{'id': 1, 'name': 'Benchmark club'}])
+
+    start = datetime.datetime(2017, 1, 2, 18, 0)
+    practices, invites, confirms, declines = [], [], [], []
+    for practiceID in range(1, num_practices + 1):
+        practices.append({'id': practiceID, 'name': 'Practice {}'.format(practiceID), 'club_id': 1,
+                          'startTime': start + datetime.timedelta(days=practiceID), 'durationMinutes': 120})
+        for userID in range(1, num_users + 1):
+            invites.append({'user_id': userID, 'practice_id': practiceID})
+            answer = rnd.random()
+            if answer < 0.5:
+                confirms.append({'user_id': userID, 'practice_id': practiceID, 'timestamp': start})
+            elif answer < 0.7:
+                declines.append({'user_id': userID, 'practice_id': practiceID, 'timestamp': start})
+    db.engine.execute(practice_model.Practice.__table__.insert(), practices)
+    db.engine.execute(user_invited_practice.insert(), invites)
+    db.engine.execute(confirm_notice_model.ConfirmNotice.__table__.insert(), confirms)
+    db.engine.execute(decline_notice_model.DeclineNotice.__table__.insert(), declines)
+
+
+def best_of(rounds, fn):
+    timings = []
+    for _ in range(rounds):
+        ts_start = time.time()
+        result = fn()
+        timings.append(time.time() - ts_start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    num_practices = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    logging.disable(logging.INFO)
+
+    seed(num_practices)
+    practices = practice_model.Practice.query.options(subqueryload('invited'))\
+        .order_by(practice_model.Practice.startTime.asc()).all()
+
+    schema = PracticeSchema(many=True)
+    plan = fast_serialization.compile_schema(schema)
+
+    marshmallow_time, marshmallow_data = best_of(rounds, lambda: schema.dump(practices).data)
+    compiled_time, compiled_data = best_of(rounds, lambda: [plan(p) for p in practices])
+
+    identical = json.dumps(marshmallow_data, sort_keys=True) == json.dumps(compiled_data, sort_keys=True)
+    print("Serializing {} practices (best of {})".format(len(practices), rounds))
+    print("marshmallow: {:8.1f} ms".format(marshmallow_time * 1000))
+    print("compiled:    {:8.1f} ms ({:.1f}x)".format(compiled_time * 1000, marshmallow_time / compiled_time))
+    print("identical output: {}".format(identical))
+    if not identical:
+        sys.exit(1)
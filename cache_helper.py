@@ -0,0 +1,109 @@
+import time
+import threading
+from collections import OrderedDict
+
+# All caches created in this process, by name. Used to expose hit/miss
+# counters (see the /stats/caches route in badmin_api).
+caches = {}
+
+
+"""
+Bounded in-process cache with LRU eviction and a per-entry time-to-live.
+
+Entries can be tagged (e.g. with ('user', 42)) so that everything derived
+from some entity can be dropped in one call when that entity changes. The
+cache is guarded by a lock, which gevent monkey-patches into a cooperative
+lock when running under the gevent gunicorn worker.
+"""
+class TTLCache(object):
+
+    def __init__(self, name, max_size=1024, ttl=60):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # key -> (expires_at, value, tags)
+        self._entries = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= time.time():
+                self._remove(key)
+                self.evictions += 1
+                self.misses += 1
+                return default
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=()):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            keys = self._tags.pop(tag, ())
+            for key in list(keys):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'maxSize': self.max_size,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hitRatio': float(self.hits) / lookups if lookups > 0 else 0.0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Must be called with self._lock held
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._tags[tag]
@@ -0,0 +1,117 @@
+"""
+Query plan regression check for the hot queries of the API.
+
+Runs EXPLAIN on each hot query against the database in DATABASE_URL and fails
+(exit code 1) if any of them reads a table with a sequential scan, i.e. if an
+index the query relies on is missing or can no longer be used.
+
+On Postgres the check runs with enable_seqscan = off, so the planner picks an
+index whenever one is usable, no matter how few rows the local tables hold.
+Migrate the database first (flask db upgrade). SQLite works too (EXPLAIN QUERY
+PLAN), with --create to create the schema from the models:
+
+    DATABASE_URL=postgresql://localhost/badmin_test python check_query_plans.py
+    DATABASE_URL=sqlite:///plans.db python check_query_plans.py --create
+"""
+import os
+import re
+import sys
+import logging
+import datetime
+
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'check_query_plans')
+
+from sqlalchemy import and_, or_
+import badmin_api
+from db_helper import db, user_invited_practice, user_member_club, user_admin_club, user_coach_club, user_membershiprequest_club
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+import user_resource
+
+
+def hot_queries():
+    # (description, query) pairs, written the way the resources query
+    Practice = practice_model.Practice
+    ConfirmNotice = confirm_notice_model.ConfirmNotice
+    DeclineNotice = decline_notice_model.DeclineNotice
+    week_start = datetime.datetime(2017, 8, 21)
+
+    queries = [
+        ('practices of a club by week/date',
+         Practice.query.filter(Practice.club_id == 1,
+                               Practice.startTime >= week_start,
+                               Practice.startTime < week_start + datetime.timedelta(weeks=1))
+                       .order_by(Practice.startTime.asc())),
+        ('practice list page after cursor',
+         Practice.query.filter(or_(Practice.startTime > week_start,
+                                   and_(Practice.startTime == week_start, Practice.id > 1)))
+                       .order_by(Practice.startTime.asc(), Practice.id.asc()).limit(51)),
+        ('confirm notice of user for practice',
+         ConfirmNotice.query.filter(ConfirmNotice.user_id == 1, ConfirmNotice.practice_id == 1)),
+        ('decline notice of user for practice',
+         DeclineNotice.query.filter(DeclineNotice.user_id == 1, DeclineNotice.practice_id == 1)),
+        ('confirm notices of practice', ConfirmNotice.query.filter(ConfirmNotice.practice_id == 1)),
+        ('decline notices of practice', DeclineNotice.query.filter(DeclineNotice.practice_id == 1)),
+        ('invitees of practice',
+         db.session.query(user_invited_practice).filter(user_invited_practice.c.practice_id == 1)),
+        ('practices user is invited to',
+         db.session.query(user_invited_practice).filter(user_invited_practice.c.user_id == 1)),
+        ('upcoming practices of user', user_resource.upcoming_practices(1, week_start)),
+        ('schedule page of user',
+         user_resource.schedule_query(1, week_start, week_start + datetime.timedelta(days=28))
+                      .order_by(Practice.startTime.asc(), Practice.id.asc()).limit(51)),
+    ]
+    for table in (user_member_club, user_admin_club, user_coach_club, user_membershiprequest_club):
+        queries.append(('{} by club'.format(table.name), db.session.query(table).filter(table.c.club_id == 1)))
+        queries.append(('{} by user'.format(table.name), db.session.query(table).filter(table.c.user_id == 1)))
+    return queries
+
+
+def explain(cursor, dialect, query):
+    compiled = query.statement.compile(dialect=dialect)
+    if compiled.positional:
+        params = [compiled.params[name] for name in compiled.positiontup]
+    else:
+        params = compiled.params
+    if dialect.name == 'postgresql':
+        cursor.execute('EXPLAIN ' + str(compiled), params)
+        return [row[0] for row in cursor.fetchall()]
+    cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def sequential_scans(dialect, plan):
+    if dialect.name == 'postgresql':
+        return [line.strip() for line in plan if 'Seq Scan' in line]
+    # SQLite: "SCAN TABLE x" reads the whole table, "SCAN TABLE x USING INDEX"
+    # and "SEARCH TABLE x USING ..." don't. Scans of subquery results
+    # (SUBQUERY n, anon_n) are not table reads.
+    return [line for line in plan
+            if re.match(r'SCAN (TABLE )?(?!anon_)\w+', line) and 'USING' not in line and 'SUBQUERY' not in line]
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    if '--create' in sys.argv:
+        db.create_all()
+
+    connection = db.session.connection()
+    dialect = connection.dialect
+    cursor = connection.connection.cursor()
+    if dialect.name == 'postgresql':
+        cursor.execute('SET enable_seqscan = off')
+
+    failures = 0
+    for description, query in hot_queries():
+        plan = explain(cursor, dialect, query)
+        scans = sequential_scans(dialect, plan)
+        print("{:<6} {}".format('FAIL' if scans else 'ok', description))
+        for line in scans:
+            print("         " + line)
+        failures += len(scans) > 0
+
+    db.session.rollback()
+    if failures > 0:
+        print("{} hot queries fall back to a sequential scan".format(failures))
+        sys.exit(1)
@@ -4,6 +4,8 @@ from db_helper import user_member_club, user_admin_club, user_coach_club, user_m
 class Club(db.Model):
     id = db.Column(db.Integer, primary_key=True, unique=True, nullable=False)
     name = db.Column(db.String(500), unique=True, nullable=False)
+    # Bumped on every write that changes the JSON of the club (see version_helper)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     members = db.relationship('User', secondary=user_member_club, backref=db.backref('clubs', lazy='dynamic'))
     admins = db.relationship('User', secondary=user_admin_club, backref=db.backref('adminOfClubs', lazy='dynamic'))
     coaches = db.relationship('User', secondary=user_coach_club, backref=db.backref('coachInClubs', lazy='dynamic'))
@@ -8,13 +8,19 @@ import datetime
 from validation_schemas import ClubValidationSchema
 # Imports for serialization (marshmallow)
 from serialization_schemas import ClubSchema, PracticeSchema
+import fast_serialization
+import pagination_helper
+import view_cache_helper
+import version_helper
 import user_model
 import club_model
 import practice_model
 # Imports for DB connection
 from sqlalchemy.exc import IntegrityError
 from db_helper import db
+from resolver_helper import resolver
 from auth_helper import auth
+import replica_helper
 
 
 """
@@ -29,17 +35,27 @@ class Clubs(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, clubID=None):
         if clubID:
             # clubID type (must be int) is enforced by Flask-RESTful
             club = club_model.Club.query.get(clubID)
             if club is None:
                 abort(404, message="Club with ID {} does not exist.".format(clubID))
-            return jsonify(self.club_schema.dump(club).data)
+            # Answer 304 from the version, before serializing the club
+            etag = version_helper.etag(club)
+            not_modified = version_helper.not_modified(etag)
+            if not_modified is not None:
+                return not_modified
+            return version_helper.with_etag(jsonify(fast_serialization.dump(self.club_schema, club)), etag)
         else:
-            # Get on club resource lists all clubs
-            clubs = club_model.Club.query.filter(1==1).all()
-            return jsonify(self.clubs_schema.dump(clubs).data)
+            # Get on club resource lists all clubs, one page at a time or
+            # streamed in full
+            if pagination_helper.stream_requested():
+                return pagination_helper.streamed_response(club_model.Club.query, [club_model.Club.id],
+                                                           lambda clubs: fast_serialization.dump(self.clubs_schema, clubs))
+            clubs, next_cursor = pagination_helper.paginate(club_model.Club.query, [club_model.Club.id])
+            return pagination_helper.paginated_response(fast_serialization.dump(self.clubs_schema, clubs), next_cursor)
 
     @auth.login_required
     def post(self):
@@ -49,7 +65,7 @@ class Clubs(Resource):
             abort(400, message="The reqeust input could bot be validated. There were the following validation errors: {}".format(errors))
 
         # Extra input validation: creatingUserID must be ID of existing user
-        creatingUser = user_model.User.query.get(request.json['userID'])
+        creatingUser = resolver().get(user_model.User, request.json['userID'])
         if creatingUser is None:
             abort(400, message="User with ID {} does not exist.".format(request.json['userID']))
 
@@ -76,13 +92,20 @@ class Clubs(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.club_schema.dump(club).data)
+        return jsonify(fast_serialization.dump(self.club_schema, club))
 
     @auth.login_required
     def put(self, clubID):
         # Input validation using Marshmallow. No parameter is actually required
         # in the PUT (update) request, since we do partical/relative update.
         # clubID type is enforced by Flask-RESTful
+        # All user IDs in the request are loaded with one query, shared by
+        # the validators and the updates below.
+        if isinstance(request.json, dict):
+            for attr in ('admins', 'coaches', 'membershipRequests', 'members'):
+                if isinstance(request.json.get(attr), list):
+                    # Anything but an int is left to the validation errors
+                    resolver().collect(user_model.User, [id for id in request.json[attr] if isinstance(id, int)])
         _, errors = self.club_validation_schema.load(request.json, partial=('name',))
         if len(errors) > 0:
             abort(400, message="The reqeust input could bot be validated. There were the following validation errors: {}".format(errors))
@@ -100,39 +123,19 @@ class Clubs(Resource):
 
         # Fecth all admins and add to club
         if 'admins' in request.json:
-            user_objects = []
-            for userID in request.json['admins']:
-                u = user_model.User.query.get(userID)
-                if u is not None:
-                    user_objects.append(u)
-            club.admins = user_objects
+            club.admins = resolver().get_many(user_model.User, request.json['admins'])
 
         # Fecth all coaches and add to club
         if 'coaches' in request.json:
-            user_objects = []
-            for userID in request.json['coaches']:
-                u = user_model.User.query.get(userID)
-                if u is not None:
-                    user_objects.append(u)
-            club.coaches = user_objects
+            club.coaches = resolver().get_many(user_model.User, request.json['coaches'])
 
         # Fecth all membersipRequest users and add to club
         if 'membershipRequests' in request.json:
-            user_objects = []
-            for userID in request.json['membershipRequests']:
-                u = user_model.User.query.get(userID)
-                if u is not None:
-                    user_objects.append(u)
-            club.membershipRequests = user_objects
+            club.membershipRequests = resolver().get_many(user_model.User, request.json['membershipRequests'])
 
         # Fecth all members and add to club
         if 'members' in request.json:
-            user_objects = []
-            for userID in request.json['members']:
-                u = user_model.User.query.get(userID)
-                if u is not None:
-                    user_objects.append(u)
-            club.members = user_objects
+            club.members = resolver().get_many(user_model.User, request.json['members'])
 
         try:
             db.session.commit()
@@ -142,7 +145,7 @@ class Clubs(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.club_schema.dump(club).data)
+        return jsonify(fast_serialization.dump(self.club_schema, club))
 
     @auth.login_required
     def delete(self, practiceID):
@@ -159,24 +162,69 @@ class ClubPractices(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, clubID, weekNumber=None, todayDate=None):
+        # Weeks are ISO weeks. The year is the ISO week-year, which differs
+        # from the calendar year around new year (e.g. 2021-01-03 is in week
+        # 53 of 2020). Defaults to the current ISO week-year.
+        year = self._int_arg('year', datetime.date.today().isocalendar()[0])
+        # The last week of a year ends in the next one, which must still be a
+        # valid date
+        if not 1 <= year <= 9998:
+            abort(400, message="Parameter year must be between 1 and 9998. Input was: {}".format(year))
+
         if weekNumber:
-            now = datetime.datetime.now()
-            weekStart = datetime.datetime.strptime(str(now.year)+'-'+str(weekNumber)+'-1', "%G-%V-%u")
-            weekEnd = datetime.datetime.strptime(str(now.year)+'-'+str(weekNumber)+'-7', "%G-%V-%u")
-            practices = practice_model.Practice.query.\
-                filter(practice_model.Practice.club_id == clubID,
-                       practice_model.Practice.startTime >= weekStart,
-                       practice_model.Practice.startTime <= weekEnd)\
-                .order_by(practice_model.Practice.startTime.asc())\
-                .all()
-            return jsonify(self.practices_schema.dump(practices).data)
+            weekStart = self._week_start(year, weekNumber)
+            etag, data = view_cache_helper.cached_practices(
+                view_cache_helper.week_tag(clubID, weekStart),
+                lambda: self._practices_between(clubID, weekStart, weekStart + datetime.timedelta(weeks=1)),
+                lambda practices: fast_serialization.dump(self.practices_schema, practices))
+            return version_helper.not_modified(etag) or version_helper.with_etag(jsonify(data), etag)
         if todayDate:
             pass
         else:
-            # TODO: Do the same as above with weeknember, but wrap in for loop 
-            # for and do for all weeks in year. return [week1:[prac1, prac2, ..], week2:[prac1, prac2, ..]]
-            abort(501, message="Not implemented yet. GET /club/<id>/practicesbyweek/<weeknumber> with a specific week instead.")
+            # All weeks of the year (or ?fromWeek=..&toWeek=..) as
+            # {week number: [practices]}, from one range query grouped here.
+            weeksInYear = self._weeks_in_year(year)
+            fromWeek = self._int_arg('fromWeek', 1)
+            toWeek = self._int_arg('toWeek', weeksInYear)
+            if not 1 <= fromWeek <= toWeek <= weeksInYear:
+                abort(400, message="Weeks must satisfy 1 <= fromWeek <= toWeek <= {} for year {}. Input was: fromWeek={}, toWeek={}".format(weeksInYear, year, fromWeek, toWeek))
+
+            practices = self._practices_between(clubID, self._week_start(year, fromWeek),
+                                                self._week_start(year, toWeek) + datetime.timedelta(weeks=1))
+            weeks = {week: [] for week in range(fromWeek, toWeek + 1)}
+            for practice, data in zip(practices, fast_serialization.dump(self.practices_schema, practices)):
+                weeks[practice.startTime.isocalendar()[1]].append(data)
+            return jsonify(weeks)
+
+    def _int_arg(self, name, default):
+        try:
+            return int(request.args.get(name, default))
+        except ValueError:
+            abort(400, message="Parameter {} must be an integer. Input was: {}".format(name, request.args.get(name)))
+
+    def _weeks_in_year(self, year):
+        # 52 or 53; December 28 is always in the last ISO week
+        return datetime.date(year, 12, 28).isocalendar()[1]
+
+    def _week_start(self, year, weekNumber):
+        # Monday 00:00 of the ISO week. strptime would take week 53 of a
+        # 52-week year as week 1 of the next year.
+        if not 1 <= weekNumber <= self._weeks_in_year(year):
+            abort(400, message="Week {} of year {} does not exist. The year has {} weeks.".format(weekNumber, year, self._weeks_in_year(year)))
+        try:
+            return datetime.datetime.strptime('{}-{}-1'.format(year, weekNumber), "%G-%V-%u")
+        except ValueError:
+            abort(400, message="Week {} of year {} does not exist.".format(weekNumber, year))
+
+    def _practices_between(self, clubID, start, end):
+        return practice_model.Practice.query.\
+            filter(practice_model.Practice.club_id == clubID,
+                   practice_model.Practice.startTime >= start,
+                   practice_model.Practice.startTime < end)\
+            .order_by(practice_model.Practice.startTime.asc())\
+            .all()
 
 """
 Resource for handling club specific requests for a specific date
@@ -190,6 +238,7 @@ class ClubPracticesDay(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, clubID, date=None):
         if date:
             # TODO: Proper sanity check input
@@ -197,14 +246,20 @@ class ClubPracticesDay(Resource):
             if len(str(date)) == 8:
                 day_start = datetime.datetime.strptime(str(date), "%Y%m%d")
                 day_end = day_start + datetime.timedelta(hours=23, minutes=59)
-                practices = practice_model.Practice.query.\
-                    filter(practice_model.Practice.club_id == clubID,
-                           practice_model.Practice.startTime >= day_start,
-                           practice_model.Practice.startTime <= day_end)\
-                    .order_by(practice_model.Practice.startTime.asc())\
-                    .all()
-                return jsonify(self.practices_schema.dump(practices).data)
+                etag, data = view_cache_helper.cached_practices(
+                    view_cache_helper.day_tag(clubID, day_start),
+                    lambda: self._practices_between(clubID, day_start, day_end),
+                    lambda practices: fast_serialization.dump(self.practices_schema, practices))
+                return version_helper.not_modified(etag) or version_helper.with_etag(jsonify(data), etag)
             else:
                 abort(400, message="Bad date format. Should be YYYYmmdd, e.g. 20170720")
         else:
-            abort(501, message="Not implemented yet. GET /club/<id>/practicesbydate/<date> with a specific week instead.")
\ No newline at end of file
+            abort(501, message="Not implemented yet. GET /club/<id>/practicesbydate/<date> with a specific week instead.")
+
+    def _practices_between(self, clubID, start, end):
+        return practice_model.Practice.query.\
+            filter(practice_model.Practice.club_id == clubID,
+                   practice_model.Practice.startTime >= start,
+                   practice_model.Practice.startTime <= end)\
+            .order_by(practice_model.Practice.startTime.asc())\
+            .all()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import gzip
+import hashlib
+from flask import request
+from cache_helper import TTLCache
+
+# Optional: without the brotli package only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this (bytes) are sent as they are; below about a
+# kilobyte the compressed body plus headers hardly saves anything.
+MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# gzip level 1-9 and brotli quality 0-11. The defaults are the usual
+# on-the-fly settings: most of the saving for a fraction of the CPU.
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+# Compressed bodies by (encoding, blake2b digest of the body). Identical
+# payloads (a cached practice list, the same page requested by many clients)
+# are compressed once; hashing the body costs a fraction of compressing it.
+compressed_cache = TTLCache('compressed_responses',
+                            max_size=int(os.environ.get('COMPRESSION_CACHE_MAX_SIZE', 512)),
+                            ttl=int(os.environ.get('COMPRESSION_CACHE_TTL', 300)))
+
+
+"""
+Negotiated compression of responses (Accept-Encoding: br or gzip).
+
+compress_response() runs as an after_request hook on every response of
+badmin_api. It leaves alone responses that are small, streamed, not text or
+JSON, not 200, or already encoded, and it adds Vary: Accept-Encoding so that
+caches in between keep the variants apart.
+"""
+
+
+def encodings():
+    # Encodings offered, in order of preference
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def etag_variants(etag):
+    # ETags of the compressed variants of a response, in encodings() order
+    return ['{}-{}'.format(etag, encoding) for encoding in encodings()]
+
+
+def compress(body, encoding):
+    # Compresses body (bytes) without the cache
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_cached(body, encoding):
+    key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+    compressed = compressed_cache.get(key)
+    if compressed is None:
+        compressed = compress(body, encoding)
+        compressed_cache.set(key, compressed)
+    return compressed
+
+
+def _negotiate():
+    return request.accept_encodings.best_match(encodings())
+
+
+def compress_response(response):
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200 \
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_SIZE:
+        return response
+    response.set_data(compress_cached(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        # A strong ETag names one exact body
+        response.set_etag(etag_variants(etag)[encodings().index(encoding)])
+    return response
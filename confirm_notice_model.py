@@ -2,6 +2,10 @@ from db_helper import db
 
 
 class ConfirmNotice(db.Model):
+    # A user confirms a practice at most once. The practice_id index serves
+    # loading the notices of a practice.
+    __table_args__ = (db.UniqueConstraint('user_id', 'practice_id', name='uq_confirm_notice_user_id_practice_id'),
+                      db.Index('ix_confirm_notice_practice_id', 'practice_id'))
 
     id = db.Column(db.Integer, primary_key=True, unique=True, nullable=False)
 
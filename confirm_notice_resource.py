@@ -8,6 +8,9 @@ import logging
 from validation_schemas import ConfirmNoticeValidationSchema
 # Imports for serialization (flask-marshmallow)
 from serialization_schemas import ConfirmNoticeSchema
+import fast_serialization
+import pagination_helper
+import version_helper
 import user_model
 import practice_model
 import confirm_notice_model
@@ -15,8 +18,10 @@ import decline_notice_model
 # Imports for DB connection
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from db_helper import db
+import rsvp_helper
 # Imports for security
 from auth_helper import auth
+import replica_helper
 
 
 """
@@ -31,17 +36,28 @@ class ConfirmNotice(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, confirmNoticeID=None):
         if confirmNoticeID:
             # confirmNoticeID type (must be int) is enforced by Flask-RESTful
             confirm_notice = confirm_notice_model.ConfirmNotice.query.get(confirmNoticeID)
             if confirm_notice is None:
                 abort(404, message="Confirm Notice with ID {} does not exist.".format(confirmNoticeID))
-            return jsonify(self.confirm_notice_schmea.dump(confirm_notice).data)
+            # Notices never change, the ETag only tells them apart
+            etag = version_helper.etag(confirm_notice)
+            not_modified = version_helper.not_modified(etag)
+            if not_modified is not None:
+                return not_modified
+            return version_helper.with_etag(jsonify(fast_serialization.dump(self.confirm_notice_schmea, confirm_notice)), etag)
         else:
-            # Get on practice resource lists all practices
-            confirm_notices = confirm_notice_model.ConfirmNotice.query.filter(1==1).all()
-            return jsonify(self.confirm_notice_schmea.dump(confirm_notices).data)
+            # Get on confirm notice resource lists all confirm notices, one page
+            # at a time or streamed in full
+            if pagination_helper.stream_requested():
+                return pagination_helper.streamed_response(confirm_notice_model.ConfirmNotice.query, [confirm_notice_model.ConfirmNotice.id],
+                                                           lambda notices: fast_serialization.dump(self.confirm_notices_schema, notices))
+            confirm_notices, next_cursor = pagination_helper.paginate(confirm_notice_model.ConfirmNotice.query,
+                                                                      [confirm_notice_model.ConfirmNotice.id])
+            return pagination_helper.paginated_response(fast_serialization.dump(self.confirm_notices_schema, confirm_notices), next_cursor)
 
     @auth.login_required
     def post(self):
@@ -52,40 +68,21 @@ class ConfirmNotice(Resource):
             abort(400, message="The reqeust input could bot be validated. There were the following validation errors: {}".format(errors))
 
         # All request.json input parameters are validated by Marshmallow
-        # schema.
+        # schema, which also checked that the user and the practice exist.
 
-        # Get the User and Practice objects that this ConfirmNotice combines
-        user = user_model.User.query.get(request.json['userId'])
-        practice = practice_model.Practice.query.get(request.json['practiceId'])
-
-        # Get timestamp of when the practice was confirmd
         try:
-            # Start by checking a notice for this user-practice pair doesn't
-            # exist already.
-            existing_notice = confirm_notice_model.ConfirmNotice.query.filter(confirm_notice_model.ConfirmNotice.user_id == user.id,
-                                                                                confirm_notice_model.ConfirmNotice.practice_id == practice.id).all()
-            if len(existing_notice) > 0:
-                abort(500, message="Cannot create ConfirmNotice - the practice for this user is already confirmed.")
-
-            # Check that a DeclineNotice for this user-practice pair doesn't
-            # exist.
-            existing_notice = decline_notice_model.DeclineNotice.query.filter(decline_notice_model.DeclineNotice.user_id == user.id,
-                                                                                decline_notice_model.DeclineNotice.practice_id == practice.id).all()
-            if len(existing_notice) > 0:
-                abort(500, message="Cannot create ConfirmNotice - the practice have an existing decline notice. Delete that first.")
-
             dt = dateutil.parser.parse(request.json['timestamp'])
             # Assume input timestring is in UTC and drop all timezone info
             dt = dt.replace(tzinfo=None)
 
-            confirm_notice = confirm_notice_model.ConfirmNotice(dt)
-            user.confirmedPractices.append(confirm_notice)
-            practice.confirmed.append(confirm_notice)
-
-            # Add a confirmNotice to DB
-            db.session.add(confirm_notice)
-            db.session.commit()
+            # One conditional write (a single statement on Postgres): replaces
+            # an existing DeclineNotice of the user for the practice, fails if
+            # the practice is already confirmed.
+            confirm_notice = rsvp_helper.answer(confirm_notice_model.ConfirmNotice, int(request.json['userId']),
+                                                int(request.json['practiceId']), dt)
 
+        except rsvp_helper.AlreadyAnswered:
+            abort(409, message="Cannot create ConfirmNotice - the practice for this user is already confirmed.")
         except ValueError as err:
             debug_code = debug_code_generator.gen_debug_code()
             self.logger.error("ValueError happend in confirm_notice_model.py (catched in confirm_notice_resource.py). Debug code: {}. Stacktrace follows: ".format(debug_code))
@@ -99,12 +96,12 @@ class ConfirmNotice(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.confirm_notice_schmea.dump(confirm_notice).data)
+        return jsonify(fast_serialization.dump(self.confirm_notice_schmea, confirm_notice))
 
     """
-    There is no PUT methon. Once the confirm notice is created it cannot be
-    changed. It can be delete if the user changes her answer, but then DELETE
-    is used.
+    There is no PUT method. Once the confirm notice is created it cannot be
+    changed. If the user changes their answer, POST a decline notice (it replaces
+    this one) or DELETE this one.
     """
 
     @auth.login_required
@@ -0,0 +1,113 @@
+import os
+import time
+from sqlalchemy import event, func
+from sqlalchemy.orm import attributes
+from sqlalchemy.exc import IntegrityError
+from flask_sqlalchemy import SignallingSession
+from db_helper import db, user_invited_practice
+import counter_model
+import user_model
+import club_model
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+# How often (in seconds) each worker recounts the tables to correct any drift,
+# e.g. from rows written outside the ORM.
+RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 3600))
+
+# Counter name -> model whose rows it counts
+COUNTED_MODELS = {'users': user_model.User,
+                  'clubs': club_model.Club,
+                  'practices': practice_model.Practice,
+                  'confirmed': confirm_notice_model.ConfirmNotice,
+                  'declined': decline_notice_model.DeclineNotice}
+COUNTER_NAMES = list(COUNTED_MODELS) + ['invited']
+
+_last_reconcile = [0]
+
+
+"""
+Counters for /stats, maintained by session flush hooks.
+
+before_flush works out how many rows of each counted model the flush inserts
+and deletes, plus the invites added to and removed from Practice.invited
+(user_invited_practice rows are not mapped, so they have no mapper events).
+after_flush applies those deltas with UPDATE counter SET value = value + n on
+the flush connection, so the counters commit or roll back with the data, and
+are shared by all workers. Each counter is split over STATS_COUNTER_SHARDS
+rows and a connection updates its own one (see counter_model), so the writes
+of different workers and requests don't wait for each other's commit on a
+counter row lock.
+
+Writes that bypass the ORM must bump the counters themselves (see
+Practice.bulk_create). reconcile() recounts everything as a safety net.
+"""
+
+
+def _invited_delta(session):
+    delta = 0
+    for obj in session.new:
+        if isinstance(obj, practice_model.Practice):
+            delta += len(attributes.get_history(obj, 'invited').added)
+    for obj in session.dirty:
+        if isinstance(obj, practice_model.Practice):
+            history = attributes.get_history(obj, 'invited')
+            delta += len(history.added) - len(history.deleted)
+    for obj in session.deleted:
+        if isinstance(obj, practice_model.Practice):
+            # The flush deletes the invites of a deleted practice
+            delta -= len(obj.invited)
+    return delta
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _collect_deltas(session, flush_context, instances):
+    deltas = dict.fromkeys(COUNTER_NAMES, 0)
+    for name, model in COUNTED_MODELS.items():
+        deltas[name] += sum(1 for obj in session.new if isinstance(obj, model))
+        deltas[name] -= sum(1 for obj in session.deleted if isinstance(obj, model))
+    deltas['invited'] = _invited_delta(session)
+    session.info['counter_deltas'] = deltas
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _apply_deltas(session, flush_context):
+    deltas = session.info.pop('counter_deltas', None)
+    if deltas:
+        counter_model.Counter.increment(session.connection(), deltas)
+
+
+def reconcile():
+    # Replaces all counters with real counts, put in shard 0 with the other
+    # shards zeroed, and creates missing shards. Writes committed between the
+    # counts and the update can make a counter drift by a few until the next
+    # reconcile.
+    counts = {name: db.session.query(func.count()).select_from(model).scalar() for name, model in COUNTED_MODELS.items()}
+    counts['invited'] = db.session.query(func.count()).select_from(user_invited_practice).scalar()
+    Counter = counter_model.Counter
+    try:
+        # Shards left over from a larger STATS_COUNTER_SHARDS
+        db.session.query(Counter).filter(Counter.shard >= counter_model.COUNTER_SHARDS).delete(synchronize_session=False)
+        for name, value in counts.items():
+            for shard in range(counter_model.COUNTER_SHARDS):
+                db.session.merge(Counter(name, shard, value if shard == 0 else 0))
+        db.session.commit()
+    except IntegrityError:
+        # Another worker created the missing counters at the same time
+        db.session.rollback()
+    _last_reconcile[0] = time.time()
+    return counts
+
+
+def read_counters():
+    # Returns {counter name: value} with one query, reconciling first if a
+    # counter shard is missing or the reconcile interval has passed.
+    Counter = counter_model.Counter
+    rows = db.session.query(Counter.name, func.sum(Counter.value), func.count()).group_by(Counter.name).all()
+    counters = {name: int(value) for name, value, _ in rows}
+    shards = {name: count for name, _, count in rows}
+    if any(shards.get(name) != counter_model.COUNTER_SHARDS for name in COUNTER_NAMES) or \
+            time.time() - _last_reconcile[0] > RECONCILE_INTERVAL:
+        counters = reconcile()
+    return counters
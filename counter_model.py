@@ -0,0 +1,52 @@
+import os
+import itertools
+from db_helper import db
+
+# Rows each counter is split over. Concurrent writes update different rows,
+# so they don't queue on one row lock; /stats adds the rows up.
+COUNTER_SHARDS = int(os.environ.get('STATS_COUNTER_SHARDS', 16))
+
+# Shard of the next new DB connection. Starting from the PID spreads the
+# workers over the shards.
+_next_shard = itertools.count(os.getpid())
+
+
+"""
+Named row counts kept up to date on write (see counter_helper), so /stats can
+read them with one small query instead of running COUNT(*) over whole tables.
+Each counter is the sum of its COUNTER_SHARDS rows.
+"""
+class Counter(db.Model):
+    name = db.Column(db.String(50), primary_key=True, nullable=False)
+    shard = db.Column(db.Integer, primary_key=True, nullable=False, autoincrement=False)
+    value = db.Column(db.BigInteger, unique=False, nullable=False)
+
+    def __init__(self, name, shard, value):
+        self.name = name
+        self.shard = shard
+        self.value = value
+
+    @staticmethod
+    def shard_of(connection):
+        # The shard a connection writes to. Each DB connection keeps its
+        # shard, so one transaction updates one row per counter, and the
+        # concurrent transactions of a worker (on different pooled
+        # connections) mostly update different rows.
+        info = connection.connection.info
+        if 'counter_shard' not in info:
+            info['counter_shard'] = next(_next_shard) % COUNTER_SHARDS
+        return info['counter_shard']
+
+    @staticmethod
+    def increment(connection, deltas):
+        # Adds the deltas ({name: delta}) to the counters. Runs on the given
+        # connection, so it is part of the transaction doing the writes.
+        # Names are updated in order so two transactions on the same shard
+        # can't deadlock.
+        table = Counter.__table__
+        shard = Counter.shard_of(connection)
+        for name in sorted(deltas):
+            if deltas[name] != 0:
+                connection.execute(table.update()
+                                   .where((table.c.name == name) & (table.c.shard == shard))
+                                   .values(value=table.c.value + deltas[name]))
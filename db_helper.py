@@ -1,34 +1,66 @@
-from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
+from flask import _request_ctx_stack
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+
+
+"""
+Session that sends the queries of a request routed to a read replica (see
+replica_helper.read_only) to that replica's bind. Flushes always go to the
+primary.
+"""
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        bind_key = getattr(_request_ctx_stack.top, 'db_replica', None)
+        if bind_key is not None and not self._flushing:
+            return db.get_engine(self.app, bind=bind_key)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+# Every association table has a primary key on (user_id, <other>_id), which
+# also serves lookups by user, and an index on the other column for lookups
+# from the other side (e.g. loading Practice.invited).
 
 
 # Helper table for modelling user-is-member-of-club relationship 
 # many-to-many: Users possibly are members of many clubs and a club have many members
 
 user_member_club = db.Table('user_member_club',
-                            db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-                            db.Column('club_id', db.Integer, db.ForeignKey('club.id')))
+                            db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                            db.Column('club_id', db.Integer, db.ForeignKey('club.id'), primary_key=True),
+                            db.Index('ix_user_member_club_club_id', 'club_id'))
 
 # Helper table for modelling club-has-admins[users] relationship (many-to-many)
 # many-to-many: A users possibly is an admin of many clubs, and a club possibly have many admins
 user_admin_club = db.Table('user_admin_club',
-                           db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-                           db.Column('club_id', db.Integer, db.ForeignKey('club.id')))
+                           db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                           db.Column('club_id', db.Integer, db.ForeignKey('club.id'), primary_key=True),
+                           db.Index('ix_user_admin_club_club_id', 'club_id'))
 
 # Helper table for modelling club-has-coaches[users] relationship (many-to-many)
 # many-to-many: A user possibly is a coach in many clubs, and a club possibly have many coaches
 user_coach_club = db.Table('user_coach_club',
-                           db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-                           db.Column('club_id', db.Integer, db.ForeignKey('club.id')))
+                           db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                           db.Column('club_id', db.Integer, db.ForeignKey('club.id'), primary_key=True),
+                           db.Index('ix_user_coach_club_club_id', 'club_id'))
 
 # Helper table for modelling club-has-membership-requests[users] relationship (many-to-many)
 # many-to-many: A user possibly has requested membership of many clubs, and a club possibly multiple membership requests
 user_membershiprequest_club = db.Table('user_membershiprequest_club',
-                                       db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-                                       db.Column('club_id', db.Integer, db.ForeignKey('club.id')))
+                                       db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                                       db.Column('club_id', db.Integer, db.ForeignKey('club.id'), primary_key=True),
+                                       db.Index('ix_user_membershiprequest_club_club_id', 'club_id'))
 
 # Helper table for modelling practices-has-invitees relationship (many-to-many)
 # many-to-many: A user can be invited to many practices and a pratice have many invitees
 user_invited_practice = db.Table('user_invited_practice',
-                                 db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-                                 db.Column('practice_id', db.Integer, db.ForeignKey('practice.id')))
+                                 db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                                 db.Column('practice_id', db.Integer, db.ForeignKey('practice.id'), primary_key=True),
+                                 db.Index('ix_user_invited_practice_practice_id', 'practice_id'))
@@ -0,0 +1,111 @@
+import os
+import time
+from werkzeug.exceptions import ServiceUnavailable
+from sqlalchemy.exc import TimeoutError
+import timing_helper
+
+try:
+    import gevent.monkey
+    import gevent.socket
+except ImportError:
+    gevent = None
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:
+    psycopg2 = None
+
+# Connections the Postgres plan allows in total (Heroku hobby/standard-0: 20)
+DB_CONNECTION_BUDGET = int(os.environ.get('DB_CONNECTION_BUDGET', 20))
+# Kept free for heroku run, migrations, psql, ...
+DB_RESERVED_CONNECTIONS = int(os.environ.get('DB_RESERVED_CONNECTIONS', 2))
+# gunicorn workers sharing the budget. gunicorn_config.py reads the same
+# variable for the worker count.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 4))
+# Seconds a request waits for a free connection before it gets a 503
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+# auto: green psycopg2 when running under gevent monkey-patching, on, off
+DB_GEVENT = os.environ.get('DB_GEVENT', 'auto')
+
+
+"""
+Raised when no pooled DB connection frees up within DB_POOL_TIMEOUT.
+Subclasses a werkzeug HTTPException so both Flask and Flask-RESTful answer
+with a 503 rather than a 500.
+"""
+class DatabaseBusy(ServiceUnavailable):
+    description = "All database connections are busy. Please try again in a moment."
+
+
+def _gevent_patched():
+    return gevent is not None and gevent.monkey.is_module_patched('socket')
+
+
+def gevent_wait_callback(connection, timeout=None):
+    # psycopg2 wait callback: instead of blocking in libpq, wait for the
+    # connection's socket through the gevent hub, so other greenlets run
+    # while a query is in flight.
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            gevent.socket.wait_read(connection.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            gevent.socket.wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError("Bad result from poll: {}".format(state))
+
+
+def make_psycopg2_green(mode=None):
+    # Installs the gevent wait callback (per process, for every connection
+    # opened afterwards). Returns True if it is installed.
+    mode = mode or DB_GEVENT
+    if mode not in ('auto', 'on', 'off'):
+        raise ValueError("DB_GEVENT must be one of auto, on or off. Was: {}".format(mode))
+    if mode == 'off' or (mode == 'auto' and not _gevent_patched()):
+        return False
+    if psycopg2 is None or gevent is None:
+        if mode == 'on':
+            raise RuntimeError("DB_GEVENT=on needs both psycopg2 and gevent installed")
+        return False
+    psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+    return True
+
+
+def pool_settings(budget=None, workers=None, reserved=None, timeout=None, listeners=0):
+    # Flask-SQLAlchemy pool settings of one worker, so that all workers
+    # together never open more than budget - reserved connections. About a
+    # quarter of a worker's share is overflow, which is closed again when it
+    # is returned, so idle workers hold fewer connections. listeners is the
+    # number of connections a worker opens outside its pool.
+    budget = DB_CONNECTION_BUDGET if budget is None else budget
+    workers = WEB_CONCURRENCY if workers is None else workers
+    reserved = DB_RESERVED_CONNECTIONS if reserved is None else reserved
+    share = (budget - reserved) // max(workers, 1) - listeners
+    if share < 1:
+        raise ValueError("A connection budget of {} with {} reserved doesn't give each of {} workers a connection".format(budget, reserved, workers))
+    overflow = share // 4
+    return {'SQLALCHEMY_POOL_SIZE': share - overflow,
+            'SQLALCHEMY_MAX_OVERFLOW': overflow,
+            'SQLALCHEMY_POOL_TIMEOUT': DB_POOL_TIMEOUT if timeout is None else timeout}
+
+
+def guard_pool(pool):
+    # Adds the time a request waits for a connection to its timing, and turns
+    # a checkout timeout into DatabaseBusy (503).
+    do_get = pool._do_get
+
+    def guarded_do_get():
+        ts_start = time.time()
+        try:
+            return do_get()
+        except TimeoutError:
+            raise DatabaseBusy()
+        finally:
+            timing = timing_helper.current()
+            if timing is not None:
+                timing.pool_wait += time.time() - ts_start
+
+    pool._do_get = guarded_do_get
@@ -8,6 +8,9 @@ import logging
 from validation_schemas import DeclineNoticeValidationSchema
 # Imports for serialization (flask-marshmallow)
 from serialization_schemas import DeclineNoticeSchema
+import fast_serialization
+import pagination_helper
+import version_helper
 import user_model
 import practice_model
 import decline_notice_model
@@ -15,8 +18,10 @@ import confirm_notice_model
 # Imports for DB connection
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from db_helper import db
+import rsvp_helper
 # Imports for security
 from auth_helper import auth
+import replica_helper
 
 
 """
@@ -31,17 +36,28 @@ class DeclineNotice(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, declineNoticeID=None):
         if declineNoticeID:
             # declineNoticeID type (must be int) is enforced by Flask-RESTful
             decline_notice = decline_notice_model.DeclineNotice.query.get(declineNoticeID)
             if decline_notice is None:
                 abort(404, message="Decline Notice with ID {} does not exist.".format(declineNoticeID))
-            return jsonify(self.decline_notice_schmea.dump(decline_notice).data)
+            # Notices never change, the ETag only tells them apart
+            etag = version_helper.etag(decline_notice)
+            not_modified = version_helper.not_modified(etag)
+            if not_modified is not None:
+                return not_modified
+            return version_helper.with_etag(jsonify(fast_serialization.dump(self.decline_notice_schmea, decline_notice)), etag)
         else:
-            # Get on practice resource lists all practices
-            decline_notices = decline_notice_model.DeclineNotice.query.filter(1==1).all()
-            return jsonify(self.decline_notice_schmea.dump(decline_notices).data)
+            # Get on decline notice resource lists all decline notices, one page
+            # at a time or streamed in full
+            if pagination_helper.stream_requested():
+                return pagination_helper.streamed_response(decline_notice_model.DeclineNotice.query, [decline_notice_model.DeclineNotice.id],
+                                                           lambda notices: fast_serialization.dump(self.decline_notices_schema, notices))
+            decline_notices, next_cursor = pagination_helper.paginate(decline_notice_model.DeclineNotice.query,
+                                                                      [decline_notice_model.DeclineNotice.id])
+            return pagination_helper.paginated_response(fast_serialization.dump(self.decline_notices_schema, decline_notices), next_cursor)
 
     @auth.login_required
     def post(self):
@@ -52,40 +68,21 @@ class DeclineNotice(Resource):
             abort(400, message="The reqeust input could bot be validated. There were the following validation errors: {}".format(errors))
 
         # All request.json input parameters are validated by Marshmallow
-        # schema.
+        # schema, which also checked that the user and the practice exist.
 
-        # Get the User and Practice objects that this DeclineNotice combines
-        user = user_model.User.query.get(request.json['userId'])
-        practice = practice_model.Practice.query.get(request.json['practiceId'])
-
-        # Get timestamp of when the practice was declined
         try:
-            # Start by checking a notice for this user-practice pair doesn't
-            # exist already.
-            existing_notice = decline_notice_model.DeclineNotice.query.filter(decline_notice_model.DeclineNotice.user_id == user.id,
-                                                                                decline_notice_model.DeclineNotice.practice_id == practice.id).all()
-            if len(existing_notice) > 0:
-                abort(500, message="Cannot create DeclineNotice - the practice for this user is already declined.")
-
-            # Check that a ConfirmNotice for this user-practice pair doesn't
-            # exist.
-            existing_notice = confirm_notice_model.ConfirmNotice.query.filter(confirm_notice_model.ConfirmNotice.user_id == user.id,
-                                                                                confirm_notice_model.ConfirmNotice.practice_id == practice.id).all()
-            if len(existing_notice) > 0:
-                abort(500, message="Cannot create DeclineNotice - the practice have an existing confirm notice. Delete that first.")
-
             dt = dateutil.parser.parse(request.json['timestamp'])
             # Assume input timestring is in UTC and drop all timezone info
             dt = dt.replace(tzinfo=None)
 
-            decline_notice = decline_notice_model.DeclineNotice(dt)
-            user.declinedPractices.append(decline_notice)
-            practice.declined.append(decline_notice)
-
-            # Add a declineNotice to DB
-            db.session.add(decline_notice)
-            db.session.commit()
+            # One conditional write (a single statement on Postgres): replaces
+            # an existing ConfirmNotice of the user for the practice, fails if
+            # the practice is already declined.
+            decline_notice = rsvp_helper.answer(decline_notice_model.DeclineNotice, int(request.json['userId']),
+                                                int(request.json['practiceId']), dt)
 
+        except rsvp_helper.AlreadyAnswered:
+            abort(409, message="Cannot create DeclineNotice - the practice for this user is already declined.")
         except ValueError as err:
             debug_code = debug_code_generator.gen_debug_code()
             self.logger.error("ValueError happend in decline_notice_model.py (catched in decline_notice_resource.py). Debug code: {}. Stacktrace follows: ".format(debug_code))
@@ -99,7 +96,7 @@ class DeclineNotice(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.decline_notice_schmea.dump(decline_notice).data)
+        return jsonify(fast_serialization.dump(self.decline_notice_schmea, decline_notice))
 
     """
     There is no PUT method. Once the decline notice is created it cannot be
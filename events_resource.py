@@ -0,0 +1,57 @@
+from flask import Response, stream_with_context
+from flask_restful import Resource, abort
+import logging
+import rsvp_events_helper
+import club_model
+import practice_model
+# Imports for DB connection
+from db_helper import db
+# Imports for security
+from auth_helper import auth
+import replica_helper
+
+
+def _event_stream(match):
+    # The session is only needed to check that the club or practice exists.
+    # Removing it returns the connection to the pool, so idle streams don't
+    # hold connections.
+    db.session.remove()
+    response = Response(stream_with_context(rsvp_events_helper.stream(match)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let a proxy buffer the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+"""
+Server-Sent Events stream of the RSVP changes of all practices of a club
+(see rsvp_events_helper)
+"""
+class ClubEvents(Resource):
+
+    def __init__(self):
+        self.logger = logging.getLogger('root')
+
+    @auth.login_required
+    @replica_helper.read_only
+    def get(self, clubID):
+        # clubID type (must be int) is enforced by Flask-RESTful
+        if db.session.query(club_model.Club.id).filter(club_model.Club.id == clubID).first() is None:
+            abort(404, message="Club with ID {} does not exist.".format(clubID))
+        return _event_stream(lambda e: e['clubId'] == clubID)
+
+
+"""
+Server-Sent Events stream of the RSVP changes of one practice
+"""
+class PracticeEvents(Resource):
+
+    def __init__(self):
+        self.logger = logging.getLogger('root')
+
+    @auth.login_required
+    @replica_helper.read_only
+    def get(self, practiceID):
+        if db.session.query(practice_model.Practice.id).filter(practice_model.Practice.id == practiceID).first() is None:
+            abort(404, message="Practice with ID {} does not exist.".format(practiceID))
+        return _event_stream(lambda e: e['practiceId'] == practiceID)
@@ -0,0 +1,136 @@
+import os
+from flask import request
+from marshmallow import fields, utils
+from marshmallow_sqlalchemy.fields import Related
+from sqlalchemy import inspect
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+"""
+Precompiled serializer for the marshmallow ModelSchemas in
+serialization_schemas.
+
+ModelSchema.dump looks up and formats every field through the generic
+marshmallow machinery for every object, and re-dumps nested schemas through
+the same path. Here each schema is compiled once into a flat list of
+(key, extractor) pairs and dumping an object is a single pass over that list.
+The output is identical to schema.dump(obj).data, so jsonify'ed responses are
+byte-for-byte the same.
+
+Whether an endpoint uses the compiled path is decided per Flask endpoint name
+(see FAST_SERIALIZATION_ENDPOINTS below), so it can be switched off for an
+endpoint without touching the resource.
+"""
+
+# Endpoint names (as registered in badmin_api) that use the compiled
+# serializer. Override with a comma separated list in the environment, '*' for
+# all endpoints or an empty string for none.
+DEFAULT_ENDPOINTS = 'practices_all,user_practies_with_id,club_practies_by_week_with_number,club_practies_by_week_all,club_practies_by_date'
+FAST_SERIALIZATION_ENDPOINTS = set(filter(None, os.environ.get('FAST_SERIALIZATION_ENDPOINTS', DEFAULT_ENDPOINTS).split(',')))
+
+# Compiled plans by (schema class, only, exclude)
+_plans = {}
+
+
+def _naive_isoformat(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # Same as marshmallow.utils.isoformat, which localizes naive datetimes to UTC
+        return value.isoformat() + '+00:00'
+    return utils.isoformat(value)
+
+
+def _related_extractor(related_field):
+    keys = [prop.key for prop in related_field.related_keys]
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda value: getattr(value, key, None)
+    return lambda value: {k: getattr(value, k, None) for k in keys}
+
+
+def _foreign_key_attribute(model, attr, related_field):
+    # For a many-to-one relationship pointing at the related primary key,
+    # returns the local foreign key attribute holding the same value. Reading
+    # it avoids loading the related object (one identity map lookup, or worse a
+    # SELECT, per object). Resources only dump after commit, so the foreign
+    # key is in sync with the relationship.
+    mapper = inspect(model)
+    if attr not in mapper.relationships:
+        return None
+    prop = mapper.relationships[attr]
+    if prop.direction is not MANYTOONE or len(prop.local_remote_pairs) != 1 or len(related_field.related_keys) != 1:
+        return None
+    local, remote = prop.local_remote_pairs[0]
+    related_mapper = prop.mapper
+    if related_mapper.get_property_by_column(remote).key != related_field.related_keys[0].key:
+        return None
+    return mapper.get_property_by_column(local).key
+
+
+def _compile_field(name, field, model):
+    attr = field.attribute or name
+
+    if isinstance(field, fields.Integer) and not field.as_string or type(field) is fields.String:
+        # Column values come back from the DB with the right type already
+        return lambda obj: getattr(obj, attr)
+
+    if type(field) is fields.DateTime and field.dateformat in (None, 'iso') and not field.localtime:
+        return lambda obj: _naive_isoformat(getattr(obj, attr))
+
+    if isinstance(field, Related):
+        foreign_key = _foreign_key_attribute(model, attr, field)
+        if foreign_key is not None:
+            return lambda obj: getattr(obj, foreign_key)
+        related = _related_extractor(field)
+        def extract_related(obj):
+            value = getattr(obj, attr)
+            return None if value is None else related(value)
+        return extract_related
+
+    if isinstance(field, fields.List) and isinstance(field.container, Related):
+        related = _related_extractor(field.container)
+        def extract_related_list(obj):
+            value = getattr(obj, attr)
+            return None if value is None else [related(each) for each in value]
+        return extract_related_list
+
+    if isinstance(field, fields.Nested) and not isinstance(field.only, str):
+        nested = compile_schema(field.schema)
+        many = field.many
+        def extract_nested(obj):
+            value = getattr(obj, attr)
+            if value is None:
+                return None
+            return [nested(each) for each in value] if many else nested(value)
+        return extract_nested
+
+    # Anything else goes through marshmallow itself
+    return lambda obj: field.serialize(name, obj)
+
+
+def compile_schema(schema):
+    # Returns a function dumping a single object the same way schema.dump does
+    key = (type(schema), schema.only and tuple(schema.only), tuple(schema.exclude))
+    plan = _plans.get(key)
+    if plan is None:
+        model = schema.opts.model
+        extractors = [(name, _compile_field(name, field, model))
+                      for name, field in schema.fields.items() if not field.load_only]
+        def plan(obj):
+            return {name: extract(obj) for name, extract in extractors}
+        _plans[key] = plan
+    return plan
+
+
+def enabled_for(endpoint):
+    return '*' in FAST_SERIALIZATION_ENDPOINTS or endpoint in FAST_SERIALIZATION_ENDPOINTS
+
+
+def dump(schema, obj):
+    # Drop-in replacement for schema.dump(obj).data in the resources
+    if not enabled_for(request.endpoint):
+        return schema.dump(obj).data
+    plan = compile_schema(schema)
+    if schema.many:
+        return [plan(each) for each in obj]
+    return plan(obj)
@@ -0,0 +1,165 @@
+"""
+Synthetic dataset generator for local load and benchmark runs.
+
+create_demo_db.py makes 3 users, 1 club and 9 practices. This fills the
+database in DATABASE_URL (SQLite or a local Postgres) with production sized
+data instead: clubs of members with admins and coaches, a few practices per
+club every week for years back (and some weeks ahead), with invites and
+confirm/decline answers at realistic ratios.
+
+Users, clubs, practices and notices are built with the model constructors, so
+they go through the same argument checks as in the API. They are written with
+multi-row Core inserts rather than one ORM flush per object, so a million
+rows take well under a minute. All users have the password 'foobar'; user 1 is
+user1@example.com. The data is deterministic for a given --seed.
+
+    DATABASE_URL=sqlite:///bench.db python generate_data.py --create --clubs 20 --users 2000 --years 3
+    DATABASE_URL=postgresql://localhost/badmin_bench python generate_data.py --clubs 50 --users 5000
+
+Run flask db upgrade first on Postgres, or pass --create to create the tables
+from the models. The tables must be empty.
+"""
+import os
+import time
+import random
+import logging
+import argparse
+import datetime
+
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'generate_data')
+
+import badmin_api
+import hashing_helper
+import counter_helper
+from db_helper import db, user_member_club, user_admin_club, user_coach_club, user_invited_practice
+import user_model
+import club_model
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+PASSWORD = 'foobar'
+# Rows per INSERT statement
+INSERT_CHUNK_SIZE = 5000
+# (weekday, hour, name) of the weekly practices of a club, the first
+# --practices-per-week of them are used
+PRACTICE_SLOTS = [(0, 18, 'A-træning (Mandag)'), (1, 19, 'B-træning (Tirsdag)'), (2, 17, 'Fysisk (Onsdag)'),
+                  (3, 18, 'A-træning (Torsdag)'), (4, 16, 'Ungdom (Fredag)'), (5, 10, 'Motion (Lørdag)'),
+                  (6, 10, 'Fri træning (Søndag)')]
+
+
+def _row(obj, **columns):
+    # Column values of a transient model object, plus the given columns
+    # (foreign keys, which are only set from relationships on flush).
+    # Unset columns with a default (version) are left to the default.
+    row = {attr.key: getattr(obj, attr.key) for attr in db.inspect(obj).mapper.column_attrs
+           if getattr(obj, attr.key) is not None or attr.columns[0].default is None}
+    row.update(columns)
+    return row
+
+
+def _insert(table, rows):
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(table.insert(), rows[i:i + INSERT_CHUNK_SIZE])
+
+
+def _make_users(num_users):
+    # Hash the shared password once instead of once per user
+    hashed_password = hashing_helper.hash_password(PASSWORD)
+    hash_password = hashing_helper.hash_password
+    hashing_helper.hash_password = lambda password: hashed_password
+    try:
+        return [user_model.User('User {}'.format(i), 'user{}@example.com'.format(i), 10000000 + i, PASSWORD)
+                for i in range(1, num_users + 1)]
+    finally:
+        hashing_helper.hash_password = hash_password
+
+
+def generate(num_clubs=10, num_users=500, years=2, weeks_ahead=8, practices_per_week=3,
+             invite_ratio=0.8, confirm_ratio=0.6, decline_ratio=0.2, seed=42):
+    # Returns {table name: number of rows inserted}
+    rnd = random.Random(seed)
+    if num_users < num_clubs:
+        raise ValueError("Need at least one user per club. Got {} users for {} clubs".format(num_users, num_clubs))
+
+    users = _make_users(num_users)
+    user_rows = [_row(user, id=i) for i, user in enumerate(users, 1)]
+
+    club_rows, members, admins, coaches = [], [], [], []
+    practice_rows, invites, confirms, declines = [], [], [], []
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+    first_monday = today - datetime.timedelta(days=today.weekday(), weeks=int(years * 52))
+    num_weeks = int(years * 52) + weeks_ahead
+
+    for clubID in range(1, num_clubs + 1):
+        # Users are spread evenly over the clubs; the first member is admin,
+        # the next two are coaches
+        memberIDs = list(range(clubID, num_users + 1, num_clubs))
+        club = club_model.Club('Klub {}'.format(clubID), [users[memberIDs[0] - 1]])
+        club_rows.append(_row(club, id=clubID))
+        members += [{'user_id': userID, 'club_id': clubID} for userID in memberIDs]
+        admins.append({'user_id': memberIDs[0], 'club_id': clubID})
+        coaches += [{'user_id': userID, 'club_id': clubID} for userID in memberIDs[1:3]]
+
+        for week in range(num_weeks):
+            for weekday, hour, name in PRACTICE_SLOTS[:practices_per_week]:
+                startTime = first_monday + datetime.timedelta(weeks=week, days=weekday, hours=hour)
+                practice = practice_model.Practice(name, club, startTime, rnd.choice([60, 90, 120]))
+                practiceID = len(practice_rows) + 1
+                practice_rows.append(_row(practice, id=practiceID, club_id=clubID))
+
+                for userID in memberIDs:
+                    if rnd.random() >= invite_ratio:
+                        continue
+                    invites.append({'user_id': userID, 'practice_id': practiceID})
+                    # Answers come in during the week before the practice
+                    timestamp = startTime - datetime.timedelta(minutes=rnd.randint(60, 7 * 24 * 60))
+                    if timestamp > datetime.datetime.utcnow():
+                        continue
+                    answer = rnd.random()
+                    if answer < confirm_ratio:
+                        notice = confirm_notice_model.ConfirmNotice(timestamp)
+                        confirms.append(_row(notice, id=len(confirms) + 1, user_id=userID, practice_id=practiceID))
+                    elif answer < confirm_ratio + decline_ratio:
+                        notice = decline_notice_model.DeclineNotice(timestamp)
+                        declines.append(_row(notice, id=len(declines) + 1, user_id=userID, practice_id=practiceID))
+
+    tables = [(user_model.User.__table__, user_rows), (club_model.Club.__table__, club_rows),
+              (user_member_club, members), (user_admin_club, admins), (user_coach_club, coaches),
+              (practice_model.Practice.__table__, practice_rows), (user_invited_practice, invites),
+              (confirm_notice_model.ConfirmNotice.__table__, confirms), (decline_notice_model.DeclineNotice.__table__, declines)]
+    for table, rows in tables:
+        _insert(table, rows)
+    if db.session.connection().dialect.name == 'postgresql':
+        # IDs were given explicitly, so move the sequences past them
+        for table in (user_model.User.__table__, club_model.Club.__table__, practice_model.Practice.__table__,
+                      confirm_notice_model.ConfirmNotice.__table__, decline_notice_model.DeclineNotice.__table__):
+            db.session.execute("SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), coalesce(max(id), 1)) FROM \"{0}\"".format(table.name))
+    db.session.commit()
+    counter_helper.reconcile()
+    return {table.name: len(rows) for table, rows in tables}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill DATABASE_URL with a synthetic dataset")
+    parser.add_argument('--create', action='store_true', help="create the tables from the models first")
+    parser.add_argument('--clubs', type=int, default=10)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--years', type=float, default=2, help="years of weekly practices back in time")
+    parser.add_argument('--weeks-ahead', type=int, default=8, help="weeks of practices ahead of today")
+    parser.add_argument('--practices-per-week', type=int, default=3, choices=range(1, len(PRACTICE_SLOTS) + 1))
+    parser.add_argument('--invite-ratio', type=float, default=0.8, help="share of club members invited to a practice")
+    parser.add_argument('--confirm-ratio', type=float, default=0.6, help="share of invites confirmed")
+    parser.add_argument('--decline-ratio', type=float, default=0.2, help="share of invites declined")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if args.create:
+        db.create_all()
+    ts_start = time.time()
+    counts = generate(args.clubs, args.users, args.years, args.weeks_ahead, args.practices_per_week,
+                      args.invite_ratio, args.confirm_ratio, args.decline_ratio, args.seed)
+    for name, count in counts.items():
+        print("{:<28} {:>9}".format(name, count))
+    print("Generated in {:.1f} s".format(time.time() - ts_start))
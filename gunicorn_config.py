@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+
+# Gunicorn settings shared by all worker processes. Loaded in the master
+# before the workers are forked, so the environment set here is inherited.
+
+# The app splits the DB connection budget by the same number (see
+# db_pool_helper), so set the worker count through WEB_CONCURRENCY only.
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', '4'))
+
+# Prometheus multiprocess mode (see metrics_helper): every worker writes its
+# metrics to files in this directory and /metrics adds them up.
+multiproc_dir = os.environ.setdefault('prometheus_multiproc_dir',
+                                      os.path.join(tempfile.gettempdir(), 'badmin_prometheus'))
+
+
+def on_starting(server):
+    # Files of an earlier run would be added to the new counts
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (in flight requests, pool usage) of a dead worker
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,142 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from werkzeug.exceptions import ServiceUnavailable
+from passlib.apps import custom_app_context as pwd_context
+
+try:
+    import gevent.monkey
+    import gevent.threadpool
+except ImportError:
+    gevent = None
+
+
+"""
+Raised when the hashing pool and its queue are full. Subclasses a werkzeug
+HTTPException so both Flask and Flask-RESTful answer with a 503.
+"""
+class HashingPoolFull(ServiceUnavailable):
+    description = "The server is busy hashing passwords. Please try again in a moment."
+
+
+# Module level functions so they can be pickled and sent to a worker process
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify(password, hashed_password):
+    return pwd_context.verify(password, hashed_password)
+
+
+def _gevent_patched():
+    return gevent is not None and gevent.monkey.is_module_patched('threading')
+
+
+"""
+Runs password hashing and verification outside the request greenlet.
+
+Password hashing is deliberately slow and CPU bound. Run directly in a gevent
+worker it stalls every other greenlet of that worker, so it is handed off to
+a pool of real OS threads or worker processes instead, which the calling
+greenlet waits on cooperatively. Modes:
+
+  inline   hash in the calling thread (the old behaviour)
+  thread   hash in a pool of OS threads (gevent's threadpool when monkey-patched).
+           Only helps if the passlib backend releases the GIL.
+  process  hash in a pool of worker processes, not limited by the GIL (default)
+
+At most size + max_queue calls are admitted at a time. Further calls wait up
+to queue_timeout seconds for a slot and then raise HashingPoolFull.
+"""
+class HashingPool(object):
+
+    def __init__(self, mode='process', size=2, max_queue=32, queue_timeout=5):
+        if mode not in ('inline', 'thread', 'process'):
+            raise ValueError("Hashing pool mode must be one of inline, thread or process. HashingPool.init was passed: {}".format(mode))
+        self.mode = mode
+        self.size = size
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(size + max_queue)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(mode=os.environ.get('HASHING_POOL_MODE', 'process'),
+                   size=int(os.environ.get('HASHING_POOL_SIZE', 2)),
+                   max_queue=int(os.environ.get('HASHING_POOL_MAX_QUEUE', 32)),
+                   queue_timeout=float(os.environ.get('HASHING_POOL_QUEUE_TIMEOUT', 5)))
+
+    def hash(self, password):
+        return self._run(_hash, password)
+
+    def verify(self, password, hashed_password):
+        return self._run(_verify, password, hashed_password)
+
+    def hash_many(self, passwords):
+        # Hashes a list of passwords, spread over all workers of the pool. The
+        # whole batch takes one slot, but keeps the workers busy; other
+        # hashes queue behind it.
+        if self.mode == 'inline' or len(passwords) == 0:
+            return [_hash(password) for password in passwords]
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingPoolFull()
+        try:
+            executor = self._get_executor()
+            if isinstance(executor, ProcessPoolExecutor):
+                # Send the passwords in a few chunks per process rather than
+                # one round trip each
+                return list(executor.map(_hash, passwords, chunksize=max(1, len(passwords) // (self.size * 4))))
+            if not _gevent_patched():
+                return list(executor.map(_hash, passwords))
+            return executor.map(_hash, passwords)
+        finally:
+            self._slots.release()
+
+    def _run(self, fn, *args):
+        if self.mode == 'inline':
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingPoolFull()
+        try:
+            executor = self._get_executor()
+            if isinstance(executor, ProcessPoolExecutor) or not _gevent_patched():
+                # With gevent monkey-patching Future.result() waits on a
+                # cooperative lock, so only the calling greenlet blocks.
+                return executor.submit(fn, *args).result()
+            return executor.apply(fn, args)
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        # Executors are created lazily, and again after a fork, so that every
+        # gunicorn worker gets its own pool instead of sharing the master's.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if self.mode == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.size)
+                elif _gevent_patched():
+                    # Monkey-patched threads are greenlets, so use gevent's
+                    # pool of real OS threads instead.
+                    self._executor = gevent.threadpool.ThreadPool(self.size)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.size)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+
+pool = HashingPool.from_env()
+
+
+def hash_password(password):
+    return pool.hash(password)
+
+
+def verify_password(password, hashed_password):
+    return pool.verify(password, hashed_password)
+
+
+def hash_passwords(passwords):
+    return pool.hash_many(passwords)
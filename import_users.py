@@ -0,0 +1,51 @@
+"""
+Bulk import of users from a CSV or JSON lines roster into DATABASE_URL, the
+same way as POST /user/import (see user_import_helper).
+
+    python import_users.py roster.csv
+    python import_users.py --club 3 players.jsonl
+    cat roster.csv | python import_users.py --format csv -
+
+Prints the rows that were not imported and a summary; exits with status 1 if
+any row was not imported.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+os.environ.setdefault('TOKEN_GEN_SECRET_KEY', 'import_users')
+
+import badmin_api
+import user_import_helper
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import users from a CSV or JSON lines roster")
+    parser.add_argument('roster', help="roster file, - for stdin")
+    parser.add_argument('--format', choices=user_import_helper.FORMATS,
+                        help="roster format (default: from the file extension, .csv or .jsonl)")
+    parser.add_argument('--club', type=int, action='append', default=[],
+                        help="make every user a member of this club too (repeatable)")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    roster_format = args.format or os.path.splitext(args.roster)[1].lstrip('.').replace('ndjson', 'jsonl')
+    if roster_format not in user_import_helper.FORMATS:
+        parser.error("Can't tell the roster format from the file name, pass --format")
+
+    ts_start = time.time()
+    created = failed = 0
+    # Decoded line by line as for POST /user/import, so the rows before an
+    # undecodable one are still imported
+    roster = sys.stdin.buffer if args.roster == '-' else open(args.roster, 'rb')
+    with roster:
+        for result in user_import_helper.import_users(user_import_helper.decode(roster), roster_format, args.club):
+            if result['code'] == 201:
+                created += 1
+            else:
+                failed += 1
+                print("row {row}: {code} {message}".format(**result))
+    print("Imported {} users, {} rows failed, in {:.1f} s".format(created, failed, time.time() - ts_start))
+    sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,168 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from sqlalchemy import event
+from flask_sqlalchemy import SignallingSession
+import pubsub_helper
+
+# pub/sub channel of the bus (a Postgres NOTIFY channel)
+CHANNEL = 'badmin_invalidate'
+# Seconds changes are collected before they are sent as one batch
+BATCH_INTERVAL = float(os.environ.get('INVALIDATION_BATCH_INTERVAL', 0.05))
+# (entity, ID) pairs per message; a NOTIFY payload is limited to 8000 bytes
+MAX_IDS_PER_MESSAGE = 500
+# Messages a worker may fall behind by before it clears its caches instead
+QUEUE_SIZE = int(os.environ.get('INVALIDATION_QUEUE_SIZE', 1000))
+
+# Tells this worker's messages apart from the others' (PIDs repeat across dynos)
+WORKER_ID = uuid.uuid4().hex[:12]
+
+# entity -> functions evicting the cache entries of one ID of the entity
+_evictors = {}
+# Caches cleared when messages may have been lost
+_caches = []
+
+_pending = set()
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_threads = {}
+
+
+"""
+Bus that drops in-process cache entries in all workers after a write.
+
+Each worker caches auth lookups and practice views (see cache_helper), and a
+write only drops the entries of the worker that served it. Writers hand the
+(entity, ID) pairs they changed to the bus once the change is committed:
+changed() marks them in a session, and after its commit their entries are
+dropped in this worker and the pairs go out; publish() sends pairs that are
+already committed, their writer drops its own entries. The pairs of all
+transactions within INVALIDATION_BATCH_INTERVAL are de-duplicated and sent
+together as a few compact messages,
+
+  {"origin": WORKER_ID, "ids": [["user", 42], ["practice", 7], ...]}
+
+through pubsub_helper (NOTIFY on Postgres). Every worker runs a listener
+thread (a greenlet under gevent), started by start(), that calls the
+functions register()ed for each entity; messages of its own worker are
+skipped, it dropped the entries itself. When messages may have been lost (a
+dropped LISTEN connection, or the worker falling behind by
+INVALIDATION_QUEUE_SIZE messages) the registered caches are cleared instead,
+and the listener subscribes again.
+
+With the in-memory pub/sub backend there are no other workers to reach.
+"""
+
+
+def register(entity, evict, caches=()):
+    # evict(id) drops the entries of an entity ID; caches are cleared on a
+    # resync
+    _evictors.setdefault(entity, []).append(evict)
+    _caches.extend(cache for cache in caches if cache not in _caches)
+
+
+def changed(session, entity, id):
+    # Evicts (entity, id) locally and publishes it after the session's
+    # transaction commits
+    session.info.setdefault('invalidations', set()).add((entity, id))
+
+
+def publish(pairs):
+    # Queues committed (entity, ID) pairs for the next batch
+    pairs = [(entity, id) for entity, id in pairs if id is not None]
+    if len(pairs) == 0:
+        return
+    with _lock:
+        _pending.update(pairs)
+        _start_thread('sender', _send_batches)
+    _wakeup.set()
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _publish_committed(session):
+    pairs = session.info.pop('invalidations', None)
+    if pairs:
+        for entity, id in pairs:
+            for evict in _evictors.get(entity, ()):
+                evict(id)
+        publish(pairs)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget(session):
+    session.info.pop('invalidations', None)
+
+
+def messages(pairs):
+    # The messages sending pairs, in ID order
+    pairs = sorted(pairs)
+    return [{'origin': WORKER_ID, 'ids': [list(pair) for pair in pairs[start:start + MAX_IDS_PER_MESSAGE]]}
+            for start in range(0, len(pairs), MAX_IDS_PER_MESSAGE)]
+
+
+def _send_batches():
+    logger = logging.getLogger('root')
+    while True:
+        _wakeup.wait()
+        # Let a burst of writes add to the batch
+        time.sleep(BATCH_INTERVAL)
+        with _lock:
+            _wakeup.clear()
+            pairs = set(_pending)
+            _pending.clear()
+        try:
+            pubsub_helper.notify(CHANNEL, messages(pairs))
+        except Exception:
+            # Try again with the next batch
+            logger.exception("Sending {} cache invalidations failed".format(len(pairs)))
+            with _lock:
+                _pending.update(pairs)
+            time.sleep(1)
+            _wakeup.set()
+
+
+def apply(message):
+    # Evicts the entries a message names, unless this worker sent it
+    if message is pubsub_helper.RESYNC:
+        for cache in _caches:
+            cache.clear()
+        return
+    if message.get('origin') == WORKER_ID:
+        return
+    for entity, id in message['ids']:
+        for evict in _evictors.get(entity, ()):
+            evict(id)
+
+
+def _listen():
+    logger = logging.getLogger('root')
+    while True:
+        subscription = pubsub_helper.subscribe(CHANNEL, maxsize=QUEUE_SIZE)
+        while not subscription.closed:
+            message = subscription.get()
+            try:
+                apply(message)
+            except Exception:
+                logger.exception("Applying cache invalidation {} failed".format(message))
+        # Dropped for falling behind: clear the caches (again, if the resync
+        # was already applied) and subscribe again
+        apply(pubsub_helper.RESYNC)
+
+
+def _start_thread(name, target):
+    # Must be called with _lock held
+    if name not in _threads:
+        # The broker needs the app context to find the engine, which the
+        # thread doesn't have
+        pubsub_helper.broker()
+        _threads[name] = threading.Thread(target=target, name='invalidation-' + name, daemon=True)
+        _threads[name].start()
+
+
+def start():
+    # Starts listening for the invalidations of the other workers. Call once
+    # per worker process, after it is forked.
+    with _lock:
+        _start_thread('listener', _listen)
@@ -0,0 +1,146 @@
+import os
+import time
+from flask import request, Response
+from flask_restful import abort
+from sqlalchemy import event
+import timing_helper
+
+# Optional: without prometheus_client installed nothing is recorded and
+# /metrics answers 501.
+try:
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:
+    multiprocess = None
+
+
+"""
+Prometheus metrics of the API, served on /metrics in the text exposition
+format:
+
+  badmin_request_duration_seconds     histogram by endpoint and method
+  badmin_requests_total               counter by endpoint, method and status
+  badmin_requests_in_flight           requests being handled right now
+  badmin_db_pool_checkout_wait_seconds  histogram of the wait for a pooled DB connection
+  badmin_db_pool_connections_in_use   connections checked out of the pools
+  badmin_db_pool_size                 configured size of the pools
+  badmin_cache_lookups_total          lookups of the in-process caches by cache and result (hit, miss)
+  badmin_cache_invalidations_total    entries dropped on write by cache
+  badmin_event_streams_open           open Server-Sent Events streams (see rsvp_events_helper)
+
+Endpoints are the Flask-RESTful endpoint names of badmin_api (users_all,
+club_practies_by_week_with_number, ...), or "unmatched" for requests that
+matched no route.
+
+With several gunicorn workers each worker only sees its own requests. Set
+prometheus_multiproc_dir to an empty directory (gunicorn_config.py does) and
+every worker writes its values to memory mapped files there, which /metrics
+adds up across all workers, whichever worker serves the scrape.
+"""
+
+
+def _multiprocess_dir():
+    return os.environ.get('prometheus_multiproc_dir') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+if multiprocess is not None:
+    REQUEST_DURATION = Histogram('badmin_request_duration_seconds', "Request duration", ['endpoint', 'method'])
+    REQUESTS = Counter('badmin_requests_total', "Requests handled", ['endpoint', 'method', 'status'])
+    IN_FLIGHT = Gauge('badmin_requests_in_flight', "Requests being handled", multiprocess_mode='livesum')
+    POOL_CHECKOUT_WAIT = Histogram('badmin_db_pool_checkout_wait_seconds', "Wait for a connection from the DB pool",
+                                   buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+    POOL_IN_USE = Gauge('badmin_db_pool_connections_in_use', "DB connections checked out of the pool", multiprocess_mode='livesum')
+    POOL_SIZE = Gauge('badmin_db_pool_size', "Configured DB pool size", multiprocess_mode='livesum')
+    CACHE_LOOKUPS = Counter('badmin_cache_lookups_total', "Lookups of in-process caches", ['cache', 'result'])
+    CACHE_INVALIDATIONS = Counter('badmin_cache_invalidations_total', "Entries dropped from in-process caches on write", ['cache'])
+    EVENT_STREAMS = Gauge('badmin_event_streams_open', "Open Server-Sent Events streams", multiprocess_mode='livesum')
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def start_request():
+    if multiprocess is not None:
+        IN_FLIGHT.inc()
+
+
+def finish_request(exception=None):
+    # Call on teardown, after timing_helper has the status of the response
+    if multiprocess is None:
+        return
+    IN_FLIGHT.dec()
+    timing = timing_helper.current()
+    if timing is None:
+        return
+    status = timing.status if exception is None and timing.status is not None else 500
+    REQUEST_DURATION.labels(_endpoint(), request.method).observe(timing.duration())
+    REQUESTS.labels(_endpoint(), request.method, str(status)).inc()
+
+
+def stream_opened():
+    if multiprocess is not None:
+        EVENT_STREAMS.inc()
+
+
+def stream_closed():
+    if multiprocess is not None:
+        EVENT_STREAMS.dec()
+
+
+def instrument_pool(pool):
+    # Records checkout waits and connections in use of a connection pool.
+    # The wait is timed around the pool's _do_get, which blocks while all
+    # connections are checked out; SQLAlchemy has no event before a checkout.
+    if multiprocess is None:
+        return
+    if hasattr(pool, 'size'):
+        POOL_SIZE.inc(pool.size())
+    do_get = pool._do_get
+
+    def timed_do_get():
+        ts_start = time.time()
+        try:
+            return do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.time() - ts_start)
+
+    pool._do_get = timed_do_get
+    event.listen(pool, 'checkout', lambda dbapi_connection, connection_record, connection_proxy: POOL_IN_USE.inc())
+    event.listen(pool, 'checkin', lambda dbapi_connection, connection_record: POOL_IN_USE.dec())
+
+
+def instrument_cache(cache):
+    # Counts the hits, misses and invalidations of a cache_helper.TTLCache.
+    # Its own counters (/stats/caches) are per worker, these add up.
+    if multiprocess is None:
+        return
+    get, invalidate_tag, delete = cache.get, cache.invalidate_tag, cache.delete
+
+    def counted_get(key, default=None):
+        hits = cache.hits
+        value = get(key, default)
+        CACHE_LOOKUPS.labels(cache.name, 'hit' if cache.hits > hits else 'miss').inc()
+        return value
+
+    def counted(invalidate):
+        def counted_invalidate(key_or_tag):
+            invalidations = cache.invalidations
+            invalidate(key_or_tag)
+            CACHE_INVALIDATIONS.labels(cache.name).inc(cache.invalidations - invalidations)
+        return counted_invalidate
+
+    cache.get = counted_get
+    cache.invalidate_tag = counted(invalidate_tag)
+    cache.delete = counted(delete)
+
+
+def metrics_response():
+    if multiprocess is None:
+        abort(501, message="Metrics are not available, prometheus_client is not installed.")
+    if _multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,28 @@
+"""Add counter table for /stats
+
+Revision ID: 3f2a9c1d7b10
+Revises: 
+Create Date: 2026-10-18 13:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are created by the first reconcile (see counter_helper)
+    op.create_table('counter',
+                    sa.Column('name', sa.String(length=50), nullable=False),
+                    sa.Column('value', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('name'))
+
+
+def downgrade():
+    op.drop_table('counter')
@@ -0,0 +1,33 @@
+"""Split the /stats counters into shards
+
+Revision ID: 5d9b2e7f1a48
+Revises: c7e05a9d4f62
+Create Date: 2026-10-18 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9b2e7f1a48'
+down_revision = 'c7e05a9d4f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The existing rows become shard 0; the first reconcile creates the
+    # other shards (see counter_helper)
+    op.add_column('counter', sa.Column('shard', sa.Integer(), nullable=False, server_default='0'))
+    op.drop_constraint('counter_pkey', 'counter', type_='primary')
+    op.create_primary_key('counter_pkey', 'counter', ['name', 'shard'])
+
+
+def downgrade():
+    # Keep each counter's total in its shard 0 row
+    op.execute("UPDATE counter c SET value = (SELECT sum(value) FROM counter s WHERE s.name = c.name) WHERE shard = 0")
+    op.execute("DELETE FROM counter WHERE shard <> 0")
+    op.drop_constraint('counter_pkey', 'counter', type_='primary')
+    op.create_primary_key('counter_pkey', 'counter', ['name'])
+    op.drop_column('counter', 'shard')
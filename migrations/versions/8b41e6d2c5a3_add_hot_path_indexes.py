@@ -0,0 +1,57 @@
+"""Add indexes and uniqueness constraints for the hot queries
+
+Revision ID: 8b41e6d2c5a3
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41e6d2c5a3'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+# Association table -> the column other than user_id
+ASSOCIATION_TABLES = [('user_member_club', 'club_id'),
+                      ('user_admin_club', 'club_id'),
+                      ('user_coach_club', 'club_id'),
+                      ('user_membershiprequest_club', 'club_id'),
+                      ('user_invited_practice', 'practice_id')]
+
+NOTICE_TABLES = ['confirm_notice', 'decline_notice']
+
+
+def upgrade():
+    # The association tables never had keys, so they may hold duplicate or
+    # half-empty rows. Drop those before adding the primary keys (Postgres).
+    for table, column in ASSOCIATION_TABLES:
+        op.execute("DELETE FROM {0} WHERE user_id IS NULL OR {1} IS NULL".format(table, column))
+        op.execute("DELETE FROM {0} a USING {0} b WHERE a.ctid < b.ctid AND a.user_id = b.user_id AND a.{1} = b.{1}".format(table, column))
+        op.create_primary_key('{}_pkey'.format(table), table, ['user_id', column])
+        op.create_index('ix_{}_{}'.format(table, column), table, [column])
+
+    # Keep the first notice of a user for a practice
+    for table in NOTICE_TABLES:
+        op.execute("DELETE FROM {0} a USING {0} b WHERE a.id > b.id AND a.user_id = b.user_id AND a.practice_id = b.practice_id".format(table))
+        op.create_unique_constraint('uq_{}_user_id_practice_id'.format(table), table, ['user_id', 'practice_id'])
+        op.create_index('ix_{}_practice_id'.format(table), table, ['practice_id'])
+
+    op.create_index('ix_practice_club_id_startTime', 'practice', ['club_id', 'startTime'])
+    op.create_index('ix_practice_startTime_id', 'practice', ['startTime', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_practice_startTime_id', table_name='practice')
+    op.drop_index('ix_practice_club_id_startTime', table_name='practice')
+
+    for table in NOTICE_TABLES:
+        op.drop_index('ix_{}_practice_id'.format(table), table_name=table)
+        op.drop_constraint('uq_{}_user_id_practice_id'.format(table), table, type_='unique')
+
+    for table, column in ASSOCIATION_TABLES:
+        op.drop_index('ix_{}_{}'.format(table, column), table_name=table)
+        op.drop_constraint('{}_pkey'.format(table), table, type_='primary')
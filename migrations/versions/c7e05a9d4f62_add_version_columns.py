@@ -0,0 +1,29 @@
+"""Add version columns to user, club and practice for ETags
+
+Revision ID: c7e05a9d4f62
+Revises: 8b41e6d2c5a3
+Create Date: 2026-10-18 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e05a9d4f62'
+down_revision = '8b41e6d2c5a3'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ['user', 'club', 'practice']
+
+
+def upgrade():
+    # Existing rows start at version 1
+    for table in VERSIONED_TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    for table in VERSIONED_TABLES:
+        op.drop_column(table, 'version')
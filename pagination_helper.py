@@ -0,0 +1,166 @@
+import os
+import json
+import base64
+import binascii
+import datetime
+import dateutil.parser
+from flask import request, url_for, jsonify, Response, stream_with_context
+from flask import json as flask_json
+from flask_restful import abort
+from sqlalchemy import and_, or_, types
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('PAGE_SIZE_DEFAULT', 50))
+MAX_PAGE_SIZE = int(os.environ.get('PAGE_SIZE_MAX', 200))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+
+
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Pages are ordered by a unique key, e.g. (id,) or (startTime, id), and the next
+page starts right after the key of the last row of the previous page. Unlike
+OFFSET the DB never reads the rows of earlier pages, so every page costs the
+same and memory per request is bounded by the page size.
+
+Clients ask for ?limit=N (capped at PAGE_SIZE_MAX) and follow the URL in the
+Link: <...>; rel="next" response header. The cursor in that URL is opaque
+(base64 encoded JSON) and must be passed back unchanged.
+
+For exports, ?stream=true returns the whole collection as one JSON list that
+is written while it is read: rows are fetched in keyset chunks of
+STREAM_CHUNK_SIZE and each chunk is serialized and sent before the next one is
+queried.
+"""
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def _integer_range(column_type):
+    # Values the DB column can hold; a key outside them fails in the DB
+    if isinstance(column_type, types.SmallInteger):
+        return -2 ** 15, 2 ** 15 - 1
+    if isinstance(column_type, types.BigInteger):
+        return -2 ** 63, 2 ** 63 - 1
+    return -2 ** 31, 2 ** 31 - 1
+
+
+def _cursor_value(column, value):
+    # The key value of a column from a decoded cursor. Raises ValueError for a
+    # value of the wrong JSON type or out of the column's range; nothing is
+    # coerced, cursors are only ever made by encode_cursor.
+    python_type = column.type.python_type
+    if python_type is datetime.datetime:
+        if not isinstance(value, str):
+            raise ValueError("Cursor value must be a timestamp")
+        return dateutil.parser.parse(value)
+    if python_type is int:
+        low, high = _integer_range(column.type)
+        if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+            raise ValueError("Cursor value must be an integer between {} and {}".format(low, high))
+        return value
+    if not isinstance(value, python_type):
+        raise ValueError("Cursor value must be a {}".format(python_type.__name__))
+    return value
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("Wrong number of cursor values")
+        return [_cursor_value(column, v) for column, v in zip(columns, values)]
+    except (ValueError, TypeError, OverflowError, binascii.Error, UnicodeError):
+        abort(400, message="Invalid pagination cursor: {}".format(cursor))
+
+
+def page_size():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        abort(400, message="Page limit must be an integer. Input was: {}".format(request.args.get('limit')))
+    if limit < 1:
+        abort(400, message="Page limit must be at least 1. Input was: {}".format(limit))
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _after(columns, values):
+    # (c1, c2) > (v1, v2) written out as c1 > v1 OR (c1 = v1 AND c2 > v2), so
+    # it works on every backend and can use a (c1, c2) index.
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*(equal + [column > values[i]])))
+    return or_(*clauses)
+
+
+def _page(query, columns, after_values, limit):
+    if after_values is not None:
+        query = query.filter(_after(columns, after_values))
+    return query.order_by(*[column.asc() for column in columns]).limit(limit).all()
+
+
+def _key(row, columns):
+    return [getattr(row, column.key) for column in columns]
+
+
+def paginate(query, columns):
+    # Returns one page of the query ordered by the given columns, plus the
+    # cursor for the next page (None on the last page). The last column must be
+    # unique, e.g. the primary key.
+    limit = page_size()
+    cursor = request.args.get('cursor')
+    after_values = decode_cursor(cursor, columns) if cursor else None
+    # Fetch one extra row to know if there is a next page
+    rows = _page(query, columns, after_values, limit + 1)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(_key(rows[-1], columns))
+
+
+def stream_requested():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def streamed_response(query, columns, dump):
+    # Streams every row of the query as a JSON list. dump serializes a list of
+    # rows, e.g. lambda rows: fast_serialization.dump(schema, rows).
+    # Chunks are read with keyset queries rather than one long running
+    # yield_per() cursor, since yield_per doesn't work with the joined eager
+    # loads on Practice. Rows of sent chunks are only weakly referenced by the
+    # session and are garbage collected, so memory is bounded by one chunk.
+    def generate():
+        yield '['
+        separator = ''
+        after_values = None
+        while True:
+            rows = _page(query, columns, after_values, STREAM_CHUNK_SIZE)
+            if len(rows) == 0:
+                break
+            yield separator + ','.join(flask_json.dumps(item) for item in dump(rows))
+            separator = ','
+            if len(rows) < STREAM_CHUNK_SIZE:
+                break
+            after_values = _key(rows[-1], columns)
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def next_page_url(next_cursor):
+    args = dict(request.view_args or {})
+    args.update(request.args.to_dict())
+    args['cursor'] = next_cursor
+    args['limit'] = page_size()
+    return url_for(request.endpoint, _external=True, **args)
+
+
+def paginated_response(data, next_cursor):
+    # The body stays a plain JSON list; the next page is linked in the header
+    response = jsonify(data)
+    if next_cursor is not None:
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_page_url(next_cursor))
+    return response
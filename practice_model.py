@@ -2,9 +2,14 @@ from datetime import datetime
 from db_helper import db
 from db_helper import user_invited_practice
 from club_model import Club
+from counter_model import Counter
 
 class Practice(db.Model):
     __tabelname__ = "practice"
+    # club_id + startTime serves the week and day views, startTime + id the
+    # paginated practice list
+    __table_args__ = (db.Index('ix_practice_club_id_startTime', 'club_id', 'startTime'),
+                      db.Index('ix_practice_startTime_id', 'startTime', 'id'))
     id = db.Column(db.Integer, primary_key=True, unique=True, nullable=False)
     name = db.Column(db.String(500), unique=False, nullable=False)
 
@@ -13,6 +18,8 @@ class Practice(db.Model):
 
     startTime = db.Column(db.TIMESTAMP(timezone=False), unique=False, nullable=False)
     durationMinutes = db.Column(db.Integer, unique=False, nullable=False)
+    # Bumped on every write that changes the JSON of the practice (see version_helper)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     invited = db.relationship('User', secondary=user_invited_practice, backref=db.backref('invitedPractices', lazy='dynamic'))
 
     # Define one-to-many relationship with Practice: One Practice can have many
@@ -24,19 +31,50 @@ class Practice(db.Model):
     declined = db.relationship('DeclineNotice', backref='practice', lazy='joined')
 
     def __init__(self, name, club, startTime, durationMinutes):
+        Practice.check_arguments(club, startTime, durationMinutes)
         self.name = name
+        self.club = club
+        self.startTime = startTime
+        self.durationMinutes = durationMinutes
 
-        if club is not None and isinstance(club, Club):
-            self.club = club
-        else:
+    @staticmethod
+    def check_arguments(club, startTime, durationMinutes):
+        if club is None or not isinstance(club, Club):
             raise ValueError("Club argument must be of type Club and not null. Practice.init was passed {}".format(club))
 
-        if startTime is not None and isinstance(startTime, datetime):
-            self.startTime = startTime
-        else:
+        if startTime is None or not isinstance(startTime, datetime):
             raise ValueError("StartTime argument must be of type DateTime and not null. Practice.init was passed {}".format(startTime))
 
-        if durationMinutes is not None and isinstance(durationMinutes, int) and durationMinutes > 0:
-            self.durationMinutes = durationMinutes
+        if durationMinutes is None or not isinstance(durationMinutes, int) or durationMinutes <= 0:
+            raise ValueError("DurationMinutes argument must be of type int, not null and greater than 0. Practice.init was passed {}".format(startTime))
+
+    @staticmethod
+    def bulk_create(connection, name, club, startTimes, durationMinutes, invited):
+        # Inserts one practice per startTime, all inviting the same users, and
+        # returns the new practice IDs in startTime order. Uses one multi-row
+        # INSERT for the practices (on Postgres) and one executemany for the
+        # invites, instead of the ORM flushing one statement per row.
+        # Runs on the given connection, so pass db.session.connection() to make
+        # it part of the session transaction.
+        for startTime in startTimes:
+            Practice.check_arguments(club, startTime, durationMinutes)
+
+        table = Practice.__table__
+        rows = [{'name': name, 'club_id': club.id, 'startTime': startTime, 'durationMinutes': durationMinutes}
+                for startTime in startTimes]
+        if connection.dialect.name == 'postgresql':
+            # Map IDs back by startTime rather than trusting RETURNING order
+            result = connection.execute(table.insert().values(rows).returning(table.c.id, table.c.startTime))
+            ids_by_start = {startTime: id for id, startTime in result}
+            practice_ids = [ids_by_start[row['startTime']] for row in rows]
         else:
-            raise ValueError("DurationMinutes argument must be of type int, not null and greater than 0. Practice.init was passed {}".format(startTime))
\ No newline at end of file
+            # No multi-row RETURNING, so get the IDs one insert at a time
+            practice_ids = [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+        invites = [{'user_id': user.id, 'practice_id': practice_id}
+                   for practice_id in practice_ids for user in invited]
+        if len(invites) > 0:
+            connection.execute(user_invited_practice.insert(), invites)
+        # Core inserts don't trigger the counter flush hooks (counter_helper)
+        Counter.increment(connection, {'practices': len(practice_ids), 'invited': len(invites)})
+        return practice_ids
@@ -9,6 +9,10 @@ from datetime import timedelta
 from validation_schemas import PracticeValidationSchema
 # Imports for serialization (flask-marshmallow)
 from serialization_schemas import PracticeSchema
+import fast_serialization
+import pagination_helper
+import view_cache_helper
+import version_helper
 import user_model
 import club_model
 import practice_model
@@ -18,8 +22,10 @@ import decline_notice_model
 # Imports for DB connection
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from db_helper import db
+from resolver_helper import resolver
 # Imports for security
 from auth_helper import auth
+import replica_helper
 
 
 """
@@ -34,17 +40,30 @@ class Practices(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, practiceID=None):
         if practiceID:
             # practiceID type (must be int) is enforced by Flask-RESTful
             practice = practice_model.Practice.query.get(practiceID)
             if practice is None:
                 abort(404, message="Practice with ID {} does not exist.".format(practiceID))
-            return jsonify(self.practice_schema.dump(practice).data)
+            # Answer 304 from the version, before serializing the practice
+            etag = version_helper.etag(practice)
+            not_modified = version_helper.not_modified(etag)
+            if not_modified is not None:
+                return not_modified
+            return version_helper.with_etag(jsonify(fast_serialization.dump(self.practice_schema, practice)), etag)
         else:
-            # Get on practice resource lists all practices
-            practices = practice_model.Practice.query.filter(1==1).order_by(practice_model.Practice.startTime.asc()).all()
-            return jsonify(self.practices_schema.dump(practices).data)
+            # Get on practice resource lists all practices, one page at a time
+            # or streamed in full, ordered by startTime (id breaks ties between
+            # practices at the same time)
+            if pagination_helper.stream_requested():
+                return pagination_helper.streamed_response(practice_model.Practice.query,
+                                                           [practice_model.Practice.startTime, practice_model.Practice.id],
+                                                           lambda practices: fast_serialization.dump(self.practices_schema, practices))
+            practices, next_cursor = pagination_helper.paginate(practice_model.Practice.query,
+                                                                [practice_model.Practice.startTime, practice_model.Practice.id])
+            return pagination_helper.paginated_response(fast_serialization.dump(self.practices_schema, practices), next_cursor)
 
     @auth.login_required
     def post(self):
@@ -58,7 +77,7 @@ class Practices(Resource):
 
         # All request.json input parameters are validated by Marshmallow
         # schema.
-        club = club_model.Club.query.get(request.json['club'])
+        club = resolver().get(club_model.Club, request.json['club'])
 
         try:
             st = dateutil.parser.parse(request.json['startTime'])
@@ -68,12 +87,7 @@ class Practices(Resource):
             invited = []
             # Fecth all invited users and add to practice
             if 'invited' in request.json:
-                user_objects = []
-                for userID in request.json['invited']:
-                    u = user_model.User.query.get(userID)
-                    if u is not None:
-                        user_objects.append(u)
-                invited = user_objects
+                invited = resolver().get_many(user_model.User, request.json['invited'])
 
             # We do not touch confirmed or declined here (POST metod),
             # as POST equals 'create' and then no one can have accepted,
@@ -84,18 +98,22 @@ class Practices(Resource):
             if 'repeats' in request.json and request.json['repeats'] is not None:
                 repeats = int(request.json['repeats'])
 
-            for x in range(0, repeats):
-                practice = practice_model.Practice(request.json['name'], club, st, request.json['durationMinutes'])
-                practice.invited = invited
-
-                # Add a practice
-                db.session.add(practice)
-
-                # Add one week to the starttime (for next practice)
-                st = st + timedelta(weeks=1)
-
+            # One practice per week, starting at the given starttime
+            startTimes = [st + timedelta(weeks=x) for x in range(0, max(repeats, 1))]
+
+            # Insert all practices and their invites with a few multi-row
+            # statements in the session transaction, rather than the ORM
+            # flushing every practice and invite row one by one.
+            practice_ids = practice_model.Practice.bulk_create(db.session.connection(), request.json['name'], club,
+                                                               startTimes, request.json['durationMinutes'], invited)
+            view_cache_helper.practices_changed(db.session, club.id, startTimes)
+            version_helper.bump(db.session, club_model.Club, [club.id])
+            version_helper.bump(db.session, user_model.User, [user.id for user in invited])
             db.session.commit()
 
+            # Return the last created practice (one SELECT)
+            practice = practice_model.Practice.query.get(practice_ids[-1])
+
         except ValueError as err:
             debug_code = debug_code_generator.gen_debug_code()
             self.logger.error("ValueError happend in practice_model.py (catched in practice_resource.py). Debug code: {}. Stacktrace follows: ".format(debug_code))
@@ -109,7 +127,7 @@ class Practices(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.practice_schema.dump(practice).data)
+        return jsonify(fast_serialization.dump(self.practice_schema, practice))
 
     @auth.login_required
     def put(self, practiceID):
@@ -147,11 +165,7 @@ class Practices(Resource):
 
         # Fecth all invited users and add to practice
         if 'invited' in request.json:
-            user_objects = []
-            for userID in request.json['invited']:
-                u = user_model.User.query.get(userID)
-                if u is not None:
-                    user_objects.append(u)
+            user_objects = resolver().get_many(user_model.User, request.json['invited'])
             # If a player is uninvited, we need to remove any confirm/decline
             # notice for that player for this practice
             uninvited_players = set(map(lambda x: x.id, practice.invited)) - set(request.json['invited'])
@@ -180,7 +194,7 @@ class Practices(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.practice_schema.dump(practice).data)
+        return jsonify(fast_serialization.dump(self.practice_schema, practice))
 
     @auth.login_required
     def delete(self, practiceID):
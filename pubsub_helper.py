@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import queue
+import select
+import logging
+import threading
+from sqlalchemy import event, text
+from flask_sqlalchemy import SignallingSession
+
+# postgres: LISTEN/NOTIFY, reaching the subscribers in every worker. memory:
+# in-process only, for tests and local runs on SQLite. auto picks postgres on
+# a Postgres DATABASE_URL.
+PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'auto')
+# Messages a subscriber may fall behind by before it is dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('PUBSUB_QUEUE_SIZE', 100))
+# Longest wait before reconnecting a dropped LISTEN connection
+RECONNECT_MAX_DELAY = 30
+
+NOTIFY = text("SELECT pg_notify(:channel, :payload)")
+
+# Sent to the subscribers after messages may have been lost (LISTEN
+# connection dropped, subscriber queue full)
+RESYNC = {'event': 'resync'}
+
+
+"""
+Publish/subscribe between the requests of all workers.
+
+publish() is transactional: the message goes out when the session's
+transaction commits, and never if it rolls back. On Postgres it is a
+pg_notify() in the transaction, which Postgres delivers on commit to every
+worker's LISTEN connection. Each worker opens that connection (in a
+background thread, a greenlet under gevent) on the first subscribe() and
+hands the messages to its local subscribers. In memory, the message goes
+straight to the local subscribers after the commit. notify() sends right
+away instead, for messages about changes that are already committed.
+
+A subscriber that falls behind by more than PUBSUB_QUEUE_SIZE messages gets
+RESYNC and is dropped; after a lost LISTEN connection is back, all
+subscribers get RESYNC, as messages may have been missed meanwhile.
+"""
+
+
+def _notify_params(channel, message):
+    return {'channel': channel, 'payload': json.dumps(message, separators=(',', ':'))}
+
+
+"""
+A subscriber's queue of messages on one channel, optionally only those
+match(message) is true for.
+"""
+class Subscription(object):
+
+    def __init__(self, broker, channel, match=None, maxsize=None):
+        self.broker = broker
+        self.channel = channel
+        self.match = match
+        self.closed = False
+        self._queue = queue.Queue(maxsize=maxsize or SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, message):
+        if self.closed or (self.match is not None and message is not RESYNC and not self.match(message)):
+            return
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # Too slow: replace the backlog with a resync and stop
+            self.close()
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            self._queue.put_nowait(RESYNC)
+
+    def get(self, timeout=None):
+        # The next message, or None after timeout seconds without one
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self.broker.unsubscribe(self)
+
+
+"""
+In-process broker
+"""
+class MemoryBroker(object):
+
+    def __init__(self):
+        # channel -> set of Subscriptions
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, match=None, maxsize=None):
+        subscription = Subscription(self, channel, match, maxsize)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.get(subscription.channel, set()).discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def dispatch(self, channel, message):
+        # Hands a message to the local subscribers of the channel
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def resync(self):
+        with self._lock:
+            subscriptions = [s for subscriptions in self._subscriptions.values() for s in subscriptions]
+        for subscription in subscriptions:
+            subscription.deliver(RESYNC)
+
+    def send(self, session, messages):
+        # Called before commit with the (channel, message) pairs of the
+        # transaction; the memory broker dispatches them after the commit
+        session.info['pubsub_sent'] = messages
+
+    def sent(self, session):
+        for channel, message in session.info.pop('pubsub_sent', ()):
+            self.dispatch(channel, message)
+
+    def notify(self, channel, messages):
+        # Sends messages right away, outside of any session transaction
+        for message in messages:
+            self.dispatch(channel, message)
+
+
+"""
+Broker over Postgres LISTEN/NOTIFY. Local fan-out as in MemoryBroker, fed by
+one LISTEN connection per worker outside the connection pool.
+"""
+class PostgresBroker(MemoryBroker):
+
+    def __init__(self, engine):
+        MemoryBroker.__init__(self)
+        self.engine = engine
+        self.logger = logging.getLogger('root')
+        self._channels = set()
+        self._listener = None
+        self._connection = None
+
+    def subscribe(self, channel, match=None, maxsize=None):
+        subscription = MemoryBroker.subscribe(self, channel, match, maxsize)
+        with self._lock:
+            if channel not in self._channels:
+                self._channels.add(channel)
+                if self._connection is not None:
+                    self._listen(self._connection, [channel])
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._run, name='pubsub-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def send(self, session, messages):
+        for channel, message in messages:
+            session.execute(NOTIFY, _notify_params(channel, message))
+
+    def sent(self, session):
+        # Delivered through LISTEN, to this worker as well
+        pass
+
+    def notify(self, channel, messages):
+        # One transaction on a pooled connection; NOTIFY is only sent on commit
+        with self.engine.begin() as connection:
+            for message in messages:
+                connection.execute(NOTIFY, _notify_params(channel, message))
+
+    def _connect(self):
+        # A connection of its own, like the pool would open one
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        connection = self.engine.dialect.dbapi.connect(*cargs, **cparams)
+        connection.set_isolation_level(0)  # autocommit, LISTEN takes effect at once
+        return connection
+
+    def _listen(self, connection, channels):
+        cursor = connection.cursor()
+        for channel in channels:
+            cursor.execute('LISTEN "{}"'.format(channel.replace('"', '""')))
+        cursor.close()
+
+    def _run(self):
+        delay = 1
+        lost = False
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                with self._lock:
+                    self._listen(connection, self._channels)
+                    self._connection = connection
+                if lost:
+                    # Messages may have been sent while there was no LISTEN
+                    self.resync()
+                delay = 1
+                while True:
+                    select.select([connection], [], [], 60)
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.dispatch(notify.channel, json.loads(notify.payload))
+            except Exception:
+                self.logger.exception("pubsub LISTEN connection lost, reconnecting in {} s".format(delay))
+                lost = True
+                with self._lock:
+                    self._connection = None
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+_broker = []
+
+
+def broker():
+    if not _broker:
+        from db_helper import db
+        if uses_listen_connection(str(db.engine.url)):
+            _broker.append(PostgresBroker(db.engine))
+        else:
+            _broker.append(MemoryBroker())
+    return _broker[0]
+
+
+def uses_listen_connection(database_url):
+    # Whether each worker opens a LISTEN connection besides its pool
+    if PUBSUB_BACKEND not in ('auto', 'postgres', 'memory'):
+        raise ValueError("PUBSUB_BACKEND must be one of auto, postgres or memory. Was: {}".format(PUBSUB_BACKEND))
+    return PUBSUB_BACKEND == 'postgres' or (PUBSUB_BACKEND == 'auto' and database_url.startswith('postgres'))
+
+
+def subscribe(channel, match=None, maxsize=None):
+    # Subscription to the messages of a channel, optionally only those
+    # match(message) is true for, holding up to maxsize (default
+    # PUBSUB_QUEUE_SIZE) undelivered messages
+    return broker().subscribe(channel, match, maxsize)
+
+
+def publish(session, channel, message):
+    # Publishes message (JSON serializable) on channel when the session's
+    # transaction commits
+    session.info.setdefault('pubsub_messages', []).append((channel, message))
+
+
+def notify(channel, messages):
+    # Sends messages (JSON serializable) on channel now
+    broker().notify(channel, messages)
+
+
+@event.listens_for(SignallingSession, 'before_commit')
+def _send(session):
+    # Flush first, flush hooks may publish
+    session.flush()
+    messages = session.info.pop('pubsub_messages', None)
+    if messages:
+        broker().send(session, messages)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _sent(session):
+    if _broker:
+        _broker[0].sent(session)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget(session):
+    session.info.pop('pubsub_messages', None)
+    session.info.pop('pubsub_sent', None)
@@ -0,0 +1,96 @@
+import os
+import time
+import random
+from functools import wraps
+from contextlib import contextmanager
+from flask import request, _request_ctx_stack
+from cache_helper import TTLCache
+import auth_helper
+
+# Comma separated URLs of read replicas of DATABASE_URL. Without any, all
+# queries go to the primary.
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Seconds after a user's own write during which their reads stay on the
+# primary. Should be above the replication lag.
+STALENESS_WINDOW = float(os.environ.get('DB_REPLICA_STALENESS_WINDOW', 10))
+# Cookie carrying the end of the window, so that other workers see it too
+PRIMARY_COOKIE = 'badmin_primary_until'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# userID -> True while the user's reads are pinned to the primary
+recent_writers = TTLCache('replica_recent_writers', max_size=10000, ttl=STALENESS_WINDOW)
+
+
+"""
+Routing of read-only requests to read replicas.
+
+Replicas are Flask-SQLAlchemy binds (replica0, replica1, ...) without any
+tables of their own. GET handlers decorated with read_only() run their queries
+on one of them, picked per request; everything else, including the auth
+lookups that run before the handler, uses the primary.
+
+A user who just wrote something might not find it on a replica yet. For
+STALENESS_WINDOW seconds after a successful write, the user's reads stay on
+the primary: the worker that handled the write remembers the user, and the
+response sets a cookie for the other workers (clients without a cookie jar
+only get the former).
+
+Locally, point DATABASE_REPLICA_URLS at a copy of the SQLite file or at a
+second Postgres database.
+"""
+
+
+def binds():
+    # Bind key -> URL, for SQLALCHEMY_BINDS
+    return {'replica{}'.format(i): url for i, url in enumerate(REPLICA_URLS)}
+
+
+def engines(db):
+    return [db.get_engine(db.get_app(), bind=bind_key) for bind_key in binds()]
+
+
+def _pinned_to_primary():
+    userID = auth_helper.current_user_id()
+    if userID is not None and recent_writers.get(userID):
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_only(f):
+    # Routes the queries of a GET handler to a replica. Put it below
+    # @auth.login_required, so the user is known.
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if REPLICA_URLS and not _pinned_to_primary():
+            _request_ctx_stack.top.db_replica = random.choice(list(binds()))
+        return f(*args, **kwargs)
+    return decorated
+
+
+@contextmanager
+def primary():
+    # Runs the queries of the block on the primary, also inside a read_only
+    # handler
+    ctx = _request_ctx_stack.top
+    bind_key = getattr(ctx, 'db_replica', None)
+    ctx.db_replica = None
+    try:
+        yield
+    finally:
+        ctx.db_replica = bind_key
+
+
+def record_write(response):
+    # Call after a request; starts the staleness window after a successful write
+    if not REPLICA_URLS or STALENESS_WINDOW <= 0:
+        return response
+    if request.method in WRITE_METHODS and response.status_code < 400:
+        userID = auth_helper.current_user_id()
+        if userID is not None:
+            recent_writers.set(userID, True)
+        response.set_cookie(PRIMARY_COOKIE, '{:.0f}'.format(time.time() + STALENESS_WINDOW),
+                            max_age=int(STALENESS_WINDOW) + 1, httponly=True)
+    return response
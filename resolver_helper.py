@@ -0,0 +1,95 @@
+from flask import _request_ctx_stack
+
+# Max number of IDs in one IN (...) list
+MAX_IN_SIZE = 500
+
+
+"""
+Request-scoped, batched lookup of model objects by ID.
+
+Validators and resources used to call Model.query.get() once per ID, so a club
+PUT with 200 members cost 200 queries to validate and 200 more to build the
+relationship. A resolver collects the IDs of a request and loads all pending
+IDs of a model with one IN (...) query the first time any of them is needed.
+Both the validation schemas and the resources read from the same resolver,
+so every object is loaded at most once per request.
+
+Use resolver() to get the resolver of the current request.
+"""
+class IDResolver(object):
+
+    def __init__(self):
+        # model -> {id: object or None if it doesn't exist}
+        self._resolved = {}
+        # model -> set of ids to load on next lookup
+        self._pending = {}
+
+    def collect(self, model, ids):
+        # Queue IDs to be loaded together with the next lookup for the model
+        resolved = self._resolved.setdefault(model, {})
+        pending = self._pending.setdefault(model, set())
+        for id in ids:
+            if id not in resolved:
+                pending.add(id)
+
+    def get(self, model, id):
+        self.collect(model, [id])
+        self._load(model)
+        return self._resolved[model].get(id)
+
+    def get_many(self, model, ids):
+        # Objects for the given IDs in the given order, each once (the
+        # association tables have a primary key on the pair, so a repeated
+        # ID would fail the insert). IDs that don't exist are skipped.
+        ids = list(ids)
+        self.collect(model, ids)
+        self._load(model)
+        resolved = self._resolved[model]
+        objects = []
+        seen = set()
+        for id in ids:
+            obj = resolved.get(id)
+            if obj is not None and obj.id not in seen:
+                seen.add(obj.id)
+                objects.append(obj)
+        return objects
+
+    def missing(self, model, ids):
+        # IDs among the given IDs that don't exist
+        ids = list(ids)
+        self.collect(model, ids)
+        self._load(model)
+        resolved = self._resolved[model]
+        return [id for id in ids if resolved.get(id) is None]
+
+    def _load(self, model):
+        pending = self._pending.get(model)
+        if not pending:
+            return
+        resolved = self._resolved.setdefault(model, {})
+        # IDs from request.json may be ints or numeric strings, like for
+        # Model.query.get(). Anything else is recorded as missing.
+        ids = {}
+        for id in pending:
+            resolved[id] = None
+            try:
+                ids.setdefault(int(id), []).append(id)
+            except (TypeError, ValueError):
+                pass
+        keys = list(ids)
+        for i in range(0, len(keys), MAX_IN_SIZE):
+            for obj in model.query.filter(model.id.in_(keys[i:i + MAX_IN_SIZE])).all():
+                for id in ids[obj.id]:
+                    resolved[id] = obj
+        pending.clear()
+
+
+def resolver():
+    # The resolver of the current request. Outside a request every call gets
+    # a new resolver.
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        return IDResolver()
+    if not hasattr(ctx, 'id_resolver'):
+        ctx.id_resolver = IDResolver()
+    return ctx.id_resolver
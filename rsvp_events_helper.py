@@ -0,0 +1,123 @@
+import os
+import time
+import json
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+from flask_sqlalchemy import SignallingSession
+import pubsub_helper
+import metrics_helper
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+# pub/sub channel of all RSVP events (a Postgres NOTIFY channel)
+CHANNEL = 'badmin_rsvp'
+# Seconds between keepalive comments on an idle stream. Heroku's router closes
+# connections that send nothing for 55 seconds.
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+# Seconds after which a stream ends and the client reconnects, so that
+# streams move to fresh workers after a deploy or restart
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 300))
+# Milliseconds the client waits before reconnecting (the SSE retry field)
+SSE_RETRY = int(os.environ.get('SSE_RETRY', 3000))
+# User IDs per invited/uninvited event; a NOTIFY payload is limited to 8000 bytes
+MAX_USER_IDS = 500
+
+# Notice model -> events of its creation and deletion
+NOTICE_EVENTS = {confirm_notice_model.ConfirmNotice: ('confirmed', 'unconfirmed'),
+                 decline_notice_model.DeclineNotice: ('declined', 'undeclined')}
+
+
+"""
+Events of RSVP changes, published to every worker when they are committed
+(see pubsub_helper) and streamed to clients as Server-Sent Events.
+
+  confirmed, declined       a notice was created (it replaces an opposite
+                            answer of the user, without an extra event)
+                            {event, clubId, practiceId, userId, noticeId}
+  unconfirmed, undeclined   a notice was deleted, directly or by uninviting
+                            the user; same fields
+  invited, uninvited        users were added to or removed from the invitees
+                            of a practice; {event, clubId, practiceId, userIds}
+
+Notices created with Core statements are published by rsvp_helper with
+answered(). Deleted notices and invite changes are found by an after_flush
+hook.
+
+The events are hints, not a log: a client (re)loads the view it shows when
+the stream opens and when it gets a resync event, which is sent when events
+may have been lost (see pubsub_helper).
+"""
+
+
+def answered(session, model, notice_id, user_id, practice_id, club_id):
+    # Publishes the creation of a notice when the session commits
+    pubsub_helper.publish(session, CHANNEL, {'event': NOTICE_EVENTS[model][0], 'clubId': club_id,
+                                             'practiceId': practice_id, 'userId': user_id, 'noticeId': notice_id})
+
+
+def _club_ids(session, practices, practice_ids):
+    # {practice ID: club ID}, from the flushed practices where possible
+    club_ids = {practice.id: practice.club_id for practice in practices}
+    missing = set(practice_ids) - set(club_ids)
+    if len(missing) > 0:
+        club_ids.update(session.query(practice_model.Practice.id, practice_model.Practice.club_id)
+                        .filter(practice_model.Practice.id.in_(missing)))
+    return club_ids
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _collect_events(session, flush_context):
+    events = []
+    for obj in session.deleted:
+        if type(obj) in NOTICE_EVENTS:
+            events.append({'event': NOTICE_EVENTS[type(obj)][1], 'practiceId': obj.practice_id,
+                           'userId': obj.user_id, 'noticeId': obj.id})
+    practices = [obj for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+                 if isinstance(obj, practice_model.Practice)]
+    for practice in practices:
+        if practice in session.deleted:
+            continue
+        # Invitees that were never loaded haven't changed
+        history = attributes.get_history(practice, 'invited', passive=attributes.PASSIVE_NO_INITIALIZE)
+        for name, users in (('invited', history.added), ('uninvited', history.deleted)):
+            user_ids = sorted(user.id for user in users or ())
+            for start in range(0, len(user_ids), MAX_USER_IDS):
+                events.append({'event': name, 'practiceId': practice.id, 'userIds': user_ids[start:start + MAX_USER_IDS]})
+    if len(events) == 0:
+        return
+    club_ids = _club_ids(session, practices, [e['practiceId'] for e in events])
+    for e in events:
+        e['clubId'] = club_ids.get(e['practiceId'])
+        pubsub_helper.publish(session, CHANNEL, e)
+
+
+def _frame(name, data):
+    return 'event: {}\ndata: {}\n\n'.format(name, json.dumps(data, separators=(',', ':')))
+
+
+def stream(match):
+    # Generator of a text/event-stream of the events match(event) is true for.
+    # It subscribes before yielding the first chunk, which the WSGI server
+    # sends along with the headers, so a client that loads its view once the
+    # stream is open misses no event.
+    def generate():
+        subscription = pubsub_helper.subscribe(CHANNEL, match)
+        metrics_helper.stream_opened()
+        try:
+            yield 'retry: {}\n\n'.format(SSE_RETRY)
+            ts_end = time.time() + SSE_MAX_DURATION
+            while time.time() < ts_end:
+                message = subscription.get(timeout=min(SSE_HEARTBEAT, max(ts_end - time.time(), 0)))
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _frame(message['event'], message)
+                if message is pubsub_helper.RESYNC and subscription.closed:
+                    # Dropped for falling behind
+                    break
+        finally:
+            subscription.close()
+            metrics_helper.stream_closed()
+
+    return generate()
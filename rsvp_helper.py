@@ -0,0 +1,175 @@
+import os
+from sqlalchemy import text, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from db_helper import db
+import counter_model
+import confirm_notice_model
+import decline_notice_model
+import practice_model
+import user_model
+import view_cache_helper
+import rsvp_events_helper
+
+# Max number of answers in one batch request
+MAX_BATCH_SIZE = int(os.environ.get('RSVP_BATCH_MAX', 100))
+
+# Answer status in requests -> notice model
+STATUSES = {'confirmed': confirm_notice_model.ConfirmNotice,
+            'declined': decline_notice_model.DeclineNotice}
+
+# Notice model -> (the opposite notice model, counter names of both)
+ANSWERS = {confirm_notice_model.ConfirmNotice: (decline_notice_model.DeclineNotice, 'confirmed', 'declined'),
+           decline_notice_model.DeclineNotice: (confirm_notice_model.ConfirmNotice, 'declined', 'confirmed')}
+
+# Answers of one user for one practice are written one at a time: the
+# DELETE of the opposite answer can't see an uncommitted answer of a concurrent
+# transaction, so both would be kept. On Postgres a transaction-scoped
+# advisory lock on (user_id, practice_id), taken in a statement of its own so
+# the answer statement's snapshot sees what the previous holder committed.
+POSTGRES_ANSWER_LOCK = "SELECT pg_advisory_xact_lock(:user_id, :practice_id)"
+
+# On Postgres one statement removes the opposite answer, inserts the new one
+# unless the user already gave it (unique (user_id, practice_id)), and keeps
+# the /stats counters in step. All CTEs run even though only inserted is read.
+POSTGRES_ANSWER = """
+WITH replaced AS (
+    DELETE FROM {opposite} WHERE user_id = :user_id AND practice_id = :practice_id RETURNING id
+), inserted AS (
+    INSERT INTO {table} ("timestamp", user_id, practice_id) VALUES (:timestamp, :user_id, :practice_id)
+    ON CONFLICT (user_id, practice_id) DO NOTHING
+    RETURNING id
+), counted AS (
+    UPDATE counter SET value = value + CASE name WHEN :counter THEN (SELECT count(*) FROM inserted)
+                                                 ELSE -(SELECT count(*) FROM replaced) END
+    WHERE name IN (:counter, :opposite_counter) AND shard = :shard
+)
+SELECT id FROM inserted
+"""
+
+
+"""
+Raised by answer() when the user already gave the same answer for the practice.
+"""
+class AlreadyAnswered(Exception):
+    pass
+
+
+def _insert_postgres(connection, model, user_id, practice_id, timestamp):
+    opposite, counter, opposite_counter = ANSWERS[model]
+    connection.execute(text(POSTGRES_ANSWER_LOCK), user_id=user_id, practice_id=practice_id)
+    sql = text(POSTGRES_ANSWER.format(table=model.__table__.name, opposite=opposite.__table__.name))
+    row = connection.execute(sql, user_id=user_id, practice_id=practice_id, timestamp=timestamp,
+                             counter=counter, opposite_counter=opposite_counter,
+                             shard=counter_model.Counter.shard_of(connection)).first()
+    if row is None:
+        raise AlreadyAnswered()
+    return row[0]
+
+
+def _insert_generic(connection, model, user_id, practice_id, timestamp):
+    # Same as the Postgres statement, as separate statements in one transaction.
+    # The unique constraint still makes a concurrent duplicate fail. Answers
+    # are serialized on the user's row instead of an advisory lock (SQLite
+    # serializes all writes anyway and leaves out FOR UPDATE).
+    opposite, counter, opposite_counter = ANSWERS[model]
+    opposite_table = opposite.__table__
+    user_table = user_model.User.__table__
+    connection.execute(select([user_table.c.id]).where(user_table.c.id == user_id).with_for_update())
+    replaced = connection.execute(opposite_table.delete().where((opposite_table.c.user_id == user_id) &
+                                                                (opposite_table.c.practice_id == practice_id))).rowcount
+    try:
+        notice_id = connection.execute(model.__table__.insert(), user_id=user_id, practice_id=practice_id,
+                                       timestamp=timestamp).inserted_primary_key[0]
+    except IntegrityError:
+        # Like on Postgres the delete stands if the transaction is committed
+        counter_model.Counter.increment(connection, {opposite_counter: -replaced})
+        raise AlreadyAnswered()
+    counter_model.Counter.increment(connection, {counter: 1, opposite_counter: -replaced})
+    return notice_id
+
+
+def insert_answer(model, user_id, practice_id, timestamp, club_id=None):
+    # Records a ConfirmNotice or DeclineNotice (model) of the user for the
+    # practice in the session transaction, replacing an opposite answer.
+    # Returns the new notice ID. Raises AlreadyAnswered if the user already gave
+    # this answer. club_id is the practice's club, looked up if not given.
+    connection = db.session.connection()
+    # Core statements don't trigger the flush hooks of the practice views
+    # and RSVP events. Answers don't bump versions, the ETags of practices
+    # and users cover their notices (see version_helper).
+    view_cache_helper.notices_changed(db.session, [practice_id])
+    if connection.dialect.name == 'postgresql':
+        notice_id = _insert_postgres(connection, model, user_id, practice_id, timestamp)
+    else:
+        notice_id = _insert_generic(connection, model, user_id, practice_id, timestamp)
+    if club_id is None:
+        club_id = db.session.query(practice_model.Practice.club_id).filter(practice_model.Practice.id == practice_id).scalar()
+    rsvp_events_helper.answered(db.session, model, notice_id, user_id, practice_id, club_id)
+    return notice_id
+
+
+def notice_object(model, notice_id, user_id, practice_id, timestamp):
+    # A persistent notice object built from known values, for serializing the
+    # response without SELECTing the new row back
+    notice = model(timestamp)
+    notice.id = notice_id
+    notice.user_id = user_id
+    notice.practice_id = practice_id
+    make_transient_to_detached(notice)
+    db.session.add(notice)
+    return notice
+
+
+def answer(model, user_id, practice_id, timestamp):
+    # Records the answer and commits. Returns the new notice object.
+    try:
+        notice_id = insert_answer(model, user_id, practice_id, timestamp)
+    except AlreadyAnswered:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return notice_object(model, notice_id, user_id, practice_id, timestamp)
+
+
+def _existing_answers(user_id, practice_ids):
+    # {practice ID: status} for the given practices the user already answered
+    answers = {}
+    for status, model in STATUSES.items():
+        query = db.session.query(model.practice_id).filter(model.user_id == user_id, model.practice_id.in_(practice_ids))
+        for (practice_id,) in query:
+            answers[practice_id] = status
+    return answers
+
+
+def answer_many(user_id, answers, timestamp):
+    # Records many answers of one user, given as (practice ID, status) pairs
+    # with distinct practice IDs. All answers are checked with three queries
+    # (practices that exist, existing confirms, existing declines) and written
+    # in one transaction with one commit.
+    # Returns one (HTTP status code, notice object or error message) per
+    # answer, in order. An answer that can't be recorded doesn't stop the
+    # others.
+    practice_ids = [practice_id for practice_id, _ in answers]
+    # {practice ID: club ID} of the practices that exist
+    found = dict(db.session.query(practice_model.Practice.id, practice_model.Practice.club_id)
+                 .filter(practice_model.Practice.id.in_(practice_ids)))
+    existing = _existing_answers(user_id, practice_ids)
+
+    results = []
+    for practice_id, status in answers:
+        model = STATUSES[status]
+        if practice_id not in found:
+            results.append((404, "Practice with ID {} does not exist.".format(practice_id)))
+        elif existing.get(practice_id) == status:
+            results.append((409, "The practice for this user is already {}.".format(status)))
+        else:
+            try:
+                results.append((201, insert_answer(model, user_id, practice_id, timestamp, found[practice_id])))
+            except AlreadyAnswered:
+                # Answered by a concurrent request since the check above
+                results.append((409, "The practice for this user is already {}.".format(status)))
+    db.session.commit()
+
+    return [(code, notice_object(STATUSES[status], result, user_id, practice_id, timestamp) if code == 201 else result)
+            for (practice_id, status), (code, result) in zip(answers, results)]
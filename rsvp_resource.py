@@ -0,0 +1,76 @@
+from flask import jsonify
+from flask_restful import Resource, abort, request
+import debug_code_generator
+import dateutil.parser
+import traceback
+import logging
+# Imports for input validation (marsmallow)
+from validation_schemas import RSVPBatchValidationSchema
+# Imports for serialization (flask-marshmallow)
+from serialization_schemas import ConfirmNoticeSchema, DeclineNoticeSchema
+import fast_serialization
+import rsvp_helper
+# Imports for DB connection
+from sqlalchemy.exc import IntegrityError
+# Imports for security
+from auth_helper import auth
+import auth_helper
+
+
+"""
+Batch RSVP: the authenticated user confirms or declines many practices with
+one request, e.g. a whole week or month at once.
+
+POST {"timestamp": ..., "answers": [{"practiceId": 1, "status": "confirmed"},
+{"practiceId": 2, "status": "declined"}, ...]}. Like a POST on /confirmNotice
+or /declineNotice each answer replaces an opposite answer to the practice.
+The response lists the result of every answer in request order:
+{"practiceId", "status", "code"} plus "notice" for a recorded answer (code 201)
+or "message" for one that wasn't (404 unknown practice, 409 already given).
+"""
+class RSVPs(Resource):
+
+    def __init__(self):
+        self.notice_schemas = {'confirmed': ConfirmNoticeSchema(), 'declined': DeclineNoticeSchema()}
+        self.rsvp_batch_validation_schema = RSVPBatchValidationSchema()
+        self.logger = logging.getLogger('root')
+
+    @auth.login_required
+    def post(self):
+        # Input validation using Marshmallow.
+        _, errors = self.rsvp_batch_validation_schema.load(request.json)
+
+        if len(errors) > 0:
+            abort(400, message="The reqeust input could bot be validated. There were the following validation errors: {}".format(errors))
+
+        answers = [(int(answer['practiceId']), answer['status']) for answer in request.json['answers']]
+
+        try:
+            dt = dateutil.parser.parse(request.json['timestamp'])
+            # Assume input timestring is in UTC and drop all timezone info
+            dt = dt.replace(tzinfo=None)
+
+            results = rsvp_helper.answer_many(auth_helper.current_user_id(), answers, dt)
+
+        except ValueError as err:
+            debug_code = debug_code_generator.gen_debug_code()
+            self.logger.error("ValueError happend in rsvp_helper.py (catched in rsvp_resource.py). Debug code: {}. Stacktrace follows: ".format(debug_code))
+            self.logger.error(traceback.format_exc())
+            self.logger.error(err)
+            abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
+        except IntegrityError as err:
+            debug_code = debug_code_generator.gen_debug_code()
+            self.logger.error("SQL IntegrityError happend in rsvp_resource.py. Debug code: {}. Stacktrace follows: ".format(debug_code))
+            self.logger.error(traceback.format_exc())
+            self.logger.error(err)
+            abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
+
+        response = []
+        for (practice_id, status), (code, result) in zip(answers, results):
+            item = {'practiceId': practice_id, 'status': status, 'code': code}
+            if code == 201:
+                item['notice'] = fast_serialization.dump(self.notice_schemas[status], result)
+            else:
+                item['message'] = result
+            response.append(item)
+        return jsonify(response)
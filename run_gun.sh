@@ -4,4 +4,5 @@ export DATABASE_URL='postgresql://localhost'
 export TOKEN_GEN_SECRET_KEY='SuperSecretKey'
 echo "Running.."
 #python badmin_api.py 5000
-gunicorn -k sync -w 1 -b 127.0.0.1:5000 badmin_api:app
+export WEB_CONCURRENCY=1
+gunicorn -c gunicorn_config.py -k sync -b 127.0.0.1:5000 badmin_api:app
@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+from flask import request, _request_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Log a warning for requests that run more SQL statements than this, to catch
+# N+1 query patterns. 0 turns the check off.
+SQL_QUERY_WARN_THRESHOLD = int(os.environ.get('SQL_QUERY_WARN_THRESHOLD', 0))
+
+
+"""
+Per-request timing: wall time of the request, number of SQL statements and
+time spent in them.
+
+The totals are sent in a Server-Timing header (shown per request in the
+browser dev tools) and logged as one key=value line per request:
+
+    request endpoint=practices_all method=GET status=200 duration_ms=41.2 sql_count=3 sql_ms=12.8 pool_wait_ms=0.0
+
+Statements are counted by cursor execute hooks on every engine. State lives on
+the request context (flask.g is shared between requests, badmin_api pushes a
+global app context), so concurrent gevent requests are counted apart.
+The line is logged on teardown, which for a streamed response is after the
+last chunk; the header of a streamed response only has the statements run
+before streaming started.
+"""
+class RequestTiming(object):
+
+    def __init__(self):
+        self.ts_start = time.time()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        # Time spent waiting for a pooled DB connection (see db_pool_helper)
+        self.pool_wait = 0.0
+        # Set by finish_request(). Requests that fail with an unhandled
+        # exception never get there.
+        self.status = None
+
+    def duration(self):
+        return time.time() - self.ts_start
+
+    def server_timing(self):
+        return 'db;dur={:.1f};desc="{} queries", pool;dur={:.1f}, total;dur={:.1f}'.format(
+            self.sql_time * 1000, self.sql_count, self.pool_wait * 1000, self.duration() * 1000)
+
+
+def current():
+    # The timing of the current request, or None outside a request
+    ctx = _request_ctx_stack.top
+    return getattr(ctx, 'timing', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    ts_start = conn.info['query_start_time'].pop()
+    timing = current()
+    if timing is not None:
+        timing.sql_count += 1
+        timing.sql_time += time.time() - ts_start
+
+
+def start_request():
+    _request_ctx_stack.top.timing = RequestTiming()
+
+
+def finish_request(response):
+    # Adds the Server-Timing header
+    timing = current()
+    if timing is not None:
+        timing.status = response.status_code
+        response.headers['Server-Timing'] = timing.server_timing()
+    return response
+
+
+def log_request(exception=None):
+    timing = current()
+    if timing is None:
+        return
+    status = timing.status if exception is None and timing.status is not None else 500
+    logger = logging.getLogger('root')
+    logger.info("request endpoint={} method={} status={} duration_ms={:.1f} sql_count={} sql_ms={:.1f} pool_wait_ms={:.1f}".format(
+        request.endpoint, request.method, status, timing.duration() * 1000, timing.sql_count, timing.sql_time * 1000,
+        timing.pool_wait * 1000))
+    if SQL_QUERY_WARN_THRESHOLD and timing.sql_count > SQL_QUERY_WARN_THRESHOLD:
+        logger.warning("request endpoint={} method={} sql_count={} exceeds SQL_QUERY_WARN_THRESHOLD={}, check for N+1 queries".format(
+            request.endpoint, request.method, timing.sql_count, SQL_QUERY_WARN_THRESHOLD))
@@ -0,0 +1,237 @@
+import io
+import os
+import csv
+import json
+import codecs
+import itertools
+from sqlalchemy.exc import IntegrityError, DBAPIError
+from db_helper import db, user_member_club
+from validation_schemas import UserImportValidationSchema
+import hashing_helper
+import version_helper
+import counter_model
+import user_model
+import club_model
+
+# Rows validated, hashed and inserted together, in one transaction. Small
+# enough that the results of a chunk (mostly hashing time) go out well
+# within Heroku's 55 second idle limit of a streamed response.
+IMPORT_CHUNK_SIZE = int(os.environ.get('USER_IMPORT_CHUNK_SIZE', 50))
+# Rows read from one import; the rest is reported as not imported
+IMPORT_MAX_ROWS = int(os.environ.get('USER_IMPORT_MAX_ROWS', 5000))
+
+FORMATS = ('csv', 'jsonl')
+# Columns of the users inserted, in COPY order
+USER_COLUMNS = ('name', 'email', 'phone', 'hashed_password')
+
+
+"""
+Bulk import of users from a CSV or JSON lines roster, one row or line per
+user:
+
+  name,email,phone,password,clubs
+  Anna,anna@example.com,12345678,secret,1;4
+
+  {"name": "Anna", "email": "anna@example.com", "phone": 12345678, "password": "secret", "clubs": [1, 4]}
+
+phone, password and clubs are optional; a user without a password can't log
+in until one is set. CSV clubs are separated by ; or spaces.
+
+The roster is read as a stream and handled IMPORT_CHUNK_SIZE rows at a time.
+Per chunk: the rows are validated, their emails checked against the
+database with one IN (...) query (and against the earlier rows), their
+clubs with another, the passwords hashed on the hashing pool
+(hashing_helper.hash_passwords), and the users and their club memberships
+inserted with COPY on Postgres or executemany inserts elsewhere, then
+committed. A row that can't be imported gets an error result and doesn't
+stop the others.
+
+import_users() yields one result per row, in roster order:
+{"row", "email", "code"} plus "userId" for a created user (code 201) or
+"message" (400 invalid, 404 unknown club, 409 email in use, 413 over
+IMPORT_MAX_ROWS). A roster that can't be read on (not UTF-8, or broken CSV)
+ends with a 400 result for the row where reading stopped; the rows before it
+are imported.
+"""
+
+
+def read_rows(lines, format):
+    # Yields the rows of a roster as dicts, or as ValueError if a line can't
+    # be parsed. lines is an iterable of text lines.
+    if format == 'csv':
+        for row in csv.DictReader(lines):
+            # Empty cells are missing values
+            row = {key.strip(): value.strip() for key, value in row.items()
+                   if key is not None and value is not None and value.strip() != ''}
+            if 'clubs' in row:
+                row['clubs'] = row['clubs'].replace(';', ' ').split()
+            yield row
+    elif format == 'jsonl':
+        for line in lines:
+            if line.strip() == '':
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as err:
+                yield ValueError("Not valid JSON: {}".format(err))
+                continue
+            yield row if isinstance(row, dict) else ValueError("Not a JSON object.")
+    else:
+        raise ValueError("Roster format must be one of {}. Was: {}".format(', '.join(FORMATS), format))
+
+
+def decode(stream):
+    # Text lines of a byte stream (e.g. request.stream), decoded as it is read
+    return codecs.iterdecode(stream, 'utf-8-sig')
+
+
+def _error(number, email, code, message):
+    return {'row': number, 'email': email, 'code': code, 'message': message}
+
+
+def _existing_emails(emails):
+    query = db.session.query(user_model.User.email).filter(user_model.User.email.in_(emails))
+    return set(email for (email,) in query)
+
+
+def _copy(connection, table, columns, rows):
+    # COPY FROM STDIN of rows (tuples in columns order) into table
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # An unquoted empty field is NULL
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    statement = 'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        table.name, ', '.join('"{}"'.format(column) for column in columns))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except connection.dialect.dbapi.Error as err:
+        # The raw cursor raises psycopg2 errors; wrap them like a statement
+        # run by SQLAlchemy would be (IntegrityError for a taken email)
+        raise DBAPIError.instance(statement, None, err, connection.dialect.dbapi.Error, dialect=connection.dialect) from err
+    finally:
+        cursor.close()
+
+
+def _insert(connection, table, columns, rows):
+    if len(rows) == 0:
+        return
+    if connection.dialect.driver == 'psycopg2':
+        _copy(connection, table, columns, rows)
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def _insert_users(users, memberships):
+    # Inserts users (rows in USER_COLUMNS order) and the memberships of each
+    # ({email: club IDs}) and commits. Returns {email: new user ID}.
+    connection = db.session.connection()
+    _insert(connection, user_model.User.__table__, USER_COLUMNS, users)
+    emails = [user[1] for user in users]
+    ids = dict((email, id) for id, email in db.session.query(user_model.User.id, user_model.User.email)
+               .filter(user_model.User.email.in_(emails)))
+    members = [(ids[email], clubID) for email, clubIDs in memberships.items() for clubID in clubIDs]
+    _insert(connection, user_member_club, ('user_id', 'club_id'), members)
+    # Core inserts don't trigger the counter and version flush hooks. New
+    # users aren't in any cache yet; the member lists of the clubs change.
+    counter_model.Counter.increment(connection, {'users': len(users)})
+    version_helper.bump(db.session, club_model.Club, set(clubID for _, clubID in members))
+    db.session.commit()
+    return ids
+
+
+def _import_chunk(rows, seen, known_clubs, default_clubs):
+    # rows: (row number, row dict or ValueError). seen: emails of earlier
+    # rows. known_clubs: {club ID: exists}. Returns the results of the rows.
+    schema = UserImportValidationSchema()
+    results = {}
+    valid = []
+    for number, row in rows:
+        if isinstance(row, ValueError):
+            results[number] = _error(number, None, 400, str(row))
+            continue
+        data, errors = schema.load(row)
+        email = row.get('email')
+        if len(errors) > 0:
+            results[number] = _error(number, email, 400, "The row could not be validated. There were the following validation errors: {}".format(errors))
+        elif data['email'] in seen:
+            results[number] = _error(number, email, 409, "The email {} is given in an earlier row.".format(email))
+        else:
+            seen.add(data['email'])
+            data['clubs'] = sorted(set(data.get('clubs', [])) | set(default_clubs))
+            valid.append((number, data))
+
+    # One query for the clubs not seen in earlier chunks
+    unknown = set(clubID for _, data in valid for clubID in data['clubs']) - set(known_clubs)
+    if len(unknown) > 0:
+        found = set(id for (id,) in db.session.query(club_model.Club.id).filter(club_model.Club.id.in_(unknown)))
+        known_clubs.update((clubID, clubID in found) for clubID in unknown)
+
+    for attempt in range(2):
+        existing = _existing_emails([data['email'] for _, data in valid]) if len(valid) > 0 else set()
+        # Don't hold a pooled connection while hashing
+        db.session.rollback()
+        accepted = []
+        for number, data in valid:
+            missing = [clubID for clubID in data['clubs'] if not known_clubs[clubID]]
+            if data['email'] in existing:
+                results[number] = _error(number, data['email'], 409, "The email {} is already in use.".format(data['email']))
+            elif len(missing) > 0:
+                results[number] = _error(number, data['email'], 404, "Club with ID {} does not exist.".format(missing[0]))
+            else:
+                accepted.append((number, data))
+        with_password = [data for _, data in accepted if data.get('password')]
+        hashed = dict(zip([data['email'] for data in with_password],
+                          hashing_helper.hash_passwords([data['password'] for data in with_password])))
+        users = [(data['name'], data['email'], data.get('phone'), hashed.get(data['email'])) for _, data in accepted]
+        try:
+            ids = _insert_users(users, dict((data['email'], data['clubs']) for _, data in accepted)) if len(users) > 0 else {}
+            break
+        except IntegrityError:
+            # An email was taken by a concurrent request since the check;
+            # check again
+            db.session.rollback()
+            if attempt == 1:
+                raise
+    for number, data in accepted:
+        results[number] = {'row': number, 'email': data['email'], 'code': 201, 'userId': ids[data['email']]}
+    return [results[number] for number, _ in rows]
+
+
+def _read_chunk(numbered):
+    # Up to IMPORT_CHUNK_SIZE (row number, row) pairs, and the error that
+    # stopped reading the roster, if any
+    chunk = []
+    try:
+        for item in itertools.islice(numbered, IMPORT_CHUNK_SIZE):
+            chunk.append(item)
+    except (csv.Error, UnicodeDecodeError) as err:
+        return chunk, err
+    return chunk, None
+
+
+def import_users(lines, format, clubs=()):
+    # Imports the users of a roster (an iterable of text lines in format),
+    # making each a member of their clubs and of clubs. Yields the result of
+    # each row as it is committed.
+    seen = set()
+    known_clubs = {}
+    numbered = enumerate(read_rows(lines, format), 1)
+    last = 0
+    while True:
+        chunk, unreadable = _read_chunk(numbered)
+        if len(chunk) == 0 and unreadable is None:
+            return
+        last = chunk[-1][0] if len(chunk) > 0 else last
+        over = [number for number, _ in chunk if number > IMPORT_MAX_ROWS]
+        chunk = [(number, row) for number, row in chunk if number <= IMPORT_MAX_ROWS]
+        for result in _import_chunk(chunk, seen, known_clubs, clubs):
+            yield result
+        if len(over) > 0:
+            yield _error(over[0], None, 413, "Only {} rows are imported at a time. This row and the rest were not imported.".format(IMPORT_MAX_ROWS))
+            return
+        if unreadable is not None:
+            yield _error(last + 1, None, 400, "The roster could not be read from this row on: {}. This row and the rest were not imported.".format(unreadable))
+            return
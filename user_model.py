@@ -1,6 +1,6 @@
 from db_helper import db
 import os
-from passlib.apps import custom_app_context as pwd_context
+import hashing_helper
 from itsdangerous import (TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired)
 
 class User(db.Model):
@@ -9,6 +9,8 @@ class User(db.Model):
     email = db.Column(db.String(500), unique=True, nullable=False)
     phone = db.Column(db.Integer, unique=False, nullable=True)
     hashed_password = db.Column(db.String(500), unique=False, nullable=True)
+    # Bumped on every write that changes the JSON of the user (see version_helper)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     # 'clubs' attribute/backref is defined in club_model
     # 'adminOfClubs' attribute/backref is defined in club_model
     # 'coachInClubs' attribute/backref is defined in club_model
@@ -29,24 +31,34 @@ class User(db.Model):
         self.phone = phone
         self.hashed_password = self.hash_password(password)
 
+    # Hashing runs in the hashing pool so it doesn't stall the gevent worker
     def hash_password(self, password):
-        return pwd_context.hash(password)
+        return hashing_helper.hash_password(password)
 
     def verify_password(self, password):
-        return pwd_context.verify(password, self.hashed_password)
+        return hashing_helper.verify_password(password, self.hashed_password)
 
     def generate_auth_token(self, expiration=604800): #7 days x 24 hours x 60 minutes x 60 secs
         s = Serializer(os.environ['TOKEN_GEN_SECRET_KEY'], expires_in=expiration)
         return s.dumps({'id': self.id})
 
     @staticmethod
-    def verify_auth_token(token):
+    def decode_auth_token(token):
+        # Returns (userID, expiry as unix timestamp) for a valid token, or
+        # None. Does not touch the DB.
         s = Serializer(os.environ['TOKEN_GEN_SECRET_KEY'])
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except SignatureExpired:
             return None # valid token, but expired
         except BadSignature:
             return None # invalid token
-        user = User.query.get(data['id'])
+        return data['id'], header['exp']
+
+    @staticmethod
+    def verify_auth_token(token):
+        decoded = User.decode_auth_token(token)
+        if decoded is None:
+            return None
+        user = User.query.get(decoded[0])
         return user
@@ -1,23 +1,33 @@
-from flask import jsonify
+from flask import jsonify, Response, stream_with_context
 from flask_restful import Resource, abort, request
 import debug_code_generator
 import traceback
+import os
+import json
 import logging
-from datetime import date
+from datetime import date, datetime, time, timedelta
+from marshmallow import utils
 # Imports for input validation (marsmallow)
 from validation_schemas import UserValidationSchema
 # Imports for serialization (marshmallow)
 from serialization_schemas import UserSchema, PracticeSchema
+import fast_serialization
+import pagination_helper
+import version_helper
+import user_import_helper
+import hashing_helper
 import user_model
 import club_model
 import practice_model
 import confirm_notice_model
 import decline_notice_model
 # Imports for DB connection
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import Date, cast, asc
-from db_helper import db
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import and_
+from db_helper import db, user_invited_practice
+from resolver_helper import resolver
 from auth_helper import auth
+import replica_helper
 
 """
 Resource for handling non user-specific actions on User resource
@@ -30,17 +40,27 @@ class Users(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, userID=None):
         if userID:
             # userID type (must be int) is enforced by Flask-RESTful
             user = user_model.User.query.get(userID)
             if user is None:
                 abort(404, message="User with ID {} does not exist.".format(userID))
-            return jsonify(self.user_schema.dump(user).data)
+            # Answer 304 from the version, before serializing the user
+            etag = version_helper.etag(user)
+            not_modified = version_helper.not_modified(etag)
+            if not_modified is not None:
+                return not_modified
+            return version_helper.with_etag(jsonify(fast_serialization.dump(self.user_schema, user)), etag)
         else:
-            # Get on user resource without ID lists all users
-            users = user_model.User.query.filter(1 == 1).all()
-            return jsonify(self.users_schema.dump(users).data)
+            # Get on user resource without ID lists all users, one page at a
+            # time or streamed in full
+            if pagination_helper.stream_requested():
+                return pagination_helper.streamed_response(user_model.User.query, [user_model.User.id],
+                                                           lambda users: fast_serialization.dump(self.users_schema, users))
+            users, next_cursor = pagination_helper.paginate(user_model.User.query, [user_model.User.id])
+            return pagination_helper.paginated_response(fast_serialization.dump(self.users_schema, users), next_cursor)
 
     # Don't require login to create user
     def post(self):
@@ -73,7 +93,7 @@ class Users(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.user_schema.dump(user).data)
+        return jsonify(fast_serialization.dump(self.user_schema, user))
 
     @auth.login_required
     def put(self, userID):
@@ -109,19 +129,16 @@ class Users(Resource):
         # if 'phone' in request.json:
         #     user.phone = request.json['phone']
 
-        # If password is PUT'ed that means a change of password
+        # If password is PUT'ed that means a change of password. Cached
+        # credentials for the user are dropped by the after_update hook in
+        # auth_helper.
         if 'password' in request.json:
             hashedPassword = user.hash_password(request.json['password'])
             user.hashed_password = hashedPassword
 
         # Fecth all users' clubs and add changes to user
         if 'clubs' in request.json:
-            club_objects = []
-            for clubID in request.json['clubs']:
-                c = club_model.Club.query.get(clubID)
-                if c is not None:
-                    club_objects.append(c)
-            user.clubs = club_objects
+            user.clubs = resolver().get_many(club_model.Club, request.json['clubs'])
 
         # # Fecth all users' practices and add to user
         # if 'practices' in request.json:
@@ -140,12 +157,67 @@ class Users(Resource):
             self.logger.error(err)
             abort(500, message="Somehow the validations passed but the input still did not match the SQL schema. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code))
 
-        return jsonify(self.user_schema.dump(user).data)
+        return jsonify(fast_serialization.dump(self.user_schema, user))
 
     @auth.login_required
     def delete(self, practiceID):
         abort(501)
 
+
+"""
+Bulk import of users from a CSV or JSON lines roster (see user_import_helper).
+
+POST the roster as the request body, with Content-Type text/csv or
+application/x-ndjson (or ?format=csv|jsonl). ?club=<id> (repeatable) makes
+every imported user a member of the club as well. The roster is read as it
+arrives and the response streams one result per row as a JSON list, as the
+rows are committed in chunks.
+"""
+class UserImport(Resource):
+
+    # Content type -> roster format
+    FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl',
+               'application/x-jsonlines': 'jsonl'}
+
+    def __init__(self):
+        self.logger = logging.getLogger('root')
+
+    @auth.login_required
+    def post(self):
+        roster_format = request.args.get('format') or self.FORMATS.get(request.mimetype)
+        if roster_format not in user_import_helper.FORMATS:
+            abort(415, message="The roster must be CSV (text/csv) or JSON lines (application/x-ndjson), or name its format in ?format=csv|jsonl.")
+        try:
+            clubs = [int(clubID) for clubID in request.args.getlist('club')]
+        except ValueError:
+            abort(400, message="The club parameter must be a club ID. Input was: {}".format(request.args.getlist('club')))
+        if len(clubs) > 0:
+            missing = set(clubs) - set(id for (id,) in db.session.query(club_model.Club.id).filter(club_model.Club.id.in_(clubs)))
+            if len(missing) > 0:
+                abort(404, message="Club with ID {} does not exist.".format(sorted(missing)[0]))
+
+        def generate():
+            yield '['
+            separator = ''
+            try:
+                for result in user_import_helper.import_users(user_import_helper.decode(request.stream), roster_format, clubs):
+                    yield separator + json.dumps(result)
+                    separator = ','
+            except hashing_helper.HashingPoolFull as err:
+                db.session.rollback()
+                yield separator + json.dumps({'code': 503, 'message': "{} The rows listed before were imported, the rest were not.".format(err.description)})
+            except SQLAlchemyError as err:
+                # The status is sent already; end the list with the error
+                db.session.rollback()
+                debug_code = debug_code_generator.gen_debug_code()
+                self.logger.error("SQL Error happend in user_import_helper.py (catched in user_resource.py). Debug code: {}. Stacktrace follows: ".format(debug_code))
+                self.logger.error(traceback.format_exc())
+                self.logger.error(err)
+                yield separator + json.dumps({'code': 500, 'message': "The database blew up. The rows listed before were imported, the rest were not. For security reasons no further details on the error will be provided other than a debug-code: {}. Please email the API developer with the debug-code and yell at him!".format(debug_code)})
+            yield ']'
+
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
 """
 
 """
@@ -156,13 +228,98 @@ class UserPractices(Resource):
         self.logger = logging.getLogger('root')
 
     @auth.login_required
+    @replica_helper.read_only
     def get(self, userID):
         # We only need to return practices where the player is invited
         # since we keep player in invited list af confirm/decline (tracked by
         # ConfirmNotice or DeclineNotice)
-        practices = db.session.query(practice_model.Practice)\
-                            .filter((cast(practice_model.Practice.startTime, Date) >= date.today()) &
-                                  (practice_model.Practice.invited.any(user_model.User.id == userID)))\
-                            .order_by(asc(practice_model.Practice.startTime)).all()
+        practices = upcoming_practices(userID, today_start()).all()
+
+        return jsonify(fast_serialization.dump(self.practices_schema, practices))
+
+
+# Default and max number of days ahead the schedule covers
+SCHEDULE_HORIZON_DAYS = int(os.environ.get('SCHEDULE_HORIZON_DAYS', 28))
+SCHEDULE_HORIZON_MAX_DAYS = int(os.environ.get('SCHEDULE_HORIZON_MAX_DAYS', 366))
+
+
+def today_start():
+    # Midnight starting today. startTime >= today_start() selects the same
+    # practices as cast(startTime, Date) >= date.today(), but can use an index
+    # on startTime.
+    return datetime.combine(date.today(), time.min)
+
+
+def upcoming_practices(userID, start, end=None):
+    # Practices the user is invited to that start at or after start (and
+    # before end), driven from the user's rows in user_invited_practice
+    # rather than a correlated EXISTS per practice.
+    query = practice_model.Practice.query\
+        .join(user_invited_practice, user_invited_practice.c.practice_id == practice_model.Practice.id)\
+        .filter(user_invited_practice.c.user_id == userID,
+                practice_model.Practice.startTime >= start)
+    if end is not None:
+        query = query.filter(practice_model.Practice.startTime < end)
+    return query.order_by(practice_model.Practice.startTime.asc(), practice_model.Practice.id.asc())
+
+
+def schedule_query(userID, start, end):
+    # Columns of the practices the user is invited to in [start, end), plus
+    # the IDs of the user's own confirm and decline notice for each
+    Practice = practice_model.Practice
+    ConfirmNotice = confirm_notice_model.ConfirmNotice
+    DeclineNotice = decline_notice_model.DeclineNotice
+    return db.session.query(Practice.id, Practice.name, Practice.club_id, Practice.startTime, Practice.durationMinutes,
+                            ConfirmNotice.id.label('confirmNoticeId'), DeclineNotice.id.label('declineNoticeId'))\
+        .select_from(user_invited_practice)\
+        .join(Practice, Practice.id == user_invited_practice.c.practice_id)\
+        .outerjoin(ConfirmNotice, and_(ConfirmNotice.practice_id == Practice.id, ConfirmNotice.user_id == userID))\
+        .outerjoin(DeclineNotice, and_(DeclineNotice.practice_id == Practice.id, DeclineNotice.user_id == userID))\
+        .filter(user_invited_practice.c.user_id == userID,
+                Practice.startTime >= start,
+                Practice.startTime < end)
+
+
+"""
+The upcoming schedule of a user: the practices the user is invited to in the
+next ?days=N days (default SCHEDULE_HORIZON_DAYS), with the user's own answer
+("rsvp": "confirmed", "declined" or null) instead of the full confirmed and
+declined lists. Paginated like the list endpoints (?limit=N, Link header).
+
+One query per page: only the practice columns and the user's own notices are
+read, and both the time bound and the invite lookup can use an index, so a
+page costs the same no matter how many past practices there are.
+"""
+class UserSchedule(Resource):
+
+    def __init__(self):
+        self.logger = logging.getLogger('root')
+
+    @auth.login_required
+    @replica_helper.read_only
+    def get(self, userID):
+        try:
+            days = int(request.args.get('days', SCHEDULE_HORIZON_DAYS))
+        except ValueError:
+            abort(400, message="Parameter days must be an integer. Input was: {}".format(request.args.get('days')))
+        if days < 1 or days > SCHEDULE_HORIZON_MAX_DAYS:
+            abort(400, message="Parameter days must be between 1 and {}. Input was: {}".format(SCHEDULE_HORIZON_MAX_DAYS, days))
+
+        start = today_start()
+        query = schedule_query(userID, start, start + timedelta(days=days))
+        rows, next_cursor = pagination_helper.paginate(query, [practice_model.Practice.startTime, practice_model.Practice.id])
+        return pagination_helper.paginated_response([self._schedule_item(row) for row in rows], next_cursor)
 
-        return jsonify(self.practices_schema.dump(practices).data)
+    def _schedule_item(self, row):
+        rsvp = None
+        if row.confirmNoticeId is not None:
+            rsvp = 'confirmed'
+        elif row.declineNoticeId is not None:
+            rsvp = 'declined'
+        return {'id': row.id,
+                'name': row.name,
+                'club': row.club_id,
+                'startTime': utils.isoformat(row.startTime),
+                'durationMinutes': row.durationMinutes,
+                'rsvp': rsvp,
+                'noticeId': row.confirmNoticeId if rsvp == 'confirmed' else row.declineNoticeId}
@@ -2,6 +2,8 @@ from marshmallow import Schema, fields, ValidationError, validate
 import user_model
 import club_model
 import practice_model
+from resolver_helper import resolver
+import rsvp_helper
 
 """
 Custom validators and helpers
@@ -12,11 +14,9 @@ def _is_list_with_valid_userIDs(listUserIDs):
     if isinstance(lst, str):
         raise ValidationError("The parameter is of type string, and should be of type list. Input was: {}".format(listUserIDs))
 
-    lst = list(listUserIDs)
-    for userID in lst:
-        u = user_model.User.query.get(userID)
-        if u is None:
-            raise ValidationError("The parameter contains a ID that is not a valid userID. Input was: {}".format(listUserIDs))
+    # All IDs are looked up with one query (see resolver_helper)
+    if len(resolver().missing(user_model.User, listUserIDs)) > 0:
+        raise ValidationError("The parameter contains a ID that is not a valid userID. Input was: {}".format(listUserIDs))
 
 
 def _is_list_with_valid_clubIDs(listClubIDs):
@@ -25,11 +25,9 @@ def _is_list_with_valid_clubIDs(listClubIDs):
     if isinstance(lst, str):
         raise ValidationError("The parameter is of type string, and should be of type list. Input was: {}".format(listClubIDs))
 
-    lst = list(listClubIDs)
-    for clubID in lst:
-        u = club_model.Club.query.get(clubID)
-        if u is None:
-            raise ValidationError("The parameter contains a ID that is not a valid clubID. Input was: {}".format(listClubIDs))
+    # All IDs are looked up with one query (see resolver_helper)
+    if len(resolver().missing(club_model.Club, listClubIDs)) > 0:
+        raise ValidationError("The parameter contains a ID that is not a valid clubID. Input was: {}".format(listClubIDs))
 
 
 def _is_list_with_valid_practiceIDs(listPracticeIDs):
@@ -38,28 +36,31 @@ def _is_list_with_valid_practiceIDs(listPracticeIDs):
     if isinstance(lst, str):
         raise ValidationError("The parameter is of type string, and should be of type list. Input was: {}".format(listPracticeIDs))
 
-    lst = list(listPracticeIDs)
-    for practiceID in lst:
-        u = practice_model.Practice.query.get(practiceID)
-        if u is None:
-            raise ValidationError("The parameter contains a ID that is not a valid practiceID. Input was: {}".format(listPracticeIDs))
+    # All IDs are looked up with one query (see resolver_helper)
+    if len(resolver().missing(practice_model.Practice, listPracticeIDs)) > 0:
+        raise ValidationError("The parameter contains a ID that is not a valid practiceID. Input was: {}".format(listPracticeIDs))
 
 
 def _is_valid_club_ID(clubID):
-        club = club_model.Club.query.get(clubID)
+        club = resolver().get(club_model.Club, clubID)
         if club is None:
             raise ValidationError("Practice clubID must be ID of exiting club. Input was: {}".format(clubID))
 
 def _is_valid_user_ID(userID):
-    user = user_model.User.query.get(userID)
+    user = resolver().get(user_model.User, userID)
     if user is None:
         raise ValidationError("User does not exist. Input was: {}".format(userID))
 
 def _is_valid_practice_ID(practiceID):
-    practice = practice_model.Practice.query.get(practiceID)
+    practice = resolver().get(practice_model.Practice, practiceID)
     if practice is None:
         raise ValidationError("Practice does not exist. Input was: {}".format(practiceID))
 
+def _is_list_with_distinct_practiceIDs(answers):
+    practiceIDs = [answer.get('practiceId') for answer in answers]
+    if len(set(practiceIDs)) != len(practiceIDs):
+        raise ValidationError("A practice can only be answered once per request. Input was: {}".format(practiceIDs))
+
 """
 Defintions of Marshmallow shcemas for validating JSON input.
 """
@@ -89,6 +90,15 @@ class UserValidationSchema(Schema):
     clubs = fields.List(fields.Int(), validate=_is_list_with_valid_clubIDs)
     practices = fields.List(fields.Int(), validate=_is_list_with_valid_practiceIDs)
 
+# A row of a bulk user import (see user_import_helper). The clubs are checked
+# for the whole import at once, not per row.
+class UserImportValidationSchema(Schema):
+    name = fields.String(required=True, validate=validate.Length(min=1, error="User name cannot be an empty string."))
+    email = fields.Email(required=True)
+    phone = fields.Int(required=False, allow_none=True)
+    password = fields.String(required=False, allow_none=True)
+    clubs = fields.List(fields.Int(), required=False)
+
 class DeclineNoticeValidationSchema(Schema):
     userId = fields.Int(required=True, validate=_is_valid_user_ID)
     practiceId= fields.Int(required=True, validate=_is_valid_practice_ID)
@@ -98,3 +108,13 @@ class ConfirmNoticeValidationSchema(Schema):
     userId = fields.Int(required=True, validate=_is_valid_user_ID)
     practiceId= fields.Int(required=True, validate=_is_valid_practice_ID)
     timestamp = fields.DateTime(required=True)
+
+class RSVPValidationSchema(Schema):
+    practiceId = fields.Int(required=True)
+    status = fields.String(required=True, validate=validate.OneOf(list(rsvp_helper.STATUSES), error="Status must be one of {choices}. Input was: {input}"))
+
+class RSVPBatchValidationSchema(Schema):
+    timestamp = fields.DateTime(required=True)
+    answers = fields.Nested(RSVPValidationSchema, many=True, required=True,
+                            validate=[validate.Length(min=1, max=rsvp_helper.MAX_BATCH_SIZE, error="Between {min} and {max} answers can be given per request."),
+                                      _is_list_with_distinct_practiceIDs])
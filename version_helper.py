@@ -0,0 +1,166 @@
+import hashlib
+from flask import request, current_app
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import attributes, object_session
+from flask_sqlalchemy import SignallingSession
+import compression_helper
+import user_model
+import club_model
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+# Models with a version column
+VERSIONED_MODELS = (user_model.User, club_model.Club, practice_model.Practice)
+NOTICE_MODELS = (confirm_notice_model.ConfirmNotice, decline_notice_model.DeclineNotice)
+
+
+"""
+Version stamps of Users, Clubs and Practices, and the ETags built from them.
+
+The version column of a row is bumped in the transaction of every write that
+changes its JSON: its own columns, but also the IDs it lists of other rows.
+A new practice changes the practice list of its club and the invited
+practices of its invitees, new club members change their users, and so on.
+
+Confirms and declines are the exception. They are the hot write, and bumping
+their practice and user would lock those rows until the commit, queueing all
+concurrent answers for a practice. The ETags of practices and users cover
+their notices instead: a practice's from its notices, which are loaded with
+it anyway, a user's from the count and highest ID of its confirms and
+declines (one indexed query; IDs only grow, so a changed set of notices
+changes one of them). The version in their JSON doesn't count answers.
+
+ORM writes are found by an after_flush hook, from the history of the flushed
+objects. Writes that bypass the ORM call bump() (see user_import_helper and
+Practice.bulk_create in practice_resource). The bumps of a transaction are
+de-duplicated and run as one UPDATE ... SET version = version + 1 per table
+just before it commits.
+
+GET handlers compare the ETag from the version with If-None-Match and answer
+304 before serializing anything.
+"""
+
+
+def bump(session, model, ids):
+    # Marks rows of a versioned model as changed in the current transaction
+    _pending(session).update((model, id) for id in ids if id is not None)
+
+
+def _pending(session):
+    return session.info.setdefault('version_bumps', set())
+
+
+def _ids(objects):
+    return [obj.id for obj in objects if obj is not None]
+
+
+def _related(session, obj):
+    # (model, id) of the versioned rows whose JSON lists obj, and that obj
+    # was added to or removed from by this flush
+    related = set()
+    whole = obj in session.new or obj in session.deleted
+    for relationship in attributes.instance_state(obj).mapper.relationships:
+        model = relationship.mapper.class_
+        if model not in VERSIONED_MODELS:
+            continue
+        # Collections that were never loaded haven't changed
+        history = attributes.get_history(obj, relationship.key, passive=attributes.PASSIVE_NO_INITIALIZE)
+        changed = list(history.added or ()) + list(history.deleted or ())
+        if whole:
+            changed += list(history.unchanged or ())
+        related.update((model, id) for id in _ids(changed))
+    return related
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _collect_bumps(session, flush_context):
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, VERSIONED_MODELS):
+            if obj not in session.deleted:
+                pending.add((type(obj), obj.id))
+            pending.update(_related(session, obj))
+        if isinstance(obj, practice_model.Practice):
+            # The club may be set by club_id only
+            history = attributes.get_history(obj, 'club_id')
+            if obj in session.new or obj in session.deleted or history.has_changes():
+                pending.update((club_model.Club, id) for id in history.sum() if id is not None)
+
+
+@event.listens_for(SignallingSession, 'before_commit')
+def _apply_bumps(session):
+    # The commit flushes after this hook, so flush first to see everything
+    session.flush()
+    pending = session.info.pop('version_bumps', None)
+    if not pending:
+        return
+    for model in VERSIONED_MODELS:
+        ids = sorted(id for pending_model, id in pending if pending_model is model)
+        if len(ids) > 0:
+            table = model.__table__
+            session.execute(table.update().where(table.c.id.in_(ids)).values(version=table.c.version + 1))
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget(session):
+    session.info.pop('version_bumps', None)
+
+
+def _notice_columns(notice):
+    return [notice.id, notice.user_id, notice.practice_id, notice.timestamp.isoformat()]
+
+
+def _practice_state(practice):
+    # Version and notices of a practice; the notices are eager loaded
+    return [practice.version, [_notice_columns(notice) for notice in practice.confirmed],
+            [_notice_columns(notice) for notice in practice.declined]]
+
+
+def _user_notices(user):
+    # (count, highest ID) of the confirms and declines of a user
+    columns = []
+    for model in NOTICE_MODELS:
+        table = model.__table__
+        columns += [select([func.count(table.c.id)]).where(table.c.user_id == user.id).as_scalar(),
+                    select([func.max(table.c.id)]).where(table.c.user_id == user.id).as_scalar()]
+    return list(object_session(user).execute(select(columns)).first())
+
+
+def etag(obj):
+    # Strong ETag of a User, Club or Practice, or of a notice
+    if isinstance(obj, NOTICE_MODELS):
+        # Notices are never updated, only created and deleted. SQLite may
+        # reuse the ID of a deleted row, so the ETag covers all columns.
+        return '{}-{}-{}'.format(type(obj).__name__, obj.id, _digest(_notice_columns(obj)[1:]))
+    if isinstance(obj, practice_model.Practice):
+        return 'Practice-{}-{}'.format(obj.id, _digest(_practice_state(obj)))
+    if isinstance(obj, user_model.User):
+        return 'User-{}-{}-{}'.format(obj.id, obj.version, _digest(_user_notices(obj)))
+    return '{}-{}-{}'.format(type(obj).__name__, obj.id, obj.version)
+
+
+def practices_etag(tag, practices):
+    # ETag of a week or day view (see view_cache_helper) showing practices
+    return '{}-{}'.format('-'.join(str(part) for part in tag),
+                          _digest([(practice.id, _practice_state(practice)) for practice in practices]))
+
+
+def _digest(values):
+    return hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def not_modified(etag):
+    # The 304 response if the client already has this version, else None.
+    # Clients send back the ETag of the compressed variant they got.
+    for variant in [etag] + compression_helper.etag_variants(etag):
+        if request.if_none_match.contains(variant):
+            response = current_app.response_class(status=304)
+            response.set_etag(variant)
+            return response
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
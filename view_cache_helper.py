@@ -0,0 +1,151 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+from flask_sqlalchemy import SignallingSession
+from cache_helper import TTLCache
+import replica_helper
+import version_helper
+import invalidation_helper
+import practice_model
+import confirm_notice_model
+import decline_notice_model
+
+# Serialized week and day views of club practices
+practice_views = TTLCache('practice_views',
+                          max_size=int(os.environ.get('PRACTICE_VIEW_CACHE_MAX_SIZE', 2048)),
+                          ttl=int(os.environ.get('PRACTICE_VIEW_CACHE_TTL', 60)))
+
+NOTICE_MODELS = (confirm_notice_model.ConfirmNotice, decline_notice_model.DeclineNotice)
+
+# Bumped on every invalidation. A view loaded while it changed is not stored,
+# as it may have been read before the write committed.
+_generation = [0]
+
+
+"""
+Cache of the serialized practice lists of /club/<id>/practicesbyweek/<week>
+and /club/<id>/practicesbydate/<date>, invalidated on write.
+
+Entries are (ETag, data) pairs, tagged with the club's week or day they show,
+with the club and with each practice in it:
+
+  ('club_week', clubID, ISO year, ISO week)
+  ('club_day', clubID, date)
+  ('club', clubID)
+  ('practice', practiceID)
+
+A session flush collects the tags touched by inserted, updated and deleted
+Practices (including changes of their invites) and notices: a new practice
+or one moved to another time or club touches the week and day it lands in,
+any other change touches its ('practice', id) tag. The entries are dropped
+after the transaction commits, or the tags are forgotten on rollback.
+Writes that bypass the ORM mark their tags with practices_changed() or
+notices_changed() (see Practice.bulk_create in practice_resource and
+rsvp_helper).
+
+Misses are loaded from the primary even in a read_only handler, so an entry
+is never older than the last invalidation. Other workers are told through
+invalidation_helper: a week or day tag becomes ('club', clubID), which drops
+all views of the club there, and practice tags stay as they are.
+"""
+
+
+def week_tag(clubID, startTime):
+    year, week, _ = startTime.isocalendar()
+    return ('club_week', clubID, year, week)
+
+
+def day_tag(clubID, startTime):
+    return ('club_day', clubID, startTime.date())
+
+
+def club_tag(clubID):
+    return ('club', clubID)
+
+
+def practice_tag(practiceID):
+    return ('practice', practiceID)
+
+
+def cached_practices(tag, load, dump):
+    # (ETag, serialized practices) of a week or day view (tag). On a miss,
+    # load() returns the practices and dump(practices) serializes them,
+    # unless the client already has them (If-None-Match): then the data is
+    # None and nothing is serialized or stored.
+    entry = practice_views.get(tag)
+    if entry is not None:
+        return entry
+    generation = _generation[0]
+    with replica_helper.primary():
+        practices = load()
+        etag = version_helper.practices_etag(tag, practices)
+        if version_helper.not_modified(etag) is not None:
+            return etag, None
+        entry = (etag, dump(practices))
+    if generation == _generation[0]:
+        practice_views.set(tag, entry, tags=[tag, club_tag(tag[1])] + [practice_tag(practice.id) for practice in practices])
+    return entry
+
+
+def _pending(session):
+    return session.info.setdefault('view_cache_tags', set())
+
+
+def practices_changed(session, clubID, startTimes):
+    # Marks the week and day views of new practices of a club as changed
+    _pending(session).update(tag for startTime in startTimes
+                             for tag in (week_tag(clubID, startTime), day_tag(clubID, startTime)))
+
+
+def notices_changed(session, practiceIDs):
+    _pending(session).update(practice_tag(practiceID) for practiceID in practiceIDs)
+
+
+def _practice_tags(practice):
+    tags = [practice_tag(practice.id)]
+    club_ids = attributes.get_history(practice, 'club_id')
+    start_times = attributes.get_history(practice, 'startTime')
+    if club_ids.has_changes() or start_times.has_changes():
+        # Inserted or moved: the old week and day are covered by the
+        # practice tag, the new ones are not
+        for clubID in club_ids.added or club_ids.unchanged:
+            for startTime in start_times.added or start_times.unchanged:
+                tags += [week_tag(clubID, startTime), day_tag(clubID, startTime)]
+    return tags
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _collect_tags(session, flush_context):
+    # Runs before the flushed objects are marked clean, so their history still
+    # shows what the flush changed. New objects have their IDs by now.
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, practice_model.Practice):
+            pending.update(_practice_tags(obj))
+        elif isinstance(obj, NOTICE_MODELS):
+            history = attributes.get_history(obj, 'practice_id')
+            pending.update(practice_tag(practiceID) for practiceID in history.sum() if practiceID is not None)
+
+
+def _evict(tag):
+    _generation[0] += 1
+    practice_views.invalidate_tag(tag)
+
+
+invalidation_helper.register('club', lambda clubID: _evict(club_tag(clubID)), caches=(practice_views,))
+invalidation_helper.register('practice', lambda practiceID: _evict(practice_tag(practiceID)))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _invalidate(session):
+    tags = session.info.pop('view_cache_tags', None)
+    if tags:
+        _generation[0] += 1
+        for tag in tags:
+            practice_views.invalidate_tag(tag)
+        invalidation_helper.publish(club_tag(tag[1]) if tag[0] in ('club_week', 'club_day') else tag for tag in tags)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget(session):
+    session.info.pop('view_cache_tags', None)